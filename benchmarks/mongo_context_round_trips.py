@@ -0,0 +1,93 @@
+"""
+Count the MongoDB round trips per turn of MongoContextManager.
+
+Every collection call is counted and delayed by a simulated network latency, so
+    commands: number of requests sent to MongoDB per turn
+    round trips: wall time per turn / latency (requests sent concurrently count once)
+
+Run from the repository root against mongomock (default) or a real server,
+with the package installed (pip install -e .) or from the checkout:
+    PYTHONPATH=src python benchmarks/mongo_context_round_trips.py [--uri mongodb://localhost:27017] [--latency 0.005] [--turns 50]
+"""
+import argparse
+import threading
+import time
+
+from fastbot.dialog.context.mongo import MongoContextManager
+
+
+COMMANDS = ['find_one', 'find_one_and_update', 'insert_one', 'update_one', 'update_many', 'bulk_write', 'aggregate']
+
+
+class CountingCollection:
+    def __init__(self, collection, latency: float, counter: dict):
+        self._collection = collection
+        self._latency = latency
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in COMMANDS:
+            return attr
+
+        def _command(*args, **kwargs):
+            with self._counter['lock']:
+                self._counter['commands'] += 1
+            time.sleep(self._latency)
+            return attr(*args, **kwargs)
+        return _command
+
+
+def run(contexts_col, users_col, latency: float, turns: int):
+    counter = {'commands': 0, 'lock': threading.Lock()}
+    manager = MongoContextManager(
+        contexts_col=CountingCollection(contexts_col, latency, counter),
+        users_col=CountingCollection(users_col, latency, counter),
+        lock_change_stream=False,
+    )
+
+    def _turn(context, i):
+        context.load(message_id=f'message-{i}')
+        context.set_data('node', {'turn': i})
+        context.user_data['last_turn'] = i
+        context.save(message_id=f'message-{i}')
+
+    results = {}
+    # First turn of a new conversation: init + load + save
+    counter['commands'] = 0
+    start = time.time()
+    context = manager.init('user', 'conversation')
+    _turn(context, 0)
+    results['new conversation'] = (counter['commands'], (time.time()-start)/latency)
+
+    # Following turns of the conversation: load + save
+    counter['commands'] = 0
+    start = time.time()
+    for i in range(1, turns+1):
+        _turn(context, i)
+    results['existing conversation'] = (counter['commands']/turns, (time.time()-start)/latency/turns)
+
+    for name, (commands, round_trips) in results.items():
+        print(f'{name:>22}: {commands:.1f} commands/turn, {round_trips:.1f} round trips/turn')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--uri', default=None)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--turns', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.uri:
+        import pymongo
+        db = pymongo.MongoClient(args.uri).get_database('fastbot_benchmark')
+    else:
+        import mongomock
+        db = mongomock.MongoClient().get_database('fastbot_benchmark')
+    db.drop_collection('contexts')
+    db.drop_collection('users')
+    run(db.get_collection('contexts'), db.get_collection('users'), args.latency, args.turns)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@ class Agent:
         test: a function allow for quickly test bot in terminal environment.
         process: take a Message Object or a String and run it through the Interpreter and DialogController
                  Return TurnContext
+        aprocess: async version of process
     """
 
     def __init__(self,
@@ -42,3 +43,10 @@ class Agent:
         self.interpreter.process(message)
         turn_context = self.controller.handle_message(message, turn_data, user_id, conversation_id)
         return turn_context
+
+    async def aprocess(self, message: Union[Message, str], turn_data: Dict[Text, Any] = {}, user_id: str = 'default', conversation_id: str = None) -> TurnContext:
+        if isinstance(message, str):
+            message = Message(message)
+        await self.interpreter.aprocess(message)
+        turn_context = await self.controller.ahandle_message(message, turn_data, user_id, conversation_id)
+        return turn_context
@@ -101,6 +101,21 @@ class ContextManager:
     def update_user_data(self, user_id: Text, data: Dict[Text, Any] = {}) -> None:
         raise NotImplementedError()
 
+    # Async versions of the persistence functions used by DialogController.ahandle_message.
+    # By default they call the synchronous functions, context managers doing I/O
+    # should override them to avoid blocking the event loop.
+    async def ainit(self, user_id: Text = None, conversation_id: Text = None, user_data: Dict[Text, Any] = {}):
+        return self.init(user_id, conversation_id, user_data)
+
+    async def aload(self, **kwargs) -> None:
+        return self.load(**kwargs)
+
+    async def asave(self, **kwargs) -> None:
+        return self.save(**kwargs)
+
+    async def aupdate_user_data(self, user_id: Text, data: Dict[Text, Any] = {}) -> None:
+        return self.update_user_data(user_id, data)
+
     def check_session_timeout(self, timeout_in: float = DEFAULT_SESSION_TIMEOUT) -> None:
         current = time()/3600
         last_message = self.timestamp/3600
@@ -0,0 +1,137 @@
+from . import ContextManager
+from typing import Text, Dict, Any, Optional, Callable, Iterator
+from collections import OrderedDict
+import threading
+import time
+import os
+
+
+CONTEXT_CACHE_SIZE = int(os.getenv('CONTEXT_CACHE_SIZE', 100000))
+
+
+class ContextCache:
+    """
+    Cache of the ContextManager of each user/conversation id,
+    used by DialogController in place of a plain dict.
+
+    - LRU: when the cache is full, the least recently used context is evicted.
+    - idle TTL: a context not used for `idle_timeout` seconds is dropped. The DialogController set it
+        to its session_timeout_duration, after which the context would be restarted anyway.
+
+    Parameters:
+        max_size: maximum number of contexts, None for unbounded
+        idle_timeout: in seconds, None to disable
+        spill: optional function (id, context) -> None, called with the contexts evicted by the LRU
+            while their session is still alive, ex: to persist MemoryContextManager states
+        rehydrate: optional function (id) -> Optional[ContextManager], called on cache miss
+            to bring back a spilled context
+    """
+
+    def __init__(self,
+                 max_size: Optional[int] = CONTEXT_CACHE_SIZE,
+                 idle_timeout: Optional[float] = None,
+                 spill: Optional[Callable[[Text, ContextManager], None]] = None,
+                 rehydrate: Optional[Callable[[Text], Optional[ContextManager]]] = None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.spill = spill
+        self.rehydrate = rehydrate
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.spills = 0
+        self.rehydrations = 0
+
+        # id -> (context, last access time)
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _is_expired(self, last_access: float, now: float) -> bool:
+        return self.idle_timeout is not None and now - last_access > self.idle_timeout
+
+    def _expire(self, now: float):
+        # Entries are ordered by last access, expired entries are always at the beginning
+        while self._entries:
+            _id, (_, last_access) = next(iter(self._entries.items()))
+            if not self._is_expired(last_access, now):
+                break
+            del self._entries[_id]
+            self.expirations += 1
+
+    def _evict(self):
+        while self.max_size is not None and len(self._entries) > self.max_size:
+            _id, (context, _) = self._entries.popitem(last=False)
+            self.evictions += 1
+            if self.spill:
+                self.spill(_id, context)
+                self.spills += 1
+
+    def get(self, _id: Text, default: Any = None) -> Optional[ContextManager]:
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(_id)
+            if entry is not None:
+                self._entries[_id] = (entry[0], now)
+                self._entries.move_to_end(_id)
+                self.hits += 1
+                return entry[0]
+
+            self.misses += 1
+            if self.rehydrate:
+                context = self.rehydrate(_id)
+                if context is not None:
+                    self.rehydrations += 1
+                    self._entries[_id] = (context, now)
+                    self._evict()
+                    return context
+        return default
+
+    def __getitem__(self, _id: Text) -> ContextManager:
+        context = self.get(_id)
+        if context is None:
+            raise KeyError(_id)
+        return context
+
+    def __setitem__(self, _id: Text, context: ContextManager):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._entries[_id] = (context, now)
+            self._entries.move_to_end(_id)
+            self._evict()
+
+    def __delitem__(self, _id: Text):
+        with self._lock:
+            del self._entries[_id]
+
+    def __contains__(self, _id: Text) -> bool:
+        with self._lock:
+            return _id in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __iter__(self) -> Iterator[Text]:
+        with self._lock:
+            return iter(list(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[Text, Any]:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'spills': self.spills,
+                'rehydrations': self.rehydrations,
+            }
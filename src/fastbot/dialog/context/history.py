@@ -0,0 +1,63 @@
+from fastbot.models import Step
+from typing import Text, Dict, Any, Union, List, Tuple
+import sys
+import os
+
+
+# Number of steps kept in the conversation history, 0 for no limit (default).
+# Policies only read the last `max_history` steps
+CONTEXT_HISTORY_SIZE = int(os.getenv('CONTEXT_HISTORY_SIZE', 0))
+
+# Maximum number of decoded states kept in `_states`. A bot only has a few hundred states,
+# hashes past the limit (ex: states removed from the bot but still in stored contexts)
+# are decoded without being kept
+CONTEXT_STATES_SIZE = int(os.getenv('CONTEXT_STATES_SIZE', 10000))
+
+# state hash -> (type, name)
+_states: Dict[Text, Tuple[Text, Text]] = {}
+
+
+def _state(step_hash: Text) -> Tuple[Text, Text]:
+    state = _states.get(step_hash)
+    if state is None:
+        step_type, _, name = step_hash.partition('__')
+        if len(_states) >= CONTEXT_STATES_SIZE:
+            return step_type, name
+        state = (sys.intern(step_type), sys.intern(name))
+        _states[sys.intern(step_hash)] = state
+    return state
+
+
+def encode_step(step: Step) -> Union[Text, List]:
+    """
+    Compact encoding of a step: the state hash (ex: 'intent__greet') if the step has no payload,
+    [hash, payload] otherwise.
+    """
+    if step.data:
+        return [step.hash, step.data]
+    return step.hash
+
+
+def decode_step(value: Union[Text, List, Dict[Text, Any]]) -> Step:
+    """
+    Reverse of `encode_step`. Also accept the output of `Step.to_dict()`
+    """
+    if isinstance(value, dict):
+        return Step(**value)
+
+    if isinstance(value, str):
+        step_hash, payload = value, {}
+    else:
+        step_hash, payload = value
+    step_type, name = _state(step_hash)
+    if step_type == 'intent':
+        return Step(intent=name, **payload)
+    return Step(action=name, **payload)
+
+
+def encode_history(history: List[Step]) -> List[Union[Text, List]]:
+    return [encode_step(step) for step in history]
+
+
+def decode_history(history: List[Union[Text, List, Dict[Text, Any]]]) -> List[Step]:
+    return [decode_step(value) for value in history]
@@ -0,0 +1,114 @@
+from typing import Text, Any, Optional, Dict, Set
+from random import random
+import threading
+import asyncio
+import logging
+import os
+
+
+log = logging.getLogger(__name__)
+
+# Backoff (in seconds) between two lock attempts when no notification is received
+CONTEXT_LOCK_BACKOFF_BASE = float(os.getenv('CONTEXT_LOCK_BACKOFF_BASE', 0.02))
+CONTEXT_LOCK_BACKOFF_MAX = float(os.getenv('CONTEXT_LOCK_BACKOFF_MAX', 0.5))
+
+
+def backoff(attempt: int, base: float = CONTEXT_LOCK_BACKOFF_BASE, maximum: float = CONTEXT_LOCK_BACKOFF_MAX) -> float:
+    """
+    Exponential backoff with jitter: a random value between half and all of min(maximum, base*2^attempt)
+    """
+    delay = min(maximum, base * 2 ** attempt)
+    return delay / 2 + random() * delay / 2
+
+
+class _Waiter:
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def notify(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._set_future)
+
+    def _set_future(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+    def wait(self, timeout: float) -> bool:
+        return self.event.wait(timeout)
+
+    async def await_(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(asyncio.shield(self.future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class LockNotifier:
+    """
+    Wake up the waiters of a context lock when the lock is released.
+
+    Releases made in this process notify the waiters directly. Releases made by other processes
+    are received through a MongoDB change stream on the contexts collection, when available
+    (replica set or sharded cluster). Otherwise waiters retry after an exponential backoff.
+
+    A waiter must be registered before its lock attempt, so a release happening between
+    a failed attempt and the wait is not missed.
+    """
+
+    def __init__(self, contexts_col: Any = None, change_stream: bool = True):
+        self.contexts_col = contexts_col
+        self.change_stream = change_stream and contexts_col is not None
+        self._waiters: Dict[Text, Set[_Waiter]] = {}
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def register(self, _id: Text, loop: Optional[asyncio.AbstractEventLoop] = None) -> _Waiter:
+        self._ensure_watcher()
+        waiter = _Waiter(loop)
+        with self._lock:
+            self._waiters.setdefault(_id, set()).add(waiter)
+        return waiter
+
+    def unregister(self, _id: Text, waiter: _Waiter):
+        with self._lock:
+            waiters = self._waiters.get(_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[_id]
+
+    def notify(self, _id: Text):
+        with self._lock:
+            waiters = list(self._waiters.get(_id, []))
+        for waiter in waiters:
+            waiter.notify()
+
+    def _ensure_watcher(self):
+        # The change stream is only opened once there is contention
+        if not self.change_stream or self._watcher is not None:
+            return
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, daemon=True)
+                self._watcher.start()
+
+    def _watch(self):
+        pipeline = [{'$match': {
+            'operationType': 'update',
+            'updateDescription.updatedFields.lockOwner': {'$type': 'null'},
+        }}]
+        try:
+            with self.contexts_col.watch(pipeline) as stream:
+                for change in stream:
+                    self.notify(change['documentKey']['_id'])
+        except Exception as e:
+            # ex: standalone server, change streams are not supported
+            log.info(f'Context lock change stream unavailable, fallback to backoff: {e}')
+            self.change_stream = False
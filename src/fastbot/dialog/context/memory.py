@@ -1,14 +1,41 @@
 from typing import Text, List, Dict, Any, Union, Callable
 from fastbot.models import Message, Response, Step
+from collections import deque
 from . import ContextManager, TurnContext
+from .history import CONTEXT_HISTORY_SIZE, encode_history, decode_history
 from ..utils import create_user_conversation_id
 
 
+NODE_FIELDS = ['node_params', 'node_results', 'node_status', 'node_data']
+STATE_FIELDS = ['callstack', 'history'] + NODE_FIELDS
+
+
 class MemoryContextManager(ContextManager):
+    """
+    Keep the conversation state in memory.
+
+    Changes made since the last `clear_changes()` are tracked, so persistent context managers
+    can write only the changed parts of the state:
+        - changed_fields: fields that must be rewritten entirely (callstack, or every field after a restart)
+        - changed_keys: {(field, node_name): True if set, False if removed} of the node_* fields
+        - new_history: steps appended to the history
+
+    Values returned by get_params, get_result and get_data can be modified in place by the nodes,
+    so reading a mutable value also marks it as changed.
+
+    The history is a ring buffer of the last `history_size` steps (0 or None for no limit, the default).
+    Steps dropped from the buffer are given to `history_sink(context, steps)` if provided,
+    ex: to archive the full conversations. With `history_payload=False` only the states
+    (intent/action names) are kept, without the message and node status.
+    """
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.history_size = kwargs.get('history_size', CONTEXT_HISTORY_SIZE)
+        self.history_sink = kwargs.get('history_sink')
+        self.history_payload = kwargs.get('history_payload', True)
         self.callstack = []
-        self.history = []
+        self.history = self._make_history()
         self.node_results = {}
         self.node_params = {}
         self.node_status = {}
@@ -16,6 +43,25 @@ class MemoryContextManager(ContextManager):
 
         self.user_data = {}
         self._user_data_manager = {}
+        self.clear_changes()
+
+    def clear_changes(self):
+        self.changed_fields = set()
+        self.changed_keys = {}
+        self.new_history = []
+
+    def _mark(self, field: Text, node_name: Text, is_set: bool = True):
+        if field not in self.changed_fields:
+            self.changed_keys[(field, node_name)] = is_set
+
+    def _make_history(self, steps: List[Step] = []):
+        return deque(steps, maxlen=self.history_size or None)
+
+    def _get(self, field: Text, node_name: Text, default: Any):
+        value = getattr(self, field).get(node_name, default)
+        if isinstance(value, (dict, list)) and node_name in getattr(self, field):
+            self._mark(field, node_name)
+        return value
 
     def init(self, user_id: Text, conversation_id: Text = None, user_data: Dict[Text, Any] = {}):
         assert isinstance(user_data, dict), 'user_data must be a json-serializable python dictionary'
@@ -30,42 +76,56 @@ class MemoryContextManager(ContextManager):
             user_id=user_id,
             conversation_id=conversation_id,
             response_function=self.response_function,
+            history_size=self.history_size,
+            history_sink=self.history_sink,
+            history_payload=self.history_payload,
         )
         ctx.user_data = self._user_data_manager[user_id]
         return ctx
 
     def set_params(self, node_name: Text, value: Any):
         self.node_params[node_name] = value
+        self._mark('node_params', node_name)
 
     def set_result(self, node_name: Text, value: Any):
         self.node_results[node_name] = value
+        self._mark('node_results', node_name)
 
     def set_status(self, node_name: Text, value: int):
         self.node_status[node_name] = value
+        self._mark('node_status', node_name)
 
     def set_data(self, node_name: Text, value: Any):
         self.node_data[node_name] = value
+        self._mark('node_data', node_name)
 
     def set_callstack(self, node_name: Union[Text, List[Text]]):
         if isinstance(node_name, List):
             self.callstack.extend(node_name)
         else:
             self.callstack.append(node_name)
+        self.changed_fields.add('callstack')
 
     def set_history(self, step: Step):
+        if not self.history_payload and step.data:
+            step = Step(intent=step.intent, action=step.action)
+        if self.history_sink and len(self.history) == self.history.maxlen:
+            self.history_sink(self, [self.history[0]])
         self.history.append(step)
+        if 'history' not in self.changed_fields:
+            self.new_history.append(step)
 
     def get_params(self, node_name: Text, default: Any = None):
-        return self.node_params.get(node_name, default)
+        return self._get('node_params', node_name, default)
 
     def get_result(self, node_name: Text, default: Any = None):
-        return self.node_results.get(node_name, default)
+        return self._get('node_results', node_name, default)
 
     def get_status(self, node_name: Text, default: Any = None):
         return self.node_status.get(node_name, default)
 
     def get_data(self, node_name: Text, default: Any = {}):
-        return self.node_data.get(node_name, default)
+        return self._get('node_data', node_name, default)
 
     def get_history(self):
         return self.history
@@ -79,26 +139,32 @@ class MemoryContextManager(ContextManager):
                 result = self.node_results.get(state.action)
                 if delete:
                     self.node_results.pop(state.action)
+                    self._mark('node_results', state.action, False)
                 return result
         return None
 
     def pop_callstack(self):
+        self.changed_fields.add('callstack')
         return self.callstack.pop()
 
     def restart(self, user_data=False):
         self.callstack = []
-        self.history = []
+        self.history = self._make_history()
         self.node_results = {}
         self.node_params = {}
         self.node_status = {}
         self.node_data = {}
         if user_data:
             self.user_data = {}
+        self.clear_changes()
+        self.changed_fields.update(STATE_FIELDS)
 
     def reset_node(self, node_name: Text):
-        self.node_data.pop(node_name, None)
-        self.node_results.pop(node_name, None)
-        self.node_status.pop(node_name, None)
+        for field in ['node_data', 'node_results', 'node_status']:
+            values = getattr(self, field)
+            if node_name in values:
+                values.pop(node_name)
+                self._mark(field, node_name, False)
 
     def load(self, **kwargs):
         pass
@@ -109,7 +175,7 @@ class MemoryContextManager(ContextManager):
     def to_dict(self):
         return {
             'callstack': self.callstack,
-            'history': [step.to_dict() for step in self.history],
+            'history': encode_history(self.history),
             'node_params': self.node_params,
             'node_results': self.node_results,
             'node_data': self.node_data,
@@ -117,6 +183,20 @@ class MemoryContextManager(ContextManager):
             'timestamp': self.timestamp,
         }
 
+    def restore(self, data: Dict[Text, Any]):
+        """
+        Restore the state from the output of `to_dict`
+        ex: rehydrate a context spilled by the DialogController's context cache
+        """
+        self.callstack = data.get('callstack', [])
+        self.history = self._make_history(decode_history(data.get('history', [])))
+        self.node_params = data.get('node_params', {})
+        self.node_results = data.get('node_results', {})
+        self.node_data = data.get('node_data', {})
+        self.node_status = data.get('node_status', {})
+        self.timestamp = data.get('timestamp', self.timestamp)
+        self.clear_changes()
+
     def update_user_data(self, user_id: Text, data: Dict[Text, Any] = {}):
         assert isinstance(data, dict), 'user_data must be a json-serializable python dictionary'
 
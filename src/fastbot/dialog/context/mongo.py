@@ -1,12 +1,19 @@
 from . import TurnContext
 from .memory import MemoryContextManager
+from .lock import LockNotifier, backoff
+from .history import encode_history, decode_history
+from .write_behind import WriteBehindQueue, CONTEXT_FLUSH_INTERVAL, CONTEXT_FLUSH_SIZE
 from fastbot.models import Message
-from fastbot.schema.policy_data import StepSchema
-from typing import Text, Dict, Any, Union, List
+from fastbot.utils.aio import run_in_thread
+from typing import Text, Dict, Any, Union, List, Tuple
 from time import time, sleep
 from uuid import uuid4
-from pymongo import ReturnDocument
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from concurrent.futures import ThreadPoolExecutor
 from random import random
+import threading
+import asyncio
 import json
 import pymongo
 import os
@@ -16,6 +23,25 @@ DB_NAME = 'fastbot'
 CONTEXT_COLLECTION_NAME = 'contexts'
 USERDATA_COLLECTION_NAME = 'users'
 MONGO_CONTEXT_LOCK_TIMEOUT = os.getenv('MONGO_CONTEXT_LOCK_TIMEOUT', 10)
+# notify: wait for the release notification (see LockNotifier) with exponential backoff as fallback
+# poll: retry every 50ms ~ 300ms
+MONGO_CONTEXT_LOCK_MODE = os.getenv('MONGO_CONTEXT_LOCK_MODE', 'notify')
+MONGO_CONTEXT_IO_THREADS = int(os.getenv('MONGO_CONTEXT_IO_THREADS', 8))
+MONGO_CONTEXT_WRITE_BEHIND = os.getenv('MONGO_CONTEXT_WRITE_BEHIND', 'false').lower() == 'true'
+
+# Send the context and the user data requests of a turn concurrently,
+# the threads are created on the first use
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _io_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(MONGO_CONTEXT_IO_THREADS, thread_name_prefix='fastbot-mongo')
+    return _executor
 
 
 class MongoContextManager(MemoryContextManager):
@@ -33,6 +59,20 @@ class MongoContextManager(MemoryContextManager):
     - user_data is not lock, to allow for multiple bot can access the same user data at the sametime.
         Therefore it is possible to override users' data accidently!
 
+    - load sends the locking `find_one_and_update` of the context and the `find_one` of the user data
+        concurrently: 2 commands, 1 round trip when the lock is free. save sends its 2 updates concurrently.
+        User data can not come with the lock in a single command: it is shared by the conversations
+        of a user so it is not embedded in the context document, and `$lookup` can not be part of an update.
+
+    - lock_mode='notify' (default): a waiter block until the lock is released (LockNotifier) instead of
+        polling. lock_mode='poll': retry every 50ms ~ 300ms.
+        In both modes the lock is given to the waiters in the order of the lockQueue.
+
+    - write_behind=True: save() only queues the context, the pending saves are coalesced per conversation
+        and written with bulk_write by a background thread (see WriteBehindQueue), the lock is released
+        by the write. The next message of a conversation with a pending save continues from the in-memory
+        context and keeps the lock, without reading the database.
+        A context is lost if the process is killed before its save is written.
     """
 
     def __init__(self, uri: Text = None, **kwargs):
@@ -48,6 +88,20 @@ class MongoContextManager(MemoryContextManager):
         assert self.contexts_col, "No Mongo contexts collection reference!"
         assert self.users_col, "No Mongo users collection reference"
         self.timeout_after = kwargs.get('timeout_after', MONGO_CONTEXT_LOCK_TIMEOUT)
+        self.lock_mode = kwargs.get('lock_mode', MONGO_CONTEXT_LOCK_MODE)
+        self.lock_notifier = kwargs.get('lock_notifier')
+        if self.lock_notifier is None:
+            self.lock_notifier = LockNotifier(self.contexts_col, change_stream=kwargs.get('lock_change_stream', True))
+        self.write_behind = kwargs.get('write_behind', MONGO_CONTEXT_WRITE_BEHIND)
+        self.write_queue = kwargs.get('write_queue')
+        if self.write_behind and self.write_queue is None:
+            self.write_queue = WriteBehindQueue(
+                self._bulk_save,
+                interval=kwargs.get('flush_interval', CONTEXT_FLUSH_INTERVAL),
+                max_size=kwargs.get('flush_size', CONTEXT_FLUSH_SIZE))
+        # message_id holding the lock of the context in the database and when the lock expires
+        self.lock_owner = None
+        self.lock_expires = 0
 
     def init(self, user_id: Text = None, conversation_id: Text = None, user_data: Dict[Text, Any] = {}):
         ctx = self.__class__(
@@ -58,98 +112,259 @@ class MongoContextManager(MemoryContextManager):
             user_data=user_data,
             response_function=self.response_function,
             timeout_after=self.timeout_after,
+            lock_mode=self.lock_mode,
+            lock_notifier=self.lock_notifier,
+            write_behind=self.write_behind,
+            write_queue=self.write_queue,
+            history_size=self.history_size,
+            history_sink=self.history_sink,
+            history_payload=self.history_payload,
         )
-        exist = ctx.contexts_col.find_one({'_id': ctx._id})
-        if not exist:
-            ctx.contexts_col.insert_one({
-                '_id': ctx._id,
-                'data': ctx.to_dict(),
-                'lockQueue': [],
-                'lockTimeout': 0,
-                'lockOwner': None,
-            })
-
-        exist = ctx.users_col.find_one({'_id': user_id})
-        if not exist:
-            ctx.users_col.insert_one({'_id': user_id, 'data': ctx.user_data})
-
+        # The context and user documents are created by the first load/save (upsert)
         return ctx
 
     def update_user_data(self, user_id: Text, data: Dict[Text, Any] = {}):
         assert isinstance(data, dict), 'user_data must be a json-serializable python dictionary'
 
-        exist = self.users_col.find_one({'_id': user_id})
-        if not exist:
-            self.users_col.insert_one({'_id': user_id, 'data': data})
+        if data:
+            update = {'$set': {f'data.{key}': val for key, val in data.items()}}
         else:
-            user_data = self.users_col.find_one({'_id': self.user_id}).get('data', {})
-            user_data.update(data)
-            self.users_col.update_one({'_id': user_id}, {'$set': {'data': user_data}})
+            update = {'$setOnInsert': {'data': {}}}
+        self.users_col.update_one({'_id': user_id}, update, upsert=True)
 
-    def get_context_and_lock(self, message_id: str):
-        # Try to acquire the lock
-        context_data = self.contexts_col.find_one_and_update(
-            {'_id': self._id, '$or': [
-                {'$or': [
-                    {'$and': [
-                        {'lockQueue.0': message_id},
-                        {'lockOwner': None}]},
-                    {'$and': [
-                        {'lockQueue': {'$size': 0}},
-                        {'lockOwner': None}]}]},
-                {'lockTimeout': {'$lt': time()}}]},
-            {'$set': {'lockTimeout': time()+self.timeout_after, 'lockOwner': message_id}, '$pull': {'lockQueue': message_id}},
-            return_document=ReturnDocument.AFTER)
-
-        # Add instanceId to queue for lock fairness
-        if context_data is None:
-            self.contexts_col.find_one_and_update({'_id': self._id}, {'$push': {'lockQueue': message_id}})
-
-        # Retry acquire the lock after a random amount of time to avoid split brain
-        # where two instance try to acquire the lock at the sametime therefor both fail
-        while context_data is None:
-            wait = 0.05+random()/4  # wait between 50ms ~ 300ms before try again
-            sleep(wait)
-            context_data = self.contexts_col.find_one_and_update(
+    def _try_lock(self, message_id: Text, upsert: bool = False):
+        """
+        Try to acquire the lock, return the context document if succeed.
+        With `upsert=True` the context document is created if it does not exist yet.
+        """
+        update = {'$set': {'lockTimeout': time()+self.timeout_after, 'lockOwner': message_id}, '$pull': {'lockQueue': message_id}}
+        if upsert:
+            update['$setOnInsert'] = {'data': self.to_dict()}
+        try:
+            return self.contexts_col.find_one_and_update(
                 {'_id': self._id, '$or': [
                     {'$or': [
                         {'$and': [
                             {'lockQueue.0': message_id},
                             {'lockOwner': None}]},
                         {'$and': [
-                            {'lockQueue': {'$size': 0}},
+                            # empty or not created yet
+                            {'lockQueue.0': {'$exists': False}},
                             {'lockOwner': None}]}]},
                     {'lockTimeout': {'$lt': time()}}]},
-                {'$set': {'lockTimeout': time()+self.timeout_after, 'lockOwner': message_id}, '$pull': {'lockQueue': message_id}},
-                return_document=ReturnDocument.AFTER)
+                update,
+                return_document=ReturnDocument.AFTER,
+                upsert=upsert)
+        except DuplicateKeyError:
+            # The document exists but the lock is held by another message
+            return None
+
+    def _enqueue_lock(self, message_id: Text):
+        self.contexts_col.update_one({'_id': self._id}, {'$push': {'lockQueue': message_id}})
+
+    def get_context_and_lock(self, message_id: str, attempted: bool = False):
+        """
+        Parameters:
+            attempted: the caller already made a first (failed) `_try_lock(message_id, upsert=True)`
+        """
+        # Try to acquire the lock
+        context_data = None if attempted else self._try_lock(message_id, upsert=True)
+
+        # Add instanceId to queue for lock fairness
+        if context_data is None:
+            self._enqueue_lock(message_id)
+
+        if self.lock_mode == 'poll':
+            # Retry acquire the lock after a random amount of time to avoid split brain
+            # where two instance try to acquire the lock at the sametime therefor both fail
+            while context_data is None:
+                wait = 0.05+random()/4  # wait between 50ms ~ 300ms before try again
+                sleep(wait)
+                context_data = self._try_lock(message_id)
+        else:
+            attempt = 0
+            while context_data is None:
+                waiter = self.lock_notifier.register(self._id)
+                try:
+                    context_data = self._try_lock(message_id)
+                    if context_data is None:
+                        waiter.wait(backoff(attempt))
+                finally:
+                    self.lock_notifier.unregister(self._id, waiter)
+                attempt += 1
 
         return context_data.get('data', {})
 
-    def load(self, message_id: Text):
-        context_data = self.get_context_and_lock(message_id)
+    async def aget_context_and_lock(self, message_id: str, attempted: bool = False):
+        """
+        Same as `get_context_and_lock`, wait for the lock without blocking the event loop
+        """
+        context_data = None if attempted else await run_in_thread(self._try_lock, message_id, True)
+        if context_data is None:
+            await run_in_thread(self._enqueue_lock, message_id)
+
+        attempt = 0
+        while context_data is None:
+            if self.lock_mode == 'poll':
+                await asyncio.sleep(0.05+random()/4)
+                context_data = await run_in_thread(self._try_lock, message_id)
+                continue
+
+            waiter = self.lock_notifier.register(self._id, asyncio.get_running_loop())
+            try:
+                context_data = await run_in_thread(self._try_lock, message_id)
+                if context_data is None:
+                    await waiter.await_(backoff(attempt))
+            finally:
+                self.lock_notifier.unregister(self._id, waiter)
+            attempt += 1
+
+        return context_data.get('data', {})
+
+    def _set_context_data(self, context_data: Dict[Text, Any], user_data: Dict[Text, Any], message_id: Text):
+        self.lock_owner = message_id
+        self.lock_expires = time()+self.timeout_after
         self.callstack = context_data.get('callstack', [])
         self.node_params = context_data.get('node_params', {})
         self.node_results = context_data.get('node_results', {})
         self.node_data = context_data.get('node_data', {})
         self.node_status = context_data.get('node_status', {})
-        self.timestamp = context_data.get('time_stamp', time())
+        self.timestamp = context_data.get('timestamp', time())
 
-        user_data = self.users_col.find_one({'_id': self.user_id}).get('data', {})
         self.user_data = user_data
 
         history = context_data.get('history', [])
-        self.history = StepSchema(many=True).load(history)
+        self.history = self._make_history(decode_history(history))
+        self.clear_changes()
 
-    def save(self, message_id: Text):
-        dump = self.to_dict()
-        self.contexts_col.update_one(
-            {'_id': self._id, 'lockOwner': message_id},
-            {'$set': {
-                'data': dump,
-                'lockTimeout': time()+self.timeout_after,
-                'lockOwner': None,
-            }}
-        )
-        update_userdata = {f'data.{key}': val for key, val in self.user_data.items()}
+    def _find_user_data(self):
+        user = self.users_col.find_one({'_id': self.user_id})
+        return user.get('data', {}) if user else {}
+
+    def _take_pending(self) -> bool:
+        """
+        Return True if the context has a pending save (write-behind) and continue from it:
+        the in-memory state is up to date and the lock is still held.
+        The pending save is written right away if it belongs to another instance
+        or its lock is about to expire.
+        """
+        if self.write_queue is None:
+            return False
+        entry = self.write_queue.take(self._id)
+        if entry is None:
+            return False
+        if entry[0] is self and time() < self.lock_expires-self.timeout_after/2:
+            return True
+        self.write_queue.write([entry])
+        return False
+
+    def load(self, message_id: Text):
+        if self._take_pending():
+            return
+        # The first lock attempt and the user data are requested concurrently.
+        # If the lock is not acquired right away, user data is read again once the lock is acquired
+        first_attempt = _io_executor().submit(self._try_lock, message_id, True)
+        user_data = self._find_user_data()
+        first_attempt = first_attempt.result()
+        if first_attempt is not None:
+            context_data = first_attempt.get('data', {})
+        else:
+            context_data = self.get_context_and_lock(message_id, attempted=True)
+            user_data = self._find_user_data()
+        self._set_context_data(context_data, user_data, message_id)
+
+    async def aload(self, message_id: Text):
+        if self.write_queue is not None and await run_in_thread(self._take_pending):
+            return
+        first_attempt, user_data = await asyncio.gather(
+            run_in_thread(self._try_lock, message_id, True),
+            run_in_thread(self._find_user_data))
+        if first_attempt is not None:
+            context_data = first_attempt.get('data', {})
+        else:
+            context_data = await self.aget_context_and_lock(message_id, attempted=True)
+            user_data = await run_in_thread(self._find_user_data)
+        self._set_context_data(context_data, user_data, message_id)
+
+    def _user_data_update(self) -> Dict[Text, Any]:
+        return {f'data.{key}': val for key, val in self.user_data.items()}
+
+    def _save_user_data(self):
+        update_userdata = self._user_data_update()
         if update_userdata:
-            self.users_col.update_one({'_id': self.user_id}, {'$set': update_userdata})
+            self.users_col.update_one({'_id': self.user_id}, {'$set': update_userdata}, upsert=True)
+
+    def _context_update(self) -> Dict[Text, Any]:
+        """
+        Build the update of the context document from the changes tracked since load:
+        only the changed nodes are $set/$unset and the new steps are $push to the history.
+        A field is rewritten entirely if it was reset (restart) or one of its keys
+        can not be used in a dotted path.
+        """
+        rewrite = set(self.changed_fields)
+        for field, key in self.changed_keys:
+            if not isinstance(key, str) or not key or '.' in key or key.startswith('$'):
+                rewrite.add(field)
+
+        set_data = {'lockTimeout': time()+self.timeout_after, 'lockOwner': None, 'data.timestamp': self.timestamp}
+        unset_data = {}
+        for field in rewrite:
+            if field == 'history':
+                set_data['data.history'] = encode_history(self.history)
+            else:
+                set_data[f'data.{field}'] = getattr(self, field)
+
+        for (field, key), is_set in self.changed_keys.items():
+            if field in rewrite:
+                continue
+            if is_set:
+                set_data[f'data.{field}.{key}'] = getattr(self, field)[key]
+            else:
+                unset_data[f'data.{field}.{key}'] = ''
+
+        update = {'$set': set_data}
+        if unset_data:
+            update['$unset'] = unset_data
+        if self.new_history and 'history' not in rewrite:
+            push = {'$each': encode_history(self.new_history)}
+            if self.history_size:
+                push['$slice'] = -self.history_size
+            update['$push'] = {'data.history': push}
+        return update
+
+    def _bulk_save(self, entries: List[Tuple['MongoContextManager', Text]]):
+        """
+        Write the pending saves of the WriteBehindQueue and release their locks
+        """
+        contexts = []
+        users = []
+        for context, lock_owner in entries:
+            contexts.append(UpdateOne({'_id': context._id, 'lockOwner': lock_owner}, context._context_update()))
+            update_userdata = context._user_data_update()
+            if update_userdata:
+                users.append(UpdateOne({'_id': context.user_id}, {'$set': update_userdata}, upsert=True))
+
+        user_write = _io_executor().submit(self.users_col.bulk_write, users, ordered=False) if users else None
+        self.contexts_col.bulk_write(contexts, ordered=False)
+        for context, _ in entries:
+            context.clear_changes()
+            self.lock_notifier.notify(context._id)
+        if user_write is not None:
+            user_write.result()
+
+    def save(self, message_id: Text):
+        if self.write_queue is not None:
+            self.write_queue.put(self._id, self, self.lock_owner or message_id)
+            return
+        # Context and user data are written concurrently
+        user_write = _io_executor().submit(self._save_user_data)
+        self.contexts_col.update_one({'_id': self._id, 'lockOwner': message_id}, self._context_update())
+        self.clear_changes()
+        self.lock_notifier.notify(self._id)
+        user_write.result()
+
+    async def asave(self, message_id: Text):
+        await run_in_thread(self.save, message_id)
+
+    async def aupdate_user_data(self, user_id: Text, data: Dict[Text, Any] = {}):
+        await run_in_thread(self.update_user_data, user_id, data)
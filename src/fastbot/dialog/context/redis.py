@@ -0,0 +1,156 @@
+from .memory import MemoryContextManager
+from .lock import backoff
+from fastbot.constants import DEFAULT_SESSION_TIMEOUT
+from fastbot.utils.aio import run_in_thread
+from typing import Text, Dict, Any
+from time import sleep
+import logging
+import json
+import os
+
+
+log = logging.getLogger(__name__)
+
+
+REDIS_CONTEXT_PREFIX = os.getenv('REDIS_CONTEXT_PREFIX', 'fastbot:')
+REDIS_CONTEXT_LOCK_TIMEOUT = float(os.getenv('REDIS_CONTEXT_LOCK_TIMEOUT', 10))
+
+
+def import_redis():
+    try:
+        import redis
+    except:
+        raise ModuleNotFoundError('redis is soft-required module for RedisContextManager. Please install it seperately.')
+    return redis
+
+
+class RedisContextManager(MemoryContextManager):
+    """
+    Extend of MemoryContextManager with a Redis (or any server speaking the Redis protocol) as persistence layer.
+    call load() when start handle the message and save() at the end when all
+    actions are executed.
+
+    - context_data (nodes' data, history, callstack) is a json string stored at `<prefix>context:<id>`
+        and locked per message_id with `SET <prefix>lock:<id> <message_id> NX PX <lock_timeout>`.
+        The lock is not fair, a waiter retry with exponential backoff until the lock is released or expired.
+
+    - the session timeout is the TTL of the context key: the context of a conversation without message
+        for `session_timeout` hours expires by itself and `check_session_timeout` does nothing.
+
+    - user_data is a hash at `<prefix>user:<user_id>` (one json encoded value per key), it is not lock.
+
+    Pass `client` to use an existing client (ex: fakeredis for testing) instead of connect to `uri`.
+    """
+
+    def __init__(self, uri: Text = None, **kwargs):
+        super().__init__(**kwargs)
+        self.client = kwargs.get('client')
+        if self.client is None:
+            assert uri, "No Redis uri or client!"
+            self.client = import_redis().Redis.from_url(uri)
+        self.prefix = kwargs.get('prefix', REDIS_CONTEXT_PREFIX)
+        self.timeout_after = kwargs.get('timeout_after', REDIS_CONTEXT_LOCK_TIMEOUT)
+        self.session_timeout = kwargs.get('session_timeout', DEFAULT_SESSION_TIMEOUT)
+
+    def init(self, user_id: Text = None, conversation_id: Text = None, user_data: Dict[Text, Any] = {}):
+        ctx = self.__class__(
+            client=self.client,
+            user_id=user_id,
+            conversation_id=conversation_id,
+            response_function=self.response_function,
+            prefix=self.prefix,
+            timeout_after=self.timeout_after,
+            session_timeout=self.session_timeout,
+            history_size=self.history_size,
+            history_sink=self.history_sink,
+            history_payload=self.history_payload,
+        )
+        return ctx
+
+    @property
+    def context_key(self):
+        return f'{self.prefix}context:{self._id}'
+
+    @property
+    def lock_key(self):
+        return f'{self.prefix}lock:{self._id}'
+
+    def user_key(self, user_id: Text):
+        return f'{self.prefix}user:{user_id}'
+
+    def check_session_timeout(self, timeout_in: float = DEFAULT_SESSION_TIMEOUT) -> None:
+        # An expired session has no context key, the state is already empty after load()
+        self.session_timeout = timeout_in
+
+    def update_user_data(self, user_id: Text, data: Dict[Text, Any] = {}):
+        assert isinstance(data, dict), 'user_data must be a json-serializable python dictionary'
+
+        if data:
+            self.client.hset(self.user_key(user_id), mapping={key: json.dumps(val) for key, val in data.items()})
+
+    def _try_lock_and_get(self, message_id: Text):
+        """
+        Try to acquire the lock and read the context and the user data in one round trip.
+        Return (context_data, user_data) if the lock is acquired, None otherwise.
+        The reads are in the same MULTI/EXEC as the lock, no other save can run between them.
+        """
+        pipe = self.client.pipeline(transaction=True)
+        pipe.set(self.lock_key, message_id, nx=True, px=int(self.timeout_after*1000))
+        pipe.get(self.context_key)
+        pipe.hgetall(self.user_key(self.user_id))
+        locked, context_data, user_data = pipe.execute()
+        if not locked:
+            return None
+        context_data = json.loads(context_data) if context_data else {}
+        user_data = {self._decode(key): json.loads(val) for key, val in user_data.items()}
+        return context_data, user_data
+
+    @staticmethod
+    def _decode(value):
+        return value.decode() if isinstance(value, bytes) else value
+
+    def _set_context_data(self, context_data: Dict[Text, Any], user_data: Dict[Text, Any]):
+        self.restore(context_data)
+        self.user_data = user_data
+
+    def load(self, message_id: Text):
+        attempt = 0
+        result = self._try_lock_and_get(message_id)
+        while result is None:
+            sleep(backoff(attempt))
+            attempt += 1
+            result = self._try_lock_and_get(message_id)
+        self._set_context_data(*result)
+
+    def save(self, message_id: Text):
+        """
+        Write the context (with the session timeout as TTL) and the user data then release the lock,
+        only if the lock is still owned by `message_id` (same as MongoContextManager, nothing is written
+        if the lock has expired and been acquired by another message).
+        """
+        context_data = json.dumps(self.to_dict())
+        user_data = {key: json.dumps(val) for key, val in self.user_data.items()}
+        session_ttl = int(self.session_timeout*3600*1000)
+
+        def write(pipe):
+            owner = pipe.get(self.lock_key)
+            if self._decode(owner) != message_id:
+                log.warning(f'Lock of {self._id} is not owned by {message_id} anymore, context is not saved')
+                return
+            pipe.multi()
+            pipe.set(self.context_key, context_data, px=session_ttl)
+            if user_data:
+                pipe.hset(self.user_key(self.user_id), mapping=user_data)
+            pipe.delete(self.lock_key)
+
+        self.client.transaction(write, self.lock_key)
+        self.clear_changes()
+
+    async def aload(self, message_id: Text):
+        await run_in_thread(self.load, message_id)
+
+    async def asave(self, message_id: Text):
+        await run_in_thread(self.save, message_id)
+
+    async def aupdate_user_data(self, user_id: Text, data: Dict[Text, Any] = {}):
+        await run_in_thread(self.update_user_data, user_id, data)
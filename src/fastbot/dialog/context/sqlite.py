@@ -0,0 +1,217 @@
+from .memory import MemoryContextManager
+from .lock import LockNotifier, backoff
+from fastbot.utils.aio import run_in_thread
+from typing import Text, Dict, Any, Optional, Tuple, List
+from contextlib import contextmanager
+from time import time
+import threading
+import sqlite3
+import json
+import os
+
+
+SQLITE_CONTEXT_LOCK_TIMEOUT = float(os.getenv('SQLITE_CONTEXT_LOCK_TIMEOUT', 10))
+# How long (ms) a connection waits for the database write lock held by another process
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))
+
+CREATE_TABLES = [
+    'CREATE TABLE IF NOT EXISTS contexts (id TEXT PRIMARY KEY, data TEXT, lock_owner TEXT, lock_timeout REAL NOT NULL DEFAULT 0)',
+    'CREATE TABLE IF NOT EXISTS users (id TEXT NOT NULL, key TEXT NOT NULL, value TEXT, PRIMARY KEY (id, key))',
+]
+# Acquire the lock of a conversation, the row is created if it does not exist yet.
+# No row is changed if the lock is held by another message and not expired
+LOCK_CONTEXT = '''
+    INSERT INTO contexts (id, lock_owner, lock_timeout) VALUES (?, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET lock_owner = excluded.lock_owner, lock_timeout = excluded.lock_timeout
+    WHERE lock_owner IS NULL OR lock_timeout < ?
+'''
+SELECT_CONTEXT = 'SELECT data FROM contexts WHERE id = ?'
+SAVE_CONTEXT = 'UPDATE contexts SET data = ?, lock_owner = NULL, lock_timeout = 0 WHERE id = ? AND lock_owner = ?'
+SELECT_USER = 'SELECT key, value FROM users WHERE id = ?'
+SAVE_USER = 'INSERT OR REPLACE INTO users (id, key, value) VALUES (?, ?, ?)'
+
+
+class SqliteStore:
+    """
+    Connections to a SQLite database file in WAL mode, one connection per thread.
+    Statements are cached (prepared once) per connection by the sqlite3 module.
+
+    Writes made with `write` by concurrent threads are committed together (group commit):
+    a writer finding no write in progress commits its statements and the ones queued
+    meanwhile by the other threads in one transaction.
+    """
+
+    def __init__(self, path: Text):
+        assert path != ':memory:', 'SqliteStore needs a database file, each connection to :memory: is a different database'
+        self.path = path
+        self._local = threading.local()
+        self._queue = []
+        self._queue_lock = threading.Lock()
+        self._writing = False
+        self.commits = 0
+        with self.transaction() as conn:
+            for statement in CREATE_TABLES:
+                conn.execute(statement)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # autocommit mode, transactions are started explicitly by `transaction()`
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT/1000, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # In WAL mode, commits are only fsync-ed at checkpoints
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Write transaction, the database write lock is taken at the beginning
+        so the transaction can not fail midway because of another writer
+        """
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        self.commits += 1
+
+    def write(self, statements: List[Tuple[Text, List[Tuple]]]):
+        """
+        Run the statements ([(sql, [parameters, ...]), ...]) in a write transaction,
+        batched with the writes of the other threads. Return when they are committed.
+        """
+        entry = [statements, threading.Event(), None]
+        with self._queue_lock:
+            self._queue.append(entry)
+            leader = not self._writing
+            self._writing = True
+        if leader:
+            while True:
+                with self._queue_lock:
+                    batch, self._queue = self._queue, []
+                    if not batch:
+                        self._writing = False
+                        break
+                self._write_batch(batch)
+        else:
+            entry[1].wait()
+        if entry[2] is not None:
+            raise entry[2]
+
+    def _write_batch(self, batch: List[List]):
+        try:
+            with self.transaction() as conn:
+                for statements, _, _ in batch:
+                    for sql, parameters in statements:
+                        conn.executemany(sql, parameters)
+        except Exception as e:
+            if len(batch) > 1:
+                # Retry one write at a time, a write only fails because of its own statements
+                for entry in batch:
+                    self._write_batch([entry])
+                return
+            batch[0][2] = e
+        for _, done, _ in batch:
+            done.set()
+
+
+class SqliteContextManager(MemoryContextManager):
+    """
+    Extend of MemoryContextManager with a SQLite database file as persistence layer,
+    for single node deployments. Same contract as MongoContextManager:
+    call load(message_id) when start handle the message and save(message_id) at the end when all
+    actions are executed.
+
+    - context_data (nodes' data, history, callstack) is a json row locked per message_id (per conversation).
+        The lock is taken and the context and user data are read in one transaction.
+        Waiters in the same process are woken up when the lock is released (LockNotifier),
+        waiters in other processes retry with exponential backoff.
+
+    - user_data is stored as one row per key and is not lock.
+    """
+
+    def __init__(self, path: Text = None, **kwargs):
+        super().__init__(**kwargs)
+        self.store = kwargs.get('store')
+        if self.store is None:
+            assert path, "No SQLite database path!"
+            self.store = SqliteStore(path)
+        self.timeout_after = kwargs.get('timeout_after', SQLITE_CONTEXT_LOCK_TIMEOUT)
+        self.lock_notifier = kwargs.get('lock_notifier') or LockNotifier()
+
+    def init(self, user_id: Text = None, conversation_id: Text = None, user_data: Dict[Text, Any] = {}):
+        ctx = self.__class__(
+            store=self.store,
+            user_id=user_id,
+            conversation_id=conversation_id,
+            response_function=self.response_function,
+            timeout_after=self.timeout_after,
+            lock_notifier=self.lock_notifier,
+            history_size=self.history_size,
+            history_sink=self.history_sink,
+            history_payload=self.history_payload,
+        )
+        return ctx
+
+    def update_user_data(self, user_id: Text, data: Dict[Text, Any] = {}):
+        assert isinstance(data, dict), 'user_data must be a json-serializable python dictionary'
+
+        if data:
+            self.store.write([(SAVE_USER, [(user_id, key, json.dumps(val)) for key, val in data.items()])])
+
+    def _try_lock(self, message_id: Text) -> Optional[Tuple[Dict[Text, Any], Dict[Text, Any]]]:
+        """
+        Try to acquire the lock, return (context_data, user_data) if succeed
+        """
+        now = time()
+        with self.store.transaction() as conn:
+            if conn.execute(LOCK_CONTEXT, (self._id, message_id, now+self.timeout_after, now)).rowcount == 0:
+                return None
+            context_data = conn.execute(SELECT_CONTEXT, (self._id,)).fetchone()[0]
+            user_data = conn.execute(SELECT_USER, (self.user_id,)).fetchall()
+        context_data = json.loads(context_data) if context_data else {}
+        user_data = {key: json.loads(value) for key, value in user_data}
+        return context_data, user_data
+
+    def _set_context_data(self, context_data: Dict[Text, Any], user_data: Dict[Text, Any]):
+        self.restore(context_data)
+        self.user_data = user_data
+
+    def load(self, message_id: Text):
+        attempt = 0
+        result = None
+        while result is None:
+            waiter = self.lock_notifier.register(self._id)
+            try:
+                result = self._try_lock(message_id)
+                if result is None:
+                    waiter.wait(backoff(attempt))
+            finally:
+                self.lock_notifier.unregister(self._id, waiter)
+            attempt += 1
+        self._set_context_data(*result)
+
+    def save(self, message_id: Text):
+        # The context, the user data and the lock release are committed together,
+        # in the same transaction as the saves of the other threads
+        statements = [(SAVE_CONTEXT, [(json.dumps(self.to_dict()), self._id, message_id)])]
+        user_data = [(self.user_id, key, json.dumps(val)) for key, val in self.user_data.items()]
+        if user_data:
+            statements.append((SAVE_USER, user_data))
+        self.store.write(statements)
+        self.clear_changes()
+        self.lock_notifier.notify(self._id)
+
+    async def aload(self, message_id: Text):
+        await run_in_thread(self.load, message_id)
+
+    async def asave(self, message_id: Text):
+        await run_in_thread(self.save, message_id)
+
+    async def aupdate_user_data(self, user_id: Text, data: Dict[Text, Any] = {}):
+        await run_in_thread(self.update_user_data, user_id, data)
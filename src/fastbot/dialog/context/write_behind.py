@@ -0,0 +1,157 @@
+from typing import Text, Any, Dict, List, Tuple, Callable, Optional
+import threading
+import logging
+import weakref
+import atexit
+import os
+
+
+log = logging.getLogger(__name__)
+
+# Pending saves are flushed every CONTEXT_FLUSH_INTERVAL seconds
+# or as soon as CONTEXT_FLUSH_SIZE conversations are pending
+CONTEXT_FLUSH_INTERVAL = float(os.getenv('CONTEXT_FLUSH_INTERVAL', 0.05))
+CONTEXT_FLUSH_SIZE = int(os.getenv('CONTEXT_FLUSH_SIZE', 500))
+# A pending save failing CONTEXT_FLUSH_RETRIES times in a row is dropped,
+# its lock is then released by the lock timeout
+CONTEXT_FLUSH_RETRIES = int(os.getenv('CONTEXT_FLUSH_RETRIES', 3))
+
+# Queues flushed at exit, a queue is removed by close()
+_queues = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_all():
+    for queue in list(_queues):
+        queue.flush()
+
+
+class WriteBehindQueue:
+    """
+    Pending context saves, coalesced per conversation id and written in bulk by a background thread.
+
+    An entry is (context, lock_owner): the context manager to write and the message_id holding
+    its lock in the database. The context is only read when the entry is written,
+    so saving the same conversation several times before a flush results in one write.
+
+    A context manager loading a conversation must `take()` its pending entry first,
+    the entry is then either continued in memory or written right away with `write()`.
+
+    A failed write is retried by the next flushes, up to `max_retries` times, then the entries are dropped
+    (logged) and their locks are left to expire. Pending saves are flushed at exit, until `close()`.
+
+    Parameters:
+        writer: function writing a list of entries, must release their locks
+    """
+
+    def __init__(self, writer: Callable[[List[Tuple[Any, Text]]], None], **kwargs):
+        self.writer = writer
+        self.interval = kwargs.get('interval', CONTEXT_FLUSH_INTERVAL)
+        self.max_size = kwargs.get('max_size', CONTEXT_FLUSH_SIZE)
+        self.max_retries = kwargs.get('max_retries', CONTEXT_FLUSH_RETRIES)
+        self._pending: Dict[Text, Tuple[Any, Text]] = {}
+        # id -> number of failed writes of the pending entry
+        self._failures: Dict[Text, int] = {}
+        # ids of the conversations being written by flush()
+        self._writing = set()
+        self._lock = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = None
+        self._closed = False
+        self.writes = 0
+        self.coalesced = 0
+        self.dropped = 0
+        _queues.add(self)
+
+    def put(self, _id: Text, context: Any, lock_owner: Text):
+        with self._lock:
+            assert not self._closed, 'WriteBehindQueue is closed'
+            self._pending[_id] = (context, lock_owner)
+            self._failures.pop(_id, None)
+            size = len(self._pending)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+        if size >= self.max_size:
+            self._wakeup.set()
+
+    def take(self, _id: Text) -> Optional[Tuple[Any, Text]]:
+        """
+        Remove and return the pending entry of a conversation, if any.
+        If the entry is being written, wait until the write is done and return None.
+        """
+        with self._lock:
+            entry = self._pending.pop(_id, None)
+            while entry is None and _id in self._writing:
+                self._lock.wait()
+                # A failed write puts the entry back
+                entry = self._pending.pop(_id, None)
+            self._failures.pop(_id, None)
+        if entry is not None:
+            self.coalesced += 1
+        return entry
+
+    def write(self, entries: List[Tuple[Any, Text]]):
+        self.writer(entries)
+        self.writes += 1
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                entries = list(self._pending.items())
+                self._pending = {}
+                self._writing = {_id for _id, _ in entries}
+            try:
+                if entries:
+                    self.write([entry for _, entry in entries])
+            except Exception as e:
+                log.error(f'Failed to write {len(entries)} contexts: {e}')
+                # Keep the failed entries unless a newer save of the same conversation is pending
+                with self._lock:
+                    for _id, entry in entries:
+                        if _id in self._pending:
+                            continue
+                        failures = self._failures.get(_id, 0) + 1
+                        if failures > self.max_retries:
+                            log.error(f'Context {_id} is dropped after {failures} failed writes')
+                            self._failures.pop(_id, None)
+                            self.dropped += 1
+                            continue
+                        self._pending[_id] = entry
+                        self._failures[_id] = failures
+            else:
+                with self._lock:
+                    for _id, _ in entries:
+                        self._failures.pop(_id, None)
+            finally:
+                with self._lock:
+                    self._writing = set()
+                    self._lock.notify_all()
+
+    def close(self):
+        """
+        Stop the background thread and write the pending saves
+        """
+        with self._lock:
+            self._closed = True
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.join()
+        self.flush()
+        _queues.discard(self)
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'writes': self.writes,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+            }
@@ -1,4 +1,6 @@
 from .context import ContextManager, TurnContext
+from .context.memory import MemoryContextManager
+from .context.cache import ContextCache, CONTEXT_CACHE_SIZE
 from .nodes.base import BaseNode
 from .nodes.status import NodeStatus
 from .policies import ActionPolicy
@@ -9,21 +11,45 @@ from fastbot.constants import SHORT_CIRCUIT
 from typing import Text, List, Dict, Any, Union, Optional
 from copy import deepcopy
 from .utils import create_user_conversation_id
+import weakref
+import asyncio
 
 
 class DialogController:
+    """
+    Contexts of the users/conversations are kept in a ContextCache, dropped after
+    `session_timeout_duration` without message.
+    `context_spill` and `context_rehydrate` are the optional hooks to persist
+    and bring back the contexts evicted from the cache (see ContextCache).
+
+    The cache is bounded by `context_cache_size` (default CONTEXT_CACHE_SIZE) only if an evicted context
+    is not lost: with a persistent context type (reloaded from its store on the next message)
+    or a `context_spill` hook. Otherwise (MemoryContextManager without spill) it is unbounded
+    unless `context_cache_size` is given.
+    """
+
     def __init__(self, context_type: ContextManager,
                  session_timeout_duration: float = DEFAULT_SESSION_TIMEOUT,
-                 action_policy: Optional[ActionPolicy] = None):
+                 action_policy: Optional[ActionPolicy] = None,
+                 **kwargs):
 
         self._context_type = context_type
 
         self.nodes = {}
         self.intent_triggers = {}
-        self.context_managers = {}
+        in_memory = type(context_type) in (ContextManager, MemoryContextManager)
+        default_cache_size = None if in_memory and not kwargs.get('context_spill') else CONTEXT_CACHE_SIZE
+        self.context_managers = ContextCache(
+            max_size=kwargs.get('context_cache_size', default_cache_size),
+            idle_timeout=session_timeout_duration*3600,  # session timeout is in hours
+            spill=kwargs.get('context_spill'),
+            rehydrate=kwargs.get('context_rehydrate'),
+        )
         self.fallback_node = None
         self.action_policy = action_policy
         self.session_timeout_duration = session_timeout_duration
+        # Serialize the messages of a conversation handled by ahandle_message
+        self._conversation_locks = weakref.WeakValueDictionary()
 
     def add_node(self, node: BaseNode) -> None:
         self.nodes[node.name] = node
@@ -47,9 +73,18 @@ class DialogController:
             self.context_managers[_id] = self._context_type.init(user_id, conversation_id)
         return self.context_managers[_id]
 
+    async def aget_user_context(self, user_id: Text, conversation_id: Text) -> ContextManager:
+        _id = create_user_conversation_id(user_id, conversation_id)
+        if not self.context_managers.get(_id):
+            self.context_managers[_id] = await self._context_type.ainit(user_id, conversation_id)
+        return self.context_managers[_id]
+
     def update_user_data(self, user_id: Text, data: Dict[Text, Any] = {}) -> None:
         self._context_type.update_user_data(user_id, data)
 
+    async def aupdate_user_data(self, user_id: Text, data: Dict[Text, Any] = {}) -> None:
+        await self._context_type.aupdate_user_data(user_id, data)
+
     def find_next_node(self, message: Message, context: ContextManager):
         node = self.intent_triggers.get(message.intent)
         if node:
@@ -65,9 +100,11 @@ class DialogController:
 
         return None
 
-    def handle_message(self, message: Message, turn_data: Dict[Text, Any] = {}, user_id: Text = 'default', conversation_id: Text = None) -> TurnContext:
-        user_context = self.get_user_context(user_id, conversation_id)
-        user_context.load(message_id=message.id)
+    def _start_turn(self, user_context: ContextManager, message: Message, turn_data: Dict[Text, Any]) -> bool:
+        """
+        Prepare the context for a new message.
+        Return False if there is no node to run
+        """
         user_context.create_turn_context(message, turn_data)
         user_context.check_session_timeout(self.session_timeout_duration)
         user_context.update_session_timestamp()
@@ -79,29 +116,82 @@ class DialogController:
             if node:
                 user_context.set_callstack(node)
             else:
-                return
+                return False
+        return True
+
+    def _short_circuit(self, user_context: ContextManager) -> None:
+        user_context.add_response(Response(f'Exceed {SHORT_CIRCUIT} steps without listening. Short Circuit!!!'))
+        user_context.restart()
+
+    def _end_step(self, user_context: ContextManager, action_name: Text, result) -> bool:
+        """
+        Update the context with the result of a node.
+        Return True if the controller should continue to run the next node in the callstack
+        """
+        if result.next:
+            user_context.set_callstack(result.next)
+
+        user_context.set_status(action_name, result.status)
+        if result.status == NodeStatus.WAITING:
+            return False
+        elif result.status == NodeStatus.RESTART:
+            user_context.restart()
+            return False
+        return True
+
+    def handle_message(self, message: Message, turn_data: Dict[Text, Any] = {}, user_id: Text = 'default', conversation_id: Text = None) -> TurnContext:
+        user_context = self.get_user_context(user_id, conversation_id)
+        user_context.load(message_id=message.id)
+        if not self._start_turn(user_context, message, turn_data):
+            return
+
         step = 1
         while not user_context.is_done():
             if step > SHORT_CIRCUIT:
-                user_context.add_response(Response(f'Exceed {SHORT_CIRCUIT} steps without listening. Short Circuit!!!'))
-                user_context.restart()
+                self._short_circuit(user_context)
                 break
 
             action_name = user_context.pop_callstack()
             action = self.nodes[action_name]
             result = action.run(user_context)
-            if result.next:
-                user_context.set_callstack(result.next)
-
             step += 1
+            if not self._end_step(user_context, action_name, result):
+                break
+        user_context.save(message_id=message.id)
+        return user_context.turn_context
+
+    async def ahandle_message(self, message: Message, turn_data: Dict[Text, Any] = {}, user_id: Text = 'default', conversation_id: Text = None) -> TurnContext:
+        """
+        Async version of `handle_message`, node hooks defined as coroutines are awaited
+        and the context is loaded/saved with the context manager's async functions.
+        Messages of the same conversation are handled one at a time.
+        """
+        _id = create_user_conversation_id(user_id, conversation_id)
+        lock = self._conversation_locks.get(_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._conversation_locks[_id] = lock
+
+        async with lock:
+            return await self._ahandle_message(message, turn_data, user_id, conversation_id)
 
-            user_context.set_status(action_name, result.status)
-            if result.status == NodeStatus.DONE:
-                continue
-            elif result.status == NodeStatus.WAITING:
+    async def _ahandle_message(self, message: Message, turn_data: Dict[Text, Any], user_id: Text, conversation_id: Text) -> TurnContext:
+        user_context = await self.aget_user_context(user_id, conversation_id)
+        await user_context.aload(message_id=message.id)
+        if not self._start_turn(user_context, message, turn_data):
+            return
+
+        step = 1
+        while not user_context.is_done():
+            if step > SHORT_CIRCUIT:
+                self._short_circuit(user_context)
                 break
-            elif result.status == NodeStatus.RESTART:
-                user_context.restart()
+
+            action_name = user_context.pop_callstack()
+            action = self.nodes[action_name]
+            result = await action.arun(user_context)
+            step += 1
+            if not self._end_step(user_context, action_name, result):
                 break
-        user_context.save(message_id=message.id)
+        await user_context.asave(message_id=message.id)
         return user_context.turn_context
@@ -55,7 +55,14 @@ class DialogControlBuilder:
         entities = dialog_config.get("entities", {})
         fallback_node_config = dialog_config.get("fallback")
 
-        dialog_controller = DialogController(self.context)
+        controller_kwargs = {}
+        if 'context_cache_size' in config:
+            controller_kwargs['context_cache_size'] = config['context_cache_size']
+        for hook in ['context_spill', 'context_rehydrate']:
+            if config.get(hook):
+                controller_kwargs[hook] = import_from_path(config[hook])
+
+        dialog_controller = DialogController(self.context, **controller_kwargs)
 
         for node_config in nodes:
             if node_config['type'] == InputsCollector.__name__:
@@ -3,9 +3,16 @@ from typing import Text, List, Dict, Any, Callable, Union
 from fastbot.models import Message, Step
 from fastbot.dialog.context import ContextManager
 from .status import NodeStatus, NodeResult
+from fastbot.utils.aio import maybe_await, run_sync
 
 
 class BaseNode():
+    """
+    `on_enter`, `on_message` and `on_exit` can be defined as coroutines (async def).
+    They are awaited by `arun` (used by DialogController.ahandle_message)
+    and run to completion by `run` when there is no running event loop.
+    """
+
     def __init__(self, name: Text, **kwargs):
         self.name = name
         self.type = self.__class__.__name__
@@ -43,24 +50,57 @@ class BaseNode():
         """
         pass
 
-    def run(self, context: ContextManager) -> NodeResult:
+    async def aon_message(self, context: ContextManager) -> NodeResult:
+        """
+        `on_message` used by `arun`, override it when the node has
+        an async alternative for the blocking work of `on_message`
+        """
+        return await maybe_await(self.on_message(context))
 
+    def _begin(self, context: ContextManager) -> bool:
         status = context.get_status(self.name)
         if not status or status in [NodeStatus.READY, NodeStatus.DONE]:
             context.set_status(self.name, NodeStatus.BEGIN)
-            enter_result = self.on_enter(context)  # pylint: disable=assignment-from-no-return
+            return True
+        return False
+
+    def _end(self, context: ContextManager, result: NodeResult, action: bool = True) -> NodeResult:
+        # Results of on_enter/on_exit are recorded as `intent__<node>` steps (first argument of Step),
+        # on_message as `action__<node>`. The state hashes are used by the trained policies
+        if action:
+            context.set_history(Step(action=self.name, status=result.status))
+        else:
+            context.set_history(Step(self.name, status=result.status))
+        return result
+
+    def run(self, context: ContextManager) -> NodeResult:
+        if self._begin(context):
+            enter_result = run_sync(self.on_enter(context))  # pylint: disable=assignment-from-no-return
+            if enter_result:
+                return self._end(context, enter_result, action=False)
+
+        message_result = run_sync(self.on_message(context))
+
+        if message_result.status == NodeStatus.DONE:
+            exit_result = run_sync(self.on_exit(context))  # pylint: disable=assignment-from-no-return
+            context.set_status(self.name, NodeStatus.READY)
+            if exit_result:
+                return self._end(context, exit_result, action=False)
+
+        return self._end(context, message_result)
+
+    async def arun(self, context: ContextManager) -> NodeResult:
+        if self._begin(context):
+            enter_result = await maybe_await(self.on_enter(context))
             if enter_result:
-                context.set_history(Step(self.name, status=enter_result.status))
-                return enter_result
+                return self._end(context, enter_result, action=False)
 
-        message_result = self.on_message(context)
+        message_result = await self.aon_message(context)
 
         if message_result.status == NodeStatus.DONE:
-            exit_result = self.on_exit(context)  # pylint: disable=assignment-from-no-return
+            exit_result = await maybe_await(self.on_exit(context))
             context.set_status(self.name, NodeStatus.READY)
             if exit_result:
-                context.set_history(Step(self.name, status=exit_result.status))
-                return exit_result
+                return self._end(context, exit_result, action=False)
 
-        context.set_history(Step(action=self.name, status=message_result.status))
-        return message_result
+        return self._end(context, message_result)
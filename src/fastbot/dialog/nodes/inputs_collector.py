@@ -65,7 +65,7 @@ class InputsCollector(BaseNode):
 
         context.set_data(self.name, node_state)
 
-    def on_message(self, context: ContextManager) -> NodeResult:
+    def _escape(self, context: ContextManager) -> Optional[NodeResult]:
         message_intent = context.turn_context.message.intent
         node_state = context.get_data(self.name)
         node_state[PROMPT] = True
@@ -80,10 +80,10 @@ class InputsCollector(BaseNode):
                 if isinstance(next_node, str):
                     next_node = [next_node]
                 return NodeResult(NodeStatus.ESCAPE, [self.name, *next_node])
+        return None
 
-        if self.entity_extractors:
-            self.entity_extractors.process(context.turn_context.message)
-
+    def _collect(self, context: ContextManager) -> NodeResult:
+        node_state = context.get_data(self.name)
         collected_inputs = self._fill_inputs(context)
         missing_input = self._get_missing_input(collected_inputs, context)
         if not missing_input:
@@ -100,6 +100,30 @@ class InputsCollector(BaseNode):
 
             return NodeResult(NodeStatus.WAITING, self.name)
 
+    def on_message(self, context: ContextManager) -> NodeResult:
+        escape_result = self._escape(context)
+        if escape_result:
+            return escape_result
+
+        if self.entity_extractors:
+            self.entity_extractors.process(context.turn_context.message)
+
+        return self._collect(context)
+
+    async def aon_message(self, context: ContextManager) -> NodeResult:
+        # Subclass overriding `on_message` keep its own implementation
+        if type(self).on_message is not InputsCollector.on_message:
+            return await super().aon_message(context)
+
+        escape_result = self._escape(context)
+        if escape_result:
+            return escape_result
+
+        if self.entity_extractors:
+            await self.entity_extractors.aprocess(context.turn_context.message)
+
+        return self._collect(context)
+
     def on_exit(self, context: ContextManager) -> None:
         node_state = context.get_data(self.name)
         node_state = {}
@@ -4,6 +4,7 @@ from .policy_result import PolicyResult
 from fastbot.dialog.policies.sklearn import SklearnPolicy
 from fastbot.dialog.context import ContextManager
 from fastbot.models import PolicyData, Step, Message
+from fastbot.utils.tflite import TFLiteSessionPool, TFLITE_POOL_SIZE
 from typing import List, Text, Tuple, Dict, Any
 import numpy as np
 import json
@@ -107,14 +108,7 @@ class KerasPolicy(ActionPolicy):
         return PolicyResult(action, actions)
 
     def tflite_predict(self, x: np.ndarray):
-        x = np.float32(x)
-        input_detail = self.model.get_input_details()[0]
-        output_detail = self.model.get_output_details()[0]
-        self.model.allocate_tensors()
-        self.model.set_tensor(input_detail['index'], x)
-        self.model.invoke()
-        output = self.model.get_tensor(output_detail['index'])
-        return output
+        return self.model.predict(x)
 
     def process(self, message: Message, context: ContextManager) -> PolicyResult:
         vec = self._history_from_context(context)
@@ -162,15 +156,8 @@ class KerasPolicy(ActionPolicy):
             fp.write(tflite_model)
 
     @classmethod
-    def load(cls, path: Text):
-        try:
-            import tflite_runtime.interpreter as tflite
-        except:
-            raise ModuleNotFoundError("""
-            tflite_runtime module is soft-required for load keras model for inference. Please install it seperately.
-            Visit `https://www.tensorflow.org/lite/guide/python` for guide on how to install appropriate
-                tflite_runtime package for your OS and python's version. 
-                    """)
+    def load(cls, path: Text, **kwargs):
+        pool_size = kwargs.get('tflite_pool_size', TFLITE_POOL_SIZE)
 
         with open(f'{path}/metadata.json', 'r') as fp:
             metadata = json.load(fp)
@@ -183,7 +170,7 @@ class KerasPolicy(ActionPolicy):
         component.action2idx = metadata['action2idx']
         component.idx2action = {idx: action for action, idx in component.action2idx.items()}
         component.max_history = metadata['max_history']
-        component.model = tflite.Interpreter(f'{path}/{cls.__name__}.tflite')
+        component.model = TFLiteSessionPool(f'{path}/{cls.__name__}.tflite', pool_size)
         component._model_mode = INFERENCING
 
         return component
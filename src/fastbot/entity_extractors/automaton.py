@@ -0,0 +1,85 @@
+from typing import Text, List, Dict, Iterator, Tuple
+from collections import deque
+import unicodedata
+
+
+def is_word_char(char: Text) -> bool:
+    """
+    Same definition of a word character as `\\w` of the `regex` module
+    """
+    return char == '_' or char.isalnum() or unicodedata.category(char) in ('Mn', 'Mc', 'Me', 'Pc')
+
+
+def is_word_boundary(text: Text, index: int) -> bool:
+    """
+    Same as `\\b` at position `index` of `text`
+    """
+    before = index > 0 and is_word_char(text[index-1])
+    after = index < len(text) and is_word_char(text[index])
+    return before != after
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton. Build once from a list of keywords then find all
+    occurrences of every keyword in a single pass over the text.
+    """
+
+    def __init__(self, keywords: List[Text]):
+        self.keywords = keywords
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for i, keyword in enumerate(keywords):
+            if keyword:
+                self._add(keyword, i)
+        self._build_fail_links()
+
+    def _add(self, keyword: Text, index: int):
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append(index)
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                # A node also matches every keyword of its longest proper suffix
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def iter(self, text: Text) -> Iterator[Tuple[int, int, int]]:
+        """
+        Yield (start, end, keyword_index) of every occurrence, ordered by end position
+        """
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for index in self._output[node]:
+                yield i + 1 - len(self.keywords[index]), i + 1, index
+
+    def find_all(self, text: Text) -> Dict[int, List[Tuple[int, int]]]:
+        """
+        Return the (start, end) occurrences of each keyword found in the text,
+        ordered by position
+        """
+        occurrences = {}
+        for start, end, index in self.iter(text):
+            occurrences.setdefault(index, []).append((start, end))
+        return occurrences
@@ -10,3 +10,10 @@ class Extractor:
 
     def process(self, message: Message):
         raise NotImplementedError()
+
+    async def aprocess(self, message: Message):
+        """
+        Async version of `process`. Extractors doing I/O should override it,
+        by default it runs `process` directly on the event loop.
+        """
+        return self.process(message)
@@ -2,9 +2,162 @@ from .base import Extractor
 from .constants import ENTITY_PREFIX
 from fastbot.models import Message, Entity
 from fastbot.models.entity import CompositeEntityConfig
-from typing import Any, Dict, List, Text, Union
+from typing import Any, Dict, List, Text, Union, Set, FrozenSet, Tuple, Optional
+from bisect import bisect_left, bisect_right
 import itertools
+import logging
 import re
+import os
+
+
+log = logging.getLogger(__name__)
+
+
+QUANTIFIERS = ('*', '+', '?', '{')
+# Maximum number of states of the search deciding if a match is blocked by previous matches
+COMPOSITE_MAX_SEARCH_STATES = int(os.getenv('COMPOSITE_MAX_SEARCH_STATES', 10000))
+
+
+class SearchLimitExceeded(Exception):
+    pass
+
+
+def chain_bounds(text: Text, entities: List[Entity]) -> List[Tuple[int, int, int]]:
+    """
+    For each entity of `entities` (sorted by start), where the raw text around it can stop in a permutation:
+    (prefix_start, next_start_bound, suffix_end)
+
+    - next_start_bound: an entity can only follow this one if it starts before the end of the first entity
+        starting after this one, otherwise there is always an entity between them in any permutation
+    - suffix_end: raw text after this entity stop at the start of the next entity in the permutation,
+        which can be as far as the last entity starting before next_start_bound
+    - prefix_start: same for the raw text before this entity
+    """
+    n_entities = len(entities)
+    starts = [e.start for e in entities]
+    # min end of entities[k:]
+    suffix_min_end = [len(text)]*(n_entities+1)
+    for k in range(n_entities-1, -1, -1):
+        suffix_min_end[k] = min(suffix_min_end[k+1], entities[k].end)
+    by_end = sorted(entities, key=lambda e: e.end)
+    ends = [e.end for e in by_end]
+    # max start of by_end[:k]
+    prefix_max_start = [0]*(n_entities+1)
+    for k, e in enumerate(by_end):
+        prefix_max_start[k+1] = max(prefix_max_start[k], e.start)
+
+    bounds = []
+    for entity in entities:
+        after = bisect_right(starts, entity.end)
+        next_bound = suffix_min_end[after]
+        last = bisect_right(starts, next_bound)-1
+        suffix_end = starts[last] if last >= after else len(text)
+
+        before = bisect_left(ends, entity.start)
+        previous_bound = prefix_max_start[before]
+        first = bisect_left(ends, previous_bound)
+        prefix_start = ends[first] if first < before else 0
+        bounds.append((prefix_start, next_bound, suffix_end))
+    return bounds
+
+
+def _has_top_level_alternation(pattern: Text) -> bool:
+    depth = 0
+    in_class = False
+    escaped = False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return True
+    return False
+
+
+class CompositePattern:
+    """
+    A composite pattern precompiled as a sequence of entity placeholders
+    and the regex fragments between them:
+
+        '@number @color @car_make' -> ['', ' ', ' ', ''] + ['number', 'color', 'car_make']
+
+    A match is a chain of non-overlapping entities with the placeholders' types,
+    where the raw text between two consecutive entities fullmatch the fragment between
+    their placeholders.
+
+    Patterns where a placeholder is inside a group, followed by a quantifier or
+    part of an alternation cannot be split (is_simple = False).
+    """
+
+    def __init__(self, pattern: Text):
+        self.pattern = pattern
+        regex_pattern, self.mapping_dict = CompositeEntitiesExtractor._seperate_key_pattern(pattern)
+
+        parts = re.split(fr'{ENTITY_PREFIX}([\w_]+)', regex_pattern)
+        fragments = parts[0::2]
+        self.entity_types = parts[1::2]
+
+        self.is_simple = bool(self.entity_types)
+        for i, fragment in enumerate(fragments):
+            if i > 0 and fragment.startswith(QUANTIFIERS):
+                self.is_simple = False
+            if _has_top_level_alternation(fragment):
+                self.is_simple = False
+        try:
+            self.fragments = [re.compile(fragment) for fragment in fragments]
+            self.prefix = re.compile(fr'(?:{fragments[0]})\Z')
+        except re.error:
+            self.is_simple = False
+
+    def find_chains(self, text: Text, entities: List[Entity],
+                    bounds: Optional[List[Tuple[int, int, int]]] = None) -> List[List[int]]:
+        """
+        Find all the chains of entities (indices of `entities`, sorted by start) matching the pattern.
+        Chains are ordered by position.
+        `bounds` is the output of chain_bounds(text, entities), shared by the patterns.
+        """
+        chains = []
+        n_entities = len(entities)
+        if bounds is None:
+            bounds = chain_bounds(text, entities)
+
+        def _extend(chain: List[int]):
+            last = entities[chain[-1]]
+            _, bound, suffix_end = bounds[chain[-1]]
+            j = len(chain)
+            if j == len(self.entity_types):
+                if self.fragments[-1].match(text, last.end, suffix_end):
+                    chains.append(list(chain))
+                return
+
+            for i in range(chain[-1]+1, n_entities):
+                entity = entities[i]
+                if entity.start > bound:
+                    break
+                if entity.start <= last.end or entity.entity != self.entity_types[j]:
+                    continue
+                if not self.fragments[j].fullmatch(text, last.end, entity.start):
+                    continue
+                chain.append(i)
+                _extend(chain)
+                chain.pop()
+
+        for i, entity in enumerate(entities):
+            if entity.entity != self.entity_types[0]:
+                continue
+            if not self.prefix.search(text, bounds[i][0], entity.start):
+                continue
+            _extend([i])
+        return chains
 
 
 class CompositeEntitiesExtractor(Extractor):
@@ -13,6 +166,16 @@ class CompositeEntitiesExtractor(Extractor):
     a single entity by using pattern.
     It will remove all the sub-entities from message output after that.
     Ex: car = '@number @color @car_make @car_model ' -> '2018 red toyota camry'
+
+    Patterns are precompiled once. Matches are found as chains of entities over the
+    entity spans instead of enumerating every non-overlapping permutation of the entities.
+    Patterns are applied longest first, a match is dropped when it shares an entity with
+    accepted matches that can not be avoided (every non-overlapping permutation containing
+    the match also contains one of them).
+
+    Extractors with patterns that cannot be split into placeholders and fragments
+    (see CompositePattern) fall back to the permutation search, as well as the inputs
+    where deciding if a match is blocked takes more than `max_search_states` states.
     """
 
     name = 'CompositeEntitiesExtractor'
@@ -27,8 +190,119 @@ class CompositeEntitiesExtractor(Extractor):
         self.entity_name = entity_config.name
         self.patterns = entity_config.patterns
 
+        # Sort patterns (longest pattern first) as longer patterns might
+        # contain more information
+        self.compiled_patterns = [CompositePattern(pattern) for pattern in sorted(self.patterns, key=len, reverse=True)]
+        self.is_simple = all(pattern.is_simple for pattern in self.compiled_patterns)
+        self.max_search_states = kwargs.get('max_search_states', COMPOSITE_MAX_SEARCH_STATES)
+
     def process(self, message: Message):
-        return self._find_composite_entities(message.text, message.entities)
+        if not self.is_simple:
+            return self._find_composite_entities_by_permutations(message.text, message.entities)
+        try:
+            return self._find_composite_entities(message.text, message.entities)
+        except SearchLimitExceeded:
+            log.warning(f'{self.entity_name}: blocked match search exceeds {self.max_search_states} states, '
+                        f'fall back to the permutation search for {len(message.entities)} entities')
+            return self._find_composite_entities_by_permutations(message.text, message.entities)
+
+    @staticmethod
+    def _can_avoid(blockers: List[Set[int]], chain: Set[int], overlaps: List[Set[int]],
+                   max_states: int = COMPOSITE_MAX_SEARCH_STATES) -> bool:
+        """
+        Whether there is a non-overlapping permutation containing the chain
+        that does not contain all the entities of any of the blockers.
+        An entity is left out of the permutation by picking an entity (excluder) overlapping it.
+
+        Depth-first search over (blocker, excluders picked so far). A state is identified by
+        the excluders that can still change the search (overlapping the next blockers' entities
+        or their excluders), states already known to fail are not searched again.
+        The search gives up after `max_states` states by raising SearchLimitExceeded.
+        """
+        relevant = [frozenset()]*(len(blockers)+1)
+        for i in range(len(blockers)-1, -1, -1):
+            entities = set(relevant[i+1])
+            for index in blockers[i]:
+                entities |= overlaps[index]
+                for excluder in overlaps[index]:
+                    entities |= overlaps[excluder]
+            relevant[i] = frozenset(entities)
+
+        failed = set()
+        states = 0
+
+        def _search(i: int, excluders: FrozenSet[int]) -> bool:
+            nonlocal states
+            # Blockers already left out by the excluders
+            while i < len(blockers) and any(overlaps[index] & excluders for index in blockers[i]):
+                i += 1
+            if i == len(blockers):
+                return True
+            state = (i, excluders & relevant[i])
+            if state in failed:
+                return False
+            states += 1
+            if states > max_states:
+                raise SearchLimitExceeded()
+            for index in blockers[i]:
+                for excluder in overlaps[index]:
+                    if overlaps[excluder] & chain or overlaps[excluder] & excluders:
+                        continue
+                    if _search(i+1, excluders | {excluder}):
+                        return True
+            failed.add(state)
+            return False
+
+        return _search(0, frozenset())
+
+    @classmethod
+    def _is_blocked(cls, chain: Set[int], matches: List[Set[int]], overlaps: List[Set[int]],
+                    max_states: int = COMPOSITE_MAX_SEARCH_STATES) -> bool:
+        """
+        A match is blocked if every permutation containing it also contains a previous
+        (larger) match sharing some of its entities.
+        """
+        blockers = []
+        for used in matches:
+            if not used & chain:
+                continue
+            others = used - chain
+            # Previous match can not be in the same permutation
+            if any(overlaps[index] & chain for index in others):
+                continue
+            blockers.append(others)
+        return not cls._can_avoid(blockers, chain, overlaps, max_states)
+
+    def _find_composite_entities(self, text: Text, entities: List[Entity]):
+        if not entities:
+            return []
+
+        entities = sorted(entities, key=lambda entity: entity.start)
+        overlaps = [
+            set(j for j, other in enumerate(entities) if j != i and self._isoverlap(entity, other))
+            for i, entity in enumerate(entities)]
+
+        bounds = chain_bounds(text, entities)
+        matches = []
+        for pattern in self.compiled_patterns:
+            for chain in pattern.find_chains(text, entities, bounds):
+                chain_indices = set(chain)
+                # If an entity of this match is already used by a previous (larger)
+                # match that cannot be avoided, this match is a subset of it
+                if self._is_blocked(chain_indices, [used for used, _, _ in matches], overlaps, self.max_search_states):
+                    continue
+                matches.append((chain_indices, chain, pattern))
+
+        composites = []
+        all_used_indices = set()
+        for chain_indices, chain, pattern in matches:
+            contained_entities = [entities[i] for i in chain]
+            contained_entities, start, end = self._format_composite_entities(contained_entities, pattern.mapping_dict)
+            composites.append(self.convert_to_entity(contained_entities, start, end))
+            all_used_indices.update(chain_indices)
+
+        filtered_entites = [entity for i, entity in enumerate(entities) if i not in all_used_indices]
+        return filtered_entites + composites
 
     @staticmethod
     def _replace_entity_values(text, entities_perms: List[List[Entity]]):
@@ -62,7 +336,7 @@ class CompositeEntitiesExtractor(Extractor):
             index_maps.append(index_map)
         return new_texts, index_maps
 
-    def _find_composite_entities(self, text: Text, entities: List[Entity]):
+    def _find_composite_entities_by_permutations(self, text: Text, entities: List[Entity]):
         if not entities:
             return []
 
@@ -11,6 +11,15 @@ ENTITY_PREFIX = '@'
 DUCKLING_ENDPOINT = os.getenv('DUCKLING_ENDPOINT', 'http://localhost:8000')
 DEFAULT_TEMP_UNIT = os.getenv('DEFAULT_TEMP_UNIT', 'celsius')
 
+DUCKLING_CONNECT_TIMEOUT = float(os.getenv('DUCKLING_CONNECT_TIMEOUT', 0.5))
+DUCKLING_READ_TIMEOUT = float(os.getenv('DUCKLING_READ_TIMEOUT', 2))
+DUCKLING_MAX_RETRIES = int(os.getenv('DUCKLING_MAX_RETRIES', 1))
+DUCKLING_POOL_SIZE = int(os.getenv('DUCKLING_POOL_SIZE', 10))
+# Number of consecutive failures before the circuit open
+# and number of seconds before a new request is tried
+DUCKLING_CIRCUIT_FAILURES = int(os.getenv('DUCKLING_CIRCUIT_FAILURES', 5))
+DUCKLING_CIRCUIT_RESET_TIMEOUT = float(os.getenv('DUCKLING_CIRCUIT_RESET_TIMEOUT', 30))
+
 ENTITY_MAPPING = {
     'quantity': 'weight',
     'distance': 'length',
@@ -26,3 +35,7 @@ DUCKLING_ENTITIES = DUCKLING_TIME_ENTITIES+DUCKLING_MEASURE_ENTITIES+DUCKLING_OT
 
 
 SPECIAL_ENTITIES = ['list', 'regex', 'composite']
+
+# Duckling results cache, size 0 disable the cache
+DUCKLING_CACHE_SIZE = int(os.getenv('DUCKLING_CACHE_SIZE', 10000))
+DUCKLING_CACHE_TTL = float(os.getenv('DUCKLING_CACHE_TTL', 3600))
@@ -0,0 +1,192 @@
+from .constants import DUCKLING_CACHE_SIZE, DUCKLING_CACHE_TTL
+from typing import Text, List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+from dateutil import tz as dateutil_tz
+from datetime import datetime
+import threading
+import json
+import time
+
+
+# Reference-time bucket of a result given the finest grain of its time values.
+# Duckling resolve relative expressions ("tomorrow", "in 2 hours") against the current time
+# and truncate the values to their grain, so a result stay valid as long as the
+# current time is in the same bucket. Second grain results are not cached.
+GRAIN_BUCKETS = {
+    'minute': '%Y-%m-%dT%H:%M',
+    'hour': '%Y-%m-%dT%H',
+    'day': '%Y-%m-%d',
+    'week': '%Y-%m-%d',
+    'month': '%Y-%m-%d',
+    'quarter': '%Y-%m-%d',
+    'year': '%Y-%m-%d',
+}
+GRAIN_ORDER = ['second', 'minute', 'hour', 'day', 'week', 'month', 'quarter', 'year']
+
+# Dimensions whose values keep the case of the text
+CASE_SENSITIVE_DIMS = ['email', 'url']
+
+
+def normalize_text(text: Text, dims: List[Text]) -> Tuple[Text, int]:
+    """
+    Return the normalized text and the offset of the normalized text in the original text.
+    Normalization never change the positions of the characters (other than the offset),
+    so the start/end of the matches can be mapped back to the original text.
+    """
+    stripped = text.lstrip()
+    offset = len(text) - len(stripped)
+    stripped = stripped.rstrip()
+    lowered = stripped.lower()
+    if len(lowered) == len(stripped) and not any(dim in CASE_SENSITIVE_DIMS for dim in dims):
+        stripped = lowered
+    return stripped, offset
+
+
+def finest_grain(matches: List[Dict[Text, Any]]) -> Optional[Text]:
+    """
+    Finest grain of the time values in Duckling's matches, None if there is no time value
+    """
+    grains = []
+    for match in matches:
+        if match.get('dim') != 'time':
+            continue
+        value = match.get('value', {})
+        for v in [value, value.get('from', {}), value.get('to', {})]:
+            if v.get('grain'):
+                grains.append(v['grain'])
+    if not grains:
+        return None
+    return min(grains, key=lambda grain: GRAIN_ORDER.index(grain) if grain in GRAIN_ORDER else 0)
+
+
+def reference_bucket(grain: Text, timezone: Text, now: Optional[float] = None) -> Optional[Text]:
+    bucket_format = GRAIN_BUCKETS.get(grain)
+    if not bucket_format:
+        return None
+    now = time.time() if now is None else now
+    return datetime.fromtimestamp(now, dateutil_tz.gettz(timezone)).strftime(bucket_format)
+
+
+class DucklingCache:
+    """
+    Bounded LRU cache of Duckling results with a TTL.
+
+    Results containing time values are only valid in the reference-time bucket (minute, hour or day
+    in the request's timezone, depend on the grain) they were parsed in and are invalidated after that.
+
+    Parameters:
+        max_size: maximum number of results kept in memory
+        ttl: time to live of a result in seconds
+        backend: optional shared cache so multiple processes can share results.
+            Any object with `get(key) -> Optional[str]` and `set(key, value, ex=ttl_in_seconds)`
+            (ex: a redis.Redis client)
+    """
+
+    def __init__(self, max_size: int = DUCKLING_CACHE_SIZE, ttl: float = DUCKLING_CACHE_TTL, backend: Any = None, **kwargs):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend
+        self.key_prefix = kwargs.get('key_prefix', 'duckling:')
+        self.hits = 0
+        self.misses = 0
+        self.backend_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(text: Text, locale: Text, dims: List[Text], timezone: Text) -> Text:
+        return json.dumps([locale, timezone, sorted(dims), text], ensure_ascii=False)
+
+    def _is_valid(self, entry: Dict[Text, Any], timezone: Text, now: float) -> bool:
+        if entry['expires_at'] <= now:
+            return False
+        if entry['bucket'] is None:
+            return True
+        return reference_bucket(entry['grain'], timezone, now) == entry['bucket']
+
+    def get(self, key: Text, timezone: Text) -> Optional[List[Dict[Text, Any]]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._is_valid(entry, timezone, now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry['result']
+                del self._entries[key]
+
+        if self.backend is not None:
+            try:
+                raw = self.backend.get(self.key_prefix+key)
+            except Exception:
+                raw = None
+            if raw:
+                entry = json.loads(raw)
+                if self._is_valid(entry, timezone, now):
+                    self._put(key, entry)
+                    with self._lock:
+                        self.hits += 1
+                        self.backend_hits += 1
+                    return entry['result']
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: Text, timezone: Text, result: List[Dict[Text, Any]]):
+        now = time.time()
+        grain = finest_grain(result)
+        bucket = None
+        if grain is not None:
+            bucket = reference_bucket(grain, timezone, now)
+            if bucket is None:
+                return
+        entry = {'result': result, 'grain': grain, 'bucket': bucket, 'expires_at': now+self.ttl}
+        self._put(key, entry)
+
+        if self.backend is not None:
+            try:
+                self.backend.set(self.key_prefix+key, json.dumps(entry), ex=max(1, int(self.ttl)))
+            except Exception:
+                pass
+
+    def _put(self, key: Text, entry: Dict[Text, Any]):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[Text, Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'backend_hits': self.backend_hits,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(endpoint: Text, **kwargs) -> Optional[DucklingCache]:
+    """
+    Return the DucklingCache shared by every extractor using the same endpoint and the same cache options
+    (max_size, ttl, backend...), None if the cache is disabled (max_size = 0).
+    """
+    kwargs.setdefault('max_size', DUCKLING_CACHE_SIZE)
+    kwargs.setdefault('ttl', DUCKLING_CACHE_TTL)
+    # The backend clients are not hashable, they are shared by identity
+    options = tuple(sorted((key, id(val) if key == 'backend' else val) for key, val in kwargs.items()))
+    with _caches_lock:
+        if (endpoint, options) not in _caches:
+            max_size = kwargs.pop('max_size')
+            _caches[(endpoint, options)] = DucklingCache(max_size, **kwargs) if max_size > 0 else None
+        return _caches[(endpoint, options)]
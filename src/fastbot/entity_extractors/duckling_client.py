@@ -0,0 +1,153 @@
+from .constants import (
+    DUCKLING_CONNECT_TIMEOUT,
+    DUCKLING_READ_TIMEOUT,
+    DUCKLING_MAX_RETRIES,
+    DUCKLING_POOL_SIZE,
+    DUCKLING_CIRCUIT_FAILURES,
+    DUCKLING_CIRCUIT_RESET_TIMEOUT,
+)
+from typing import Text, List, Dict, Any, Optional
+from fastbot.utils.aio import run_in_thread
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import threading
+import requests
+import logging
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Open the circuit after `failure_threshold` consecutive failures. While the circuit is open
+    requests are not allowed, after `reset_timeout` seconds one request is let through
+    (half-open) and its result close or re-open the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = DUCKLING_CIRCUIT_FAILURES, reset_timeout: float = DUCKLING_CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def is_rejecting(self) -> bool:
+        """
+        Whether requests are currently rejected, without letting a half-open request through
+        """
+        opened_at = self.opened_at
+        return opened_at is not None and time.monotonic() - opened_at < self.reset_timeout
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # half-open, let this request through and hold the others
+                # until it succeed or fail
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    log.warning(f'Circuit opened after {self.failures} consecutive failures')
+                self.opened_at = time.monotonic()
+
+
+class DucklingClient:
+    """
+    Connection-pooled (keep-alive) HTTP client of a Duckling server.
+
+    Parameters:
+        connect_timeout, read_timeout: in seconds
+        max_retries: number of retries on connection errors and 502/503/504 responses.
+            Read errors (ex: read timeout) are not retried, the server may still be parsing the request
+        pool_size: maximum number of kept-alive connections
+        circuit_failures, circuit_reset_timeout: see CircuitBreaker
+
+    `parse` never raise, it return None when the request fail or when the circuit is open
+    (an empty list is a successful parse without match).
+    """
+
+    def __init__(self, endpoint: Text, **kwargs):
+        self.endpoint = endpoint.rstrip('/')+'/parse'
+        self.timeout = (kwargs.get('connect_timeout', DUCKLING_CONNECT_TIMEOUT),
+                        kwargs.get('read_timeout', DUCKLING_READ_TIMEOUT))
+        self.breaker = CircuitBreaker(kwargs.get('circuit_failures', DUCKLING_CIRCUIT_FAILURES),
+                                      kwargs.get('circuit_reset_timeout', DUCKLING_CIRCUIT_RESET_TIMEOUT))
+
+        pool_size = kwargs.get('pool_size', DUCKLING_POOL_SIZE)
+        max_retries = kwargs.get('max_retries', DUCKLING_MAX_RETRIES)
+        retries = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            other=0,
+            status=max_retries,
+            backoff_factor=0.1,
+            status_forcelist=[502, 503, 504],
+            # Parsing is idempotent, POST can be retried when it did not reach the server or was rejected
+            allowed_methods=None,
+        )
+        self.session = requests.Session()
+        self.session.headers.update({'Content-Type': 'application/x-www-form-urlencoded'})
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries))
+
+    def parse(self, payload: Text) -> Optional[List[Dict[Text, Any]]]:
+        if not self.breaker.allow():
+            return None
+        try:
+            resp = self.session.post(self.endpoint, data=payload, timeout=self.timeout)
+            resp.raise_for_status()
+            result = resp.json()
+        except Exception as e:
+            log.error(e)
+            self.breaker.record_failure()
+            return None
+        self.breaker.record_success()
+        return result
+
+    async def aparse(self, payload: Text) -> Optional[List[Dict[Text, Any]]]:
+        """
+        Same as `parse` without blocking the event loop. The request runs in the default executor,
+        an open circuit return right away without using a thread.
+        """
+        if self.breaker.is_rejecting():
+            return None
+        return await run_in_thread(self.parse, payload)
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(endpoint: Text, **kwargs) -> DucklingClient:
+    """
+    Return the DucklingClient shared by every extractor using the same endpoint.
+    The client is created with the `kwargs` of the first call.
+    """
+    with _clients_lock:
+        client = _clients.get(endpoint)
+        if client is None:
+            client = DucklingClient(endpoint, **kwargs)
+            _clients[endpoint] = client
+        return client
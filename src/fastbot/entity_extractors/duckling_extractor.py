@@ -1,16 +1,20 @@
 from .base import Extractor
 from .constants import *
+from .duckling_client import get_client
+from .duckling_cache import get_cache, normalize_text
 from fastbot.models import Message, Entity
 from typing import Text, List, Dict, Any, Optional
 from dateutil.parser import parse as dateparser
 from urllib import parse
-import requests
 import json
 import logging
 
 
 log = logging.getLogger(__name__)
 
+CLIENT_OPTIONS = ['connect_timeout', 'read_timeout', 'max_retries', 'pool_size', 'circuit_failures', 'circuit_reset_timeout']
+CACHE_OPTIONS = {'cache_size': 'max_size', 'cache_ttl': 'ttl', 'cache_backend': 'backend'}
+
 
 class DucklingExtractor(Extractor):
     """
@@ -22,6 +26,16 @@ class DucklingExtractor(Extractor):
         distance        -> length
         time            -> time | date | datetime | datetime_interval
         amount-of-money -> currency
+
+    Requests go through a DucklingClient (keep-alive connection pool, timeouts, retries and
+    circuit breaker) shared by all the extractors with the same endpoint.
+    Client options: connect_timeout, read_timeout, max_retries, pool_size,
+    circuit_failures, circuit_reset_timeout
+
+    Results are cached in a DucklingCache shared by all the extractors with the same endpoint and cache options,
+    keyed by the normalized text (stripped, lowercased unless a dimension is case sensitive), locale, dimensions and timezone.
+    Duckling matching is case insensitive, the texts sent to Duckling are not normalized.
+    Cache options: cache_size (0 to disable), cache_ttl, cache_backend, or `cache=False` to disable it.
     """
 
     name = 'DucklingExtractor'
@@ -34,21 +48,28 @@ class DucklingExtractor(Extractor):
         super().__init__(**kwargs)
         self.locale = DUCKLING_LOCALE.get(language, f'{language}_NL')
         self.dimensions = dimensions
-        self.endpoint = endpoint+'/parse'
+        client_kwargs = {key: kwargs[key] for key in CLIENT_OPTIONS if key in kwargs}
+        self.client = kwargs.get('client') or get_client(endpoint, **client_kwargs)
+        self.cache = kwargs.get('cache')
+        if self.cache is None:
+            cache_kwargs = {CACHE_OPTIONS[key]: kwargs[key] for key in CACHE_OPTIONS if key in kwargs}
+            self.cache = get_cache(endpoint, **cache_kwargs)
         self.default_timezone = kwargs.get('timezone', DEFAULT_TZ)
         self.default_temp_unit = kwargs.get('default_temp_unit', DEFAULT_TEMP_UNIT)
 
+    def _duckling_dimensions(self):
+        temp_dims = []
+        for dim in self.dimensions:
+            # break duckling `time` -> time, date, datetime, datetime_interval
+            if dim in DUCKLING_TIME_ENTITIES:
+                temp_dims.append('time')
+            else:
+                temp_dims.append(REVERSED_ENTITY_MAPPING.get(dim, dim))
+        return sorted(set(temp_dims))
+
     def _payload(self, text: Text, timezone: Text):
         def _duckling_dimension():
-            temp_dims = []
-            for dim in self.dimensions:
-                # break duckling `time` -> time, date, datetime, datetime_interval
-                if dim in DUCKLING_TIME_ENTITIES:
-                    temp_dims.append('time')
-                else:
-                    temp_dims.append(REVERSED_ENTITY_MAPPING.get(dim, dim))
-            temp_dims = list(set(temp_dims))
-            return parse.quote(json.dumps(temp_dims))
+            return parse.quote(json.dumps(self._duckling_dimensions()))
 
         def _preprocess_text(text):
             return parse.quote(text)
@@ -66,16 +87,49 @@ class DucklingExtractor(Extractor):
             querystring += f'{key}={value}&'
         return querystring[:-1]  # remove the last '&'
 
+    def _cache_lookup(self, text: Text, timezone: Text):
+        dims = self._duckling_dimensions()
+        normalized_text, offset = normalize_text(text, dims)
+        key = self.cache.make_key(normalized_text, self.locale, dims, timezone)
+        return key, offset, self.cache.get(key, timezone)
+
+    @staticmethod
+    def _to_text(matches: List[Dict[Text, Any]], text: Text, offset: int):
+        """
+        Map the cached matches back to `text`: shift the positions by the offset of the normalized text
+        and take the body from the text, the cached ones can come from a text with another case
+        """
+        return [
+            dict(match, start=match['start']+offset, end=match['end']+offset, body=text[match['start']+offset:match['end']+offset])
+            for match in matches
+        ]
+
     def _parse(self, text: Text, timezone: Text):
-        payload = self._payload(text, timezone)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        try:
-            resp = requests.post(self.endpoint, data=payload, headers=headers)
-            resp.raise_for_status()
-            return resp.json()
-        except Exception as e:
-            log.error(e)
-            return []
+        if not self.cache:
+            return self.client.parse(self._payload(text, timezone)) or []
+
+        # Only the cache key is normalized, Duckling parses the text as is (without the surrounding spaces
+        # so the positions are relative to the normalized text)
+        key, offset, matches = self._cache_lookup(text, timezone)
+        if matches is None:
+            matches = self.client.parse(self._payload(text.strip(), timezone))
+            # Failed requests (None) are not cached, empty results are
+            if matches is None:
+                return []
+            self.cache.set(key, timezone, matches)
+        return self._to_text(matches, text, offset)
+
+    async def _aparse(self, text: Text, timezone: Text):
+        if not self.cache:
+            return await self.client.aparse(self._payload(text, timezone)) or []
+
+        key, offset, matches = self._cache_lookup(text, timezone)
+        if matches is None:
+            matches = await self.client.aparse(self._payload(text.strip(), timezone))
+            if matches is None:
+                return []
+            self.cache.set(key, timezone, matches)
+        return self._to_text(matches, text, offset)
 
     def _remove_irrelevant_entities(self, entities: List[Dict[Text, Any]]):
         cleaned_entities = []
@@ -163,13 +217,21 @@ class DucklingExtractor(Extractor):
             grain = match['value'].get('grain')
         return entity_type, value_type, value, unit, grain
 
-    def process(self, message: Message):
-        text = message.text
+    def _timezone(self, message: Message):
         timezone = message.config.get('timezone')
         if not timezone:
             timezone = self.default_timezone
-        matches = self._parse(text, timezone)
+        return timezone
+
+    def _to_entities(self, matches: List[Dict[Text, Any]]):
         entities = self._convert_duckling_format(matches)
         entities = self._remove_irrelevant_entities(entities)
-
         return entities
+
+    def process(self, message: Message):
+        matches = self._parse(message.text, self._timezone(message))
+        return self._to_entities(matches)
+
+    async def aprocess(self, message: Message):
+        matches = await self._aparse(message.text, self._timezone(message))
+        return self._to_entities(matches)
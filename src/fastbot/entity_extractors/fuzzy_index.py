@@ -0,0 +1,69 @@
+from typing import Text, List, Dict, Callable, Optional, Tuple
+import heapq
+
+
+class NgramIndex:
+    """
+    Character n-gram inverted index over a list of terms.
+    Used to shortlist the terms that share the most n-grams with a piece of text,
+    so only the shortlist need to be scored by an (expensive) fuzzy matching function.
+
+    n-grams are looked up from the rarest to the most common one. An n-gram shared by
+    more than `max_scan` terms does not introduce new candidates, it only increases
+    the count of the existing ones. Which bound the work per lookup regardless of the
+    number of terms.
+    """
+
+    def __init__(self, terms: List[Text], n: int = 3, max_scan: int = 1000):
+        self.n = n
+        self.max_scan = max_scan
+        self.terms = terms
+        self.lengths = [len(term) for term in terms]
+        self._index = {}
+        for i, term in enumerate(terms):
+            for gram in set(self.ngrams(term)):
+                self._index.setdefault(gram, set()).add(i)
+
+    def ngrams(self, text: Text) -> List[Text]:
+        # pad with spaces so the first and last characters also get their own n-grams
+        padded = f' {text} '
+        if len(padded) <= self.n:
+            return [padded]
+        return [padded[i:i+self.n] for i in range(len(padded)-self.n+1)]
+
+    def candidates(self,
+                   text: Text,
+                   limit: Optional[int] = None,
+                   accept: Optional[Callable[[int], bool]] = None,
+                   length_range: Optional[Tuple[float, float]] = None) -> List[int]:
+        """
+        Return the indices of the terms sharing at least one n-gram with the text,
+        most shared n-grams first.
+
+        Parameters:
+            limit: maximum number of candidates to return
+            accept: filter function on the term index
+            length_range: (min, max) length of the terms
+        """
+        postings = [self._index[gram] for gram in set(self.ngrams(text)) if gram in self._index]
+        postings.sort(key=len)
+
+        counts = {}
+        for terms in postings:
+            if len(terms) <= self.max_scan:
+                for i in terms:
+                    counts[i] = counts.get(i, 0) + 1
+            else:
+                for i in counts:
+                    if i in terms:
+                        counts[i] += 1
+
+        if length_range is not None:
+            lengths = self.lengths
+            min_length, max_length = length_range
+            counts = {i: count for i, count in counts.items() if min_length <= lengths[i] <= max_length}
+        if accept is not None:
+            counts = {i: count for i, count in counts.items() if accept(i)}
+        if limit:
+            return heapq.nlargest(limit, counts, key=counts.get)
+        return sorted(counts, key=counts.get, reverse=True)
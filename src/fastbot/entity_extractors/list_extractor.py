@@ -1,18 +1,29 @@
 from .base import Extractor
+from .automaton import AhoCorasick, is_word_boundary
+from .fuzzy_index import NgramIndex
 from fastbot.models import Message, Entity
 from fastbot.models.entity import ListEntityConfig
-from typing import Text, List, Dict, Any, Union
+from typing import Text, List, Dict, Any, Union, Tuple
 from rapidfuzz import fuzz
 import regex as re
 
 
-FUZZY_FACTOR = 0.17
-TERM_LENGTH_WEIGHT = 1.2
+WORD_PATTERN = re.compile(r'\w+')
 
 
 class ListExtractor(Extractor):
     """
     Extract entities from messages using a list of values + their synonyms
+
+    Exact matching use an Aho-Corasick automaton built once over all the terms,
+    so every message is scanned in a single pass regardless of the list size.
+
+    Fuzzy matching slides windows of words over the message, shortlist the closest
+    terms of each window with a character n-gram index and only score the shortlist
+    with `fuzz.ratio` of the window and the term. (The former per-term `{e<=N}` regex used
+    `fuzz.partial_ratio` of the regex match, which scored any window containing the term,
+    or contained in it, 100 and made the matches take the surrounding characters.)
+    Terms shorter than `fuzzy_match_min_search_length` are always matched exactly.
     """
 
     name = 'ListExtractor'
@@ -30,43 +41,134 @@ class ListExtractor(Extractor):
         self.fuzzy_match = entity_config.fuzzy_match
         self.fuzzy_match_threshold = entity_config.fuzzy_match_threshold
         self.fuzzy_match_min_search_length = entity_config.fuzzy_match_min_search_length
+        self.fuzzy_match_max_candidates = entity_config.fuzzy_match_max_candidates
+        self._build_search_terms()
+        if self.fuzzy_match:
+            self._build_fuzzy_index()
+        else:
+            self.automaton = AhoCorasick(self._terms)
+
+    def _build_search_terms(self):
+        """
+        Search terms of each item (longest term first) and a
+        mapping from each distinct term to the items it belongs to
+        """
+        self._items_terms = []
+        self._terms = []
+        self._term2idx = {}
+        self._term_items = []
+        for i, item in enumerate(self.list):
+            search_terms = [item.name] + item.synonyms
+            if not self.case_sensitive:
+                search_terms = list(dict.fromkeys([term.lower() for term in search_terms]))
+            search_terms.sort(key=len, reverse=True)
+            self._items_terms.append(search_terms)
+
+            for term in search_terms:
+                if term not in self._term2idx:
+                    self._term2idx[term] = len(self._terms)
+                    self._terms.append(term)
+                    self._term_items.append([])
+                term_items = self._term_items[self._term2idx[term]]
+                if not term_items or term_items[-1] != i:
+                    term_items.append(i)
+
+    def _build_fuzzy_index(self):
+        is_fuzzy = [len(term) >= self.fuzzy_match_min_search_length for term in self._terms]
+
+        # Short terms are matched exactly, empty keywords keep the automaton
+        # indices aligned with the term indices
+        self.automaton = AhoCorasick([term if not fuzzy else '' for term, fuzzy in zip(self._terms, is_fuzzy)])
+
+        self._fuzzy_terms = [i for i, fuzzy in enumerate(is_fuzzy) if fuzzy]
+        self.fuzzy_index = NgramIndex([self._terms[i] for i in self._fuzzy_terms])
+        self._fuzzy_terms_words = [len(WORD_PATTERN.findall(self._terms[i])) for i in self._fuzzy_terms]
+
+        # Windows are allowed to have one more or one less word than the term,
+        # fuzzy terms matched by the windows of each size (None for all of them)
+        self._window_terms = {}
+        for n_words in set(self._fuzzy_terms_words):
+            for size in (n_words-1, n_words, n_words+1):
+                if size > 0 and size not in self._window_terms:
+                    terms = set(j for j, n in enumerate(self._fuzzy_terms_words) if abs(n-size) <= 1)
+                    self._window_terms[size] = terms if len(terms) < len(self._fuzzy_terms) else None
+        self._window_sizes = sorted(self._window_terms)
 
     def convert_to_entity(self, value: Any, text: Text, start: int, end: int, confidence: float) -> Entity:
         return Entity(self.entity_name, start, end, value, self.name, text=text, confidence=confidence)
 
     def process(self, message: Message) -> List[Entity]:
         text = message.text
+        if not self.case_sensitive:
+            text = text.lower()
+
+        if self.fuzzy_match:
+            # Exact match of short terms has a 100 (%) fuzzy score
+            matches = self._exact_search(text, 100.0)
+            for term_idx, term_matches in self._fuzzy_search(text).items():
+                matches.setdefault(term_idx, []).extend(term_matches)
+        else:
+            matches = self._exact_search(text, 1.0)
+        return self._matches_to_entities(text, matches)
+
+    def _exact_search(self, text: Text, confidence: float) -> Dict[int, List[Tuple[int, int, float]]]:
+        matches = {}
+        for term_idx, occurrences in self.automaton.find_all(text).items():
+            # Only keep non-overlapping occurrences of a term that are
+            # surrounded by word boundaries, same as `re.finditer(\bterm\b)`
+            last_end = -1
+            for start_index, end_index in occurrences:
+                if start_index < last_end:
+                    continue
+                if not (is_word_boundary(text, start_index) and is_word_boundary(text, end_index)):
+                    continue
+                last_end = end_index
+                matches.setdefault(term_idx, []).append((start_index, end_index, confidence))
+        return matches
+
+    def _fuzzy_search(self, text: Text) -> Dict[int, List[Tuple[int, int, float]]]:
+        words = [(m.start(), m.end()) for m in WORD_PATTERN.finditer(text)]
+        terms = self.fuzzy_index.terms
+        # Lowest length ratio of a term and a window scoring above the threshold
+        min_ratio = self.fuzzy_match_threshold/(200-self.fuzzy_match_threshold)
+
+        matches = {}
+        for size in self._window_sizes:
+            # Terms with one more or one less word than the windows
+            window_terms = self._window_terms[size]
+            accept = window_terms.__contains__ if window_terms is not None else None
+            for i in range(len(words)-size+1):
+                start_index = words[i][0]
+                end_index = words[i+size-1][1]
+                window = text[start_index:end_index]
+
+                # Skip terms that can not reach the threshold because of their
+                # length, ratio <= 2*min_len/(len1+len2)
+                length_range = (len(window)*min_ratio-1e-9, len(window)/min_ratio+1e-9) if min_ratio else None
+                for j in self.fuzzy_index.candidates(window, self.fuzzy_match_max_candidates, accept, length_range):
+                    confidence = fuzz.ratio(window, terms[j], score_cutoff=self.fuzzy_match_threshold)
+                    if confidence:
+                        term_idx = self._fuzzy_terms[j]
+                        matches.setdefault(term_idx, []).append((start_index, end_index, confidence))
+
+        # Best matching windows of each term first
+        for term_matches in matches.values():
+            term_matches.sort(key=lambda m: (-m[2], m[0]))
+        return matches
+
+    def _matches_to_entities(self, text: Text, matches: Dict[int, List[Tuple[int, int, float]]]) -> List[Entity]:
+        matched_items = sorted(set(i for term_idx in matches for i in self._term_items[term_idx]))
 
         entities = []
-        for item in self.list:
-            search_terms = [item.name] + item.synonyms
-
-            if not self.case_sensitive:
-                search_terms = list(set([term.lower() for term in search_terms]))
-                text = text.lower()
-
-            search_terms.sort(key=len, reverse=True)
+        for i in matched_items:
+            item = self.list[i]
             overlaps = []
-            for term in search_terms:
-                pattern = fr'\b{term}\b'
-                if self.fuzzy_match and len(term) >= self.fuzzy_match_min_search_length:
-                    err = round(FUZZY_FACTOR*(len(text)**TERM_LENGTH_WEIGHT))
-                    pattern = r'\b(%s){e<=%i}\b' % (term, err)
-
-                for match in re.finditer(pattern, text):
-                    start_index = match.start(0)
-                    end_index = match.end(0)
-
-                    confidence = 1.0
-                    if self.fuzzy_match:
-                        confidence = fuzz.partial_ratio(match.group(), term, score_cutoff=self.fuzzy_match_threshold)
-                        if confidence == 0:
-                            continue
-
+            for term in self._items_terms[i]:
+                for start_index, end_index, confidence in matches.get(self._term2idx[term], []):
                     # if a term is a substring of one of the previous terms, ignore
                     if not self._is_overlaps((start_index, end_index), overlaps):
                         item_value = item.code if item.code else item.name
-                        entity = self.convert_to_entity(item_value, match.group(), start_index, end_index, confidence)
+                        entity = self.convert_to_entity(item_value, text[start_index:end_index], start_index, end_index, confidence)
                         entities.append(entity)
                         overlaps.append((start_index, end_index))
         return entities
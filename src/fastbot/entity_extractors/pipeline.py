@@ -1,23 +1,32 @@
 from .base import Extractor
 from .composite_extractor import CompositeEntitiesExtractor
+from .regex_extractor import RegexExtractor, RegexPatternSet
 from .unit_converter import UnitConverter
 from fastbot.models import Message, Entity
 from typing import Text, List, Dict, Any
+import asyncio
 from .constants import DUCKLING_MEASURE_ENTITIES
 
 
 class ExtractorPipeline:
     """
     List of entities extractor
+
+    With `combine_regex=True`, the patterns of all RegexExtractors in the pipeline
+    are merged into a single RegexPatternSet, so the text is scanned once for all of them
+    (the entities are the same as with each extractor scanning the text).
     """
 
     def __init__(self, extractors: List[Extractor] = [], **kwargs):
         self.pipeline = extractors
         self.unit_map = kwargs.get('unit_map', None)
         self.unit_converter = UnitConverter()
+        self.combine_regex = kwargs.get('combine_regex', False)
+        self._regex_set = None
 
     def add_extractor(self, extractor: Extractor):
         self.pipeline.append(extractor)
+        self._regex_set = None
 
     def get_extractor_by_type(self, extractor_type: Text):
         for extractor in self.pipeline:
@@ -29,14 +38,54 @@ class ExtractorPipeline:
             if extractor.name == extractor_name:
                 return extractor
 
+    def _build_regex_set(self):
+        patterns = []
+        for extractor in self.pipeline:
+            if isinstance(extractor, RegexExtractor):
+                patterns.extend([(extractor, pattern) for pattern in extractor.entity_patterns])
+        self._regex_set = RegexPatternSet(patterns)
+
+    def _process_regex(self, message: Message) -> Dict[RegexExtractor, List[Entity]]:
+        if self._regex_set is None:
+            self._build_regex_set()
+
+        regex_entities = {}
+        for extractor, start, end, value in self._regex_set.finditer(message.text):
+            regex_entities.setdefault(extractor, []).append(extractor.convert_to_entity(value, start, end))
+        return regex_entities
+
     def process(self, message: Message):
+        regex_entities = self._process_regex(message) if self.combine_regex else {}
         for extractor in self.pipeline:
             if isinstance(extractor, CompositeEntitiesExtractor):
                 message.entities = extractor.process(message)
+            elif self.combine_regex and isinstance(extractor, RegexExtractor):
+                message.entities.extend(regex_entities.get(extractor, []))
             else:
                 message.entities.extend(extractor.process(message))
         self._convert_unit(message)
 
+    async def aprocess(self, message: Message):
+        """
+        Async version of `process`. Extractors other than the composite ones
+        run concurrently, their entities are still added in pipeline order.
+        """
+        regex_entities = self._process_regex(message) if self.combine_regex else {}
+        extractors = [extractor for extractor in self.pipeline
+                      if not isinstance(extractor, CompositeEntitiesExtractor)
+                      and not (self.combine_regex and isinstance(extractor, RegexExtractor))]
+        results = await asyncio.gather(*[extractor.aprocess(message) for extractor in extractors])
+        results = dict(zip(extractors, results))
+
+        for extractor in self.pipeline:
+            if isinstance(extractor, CompositeEntitiesExtractor):
+                message.entities = await extractor.aprocess(message)
+            elif self.combine_regex and isinstance(extractor, RegexExtractor):
+                message.entities.extend(regex_entities.get(extractor, []))
+            else:
+                message.entities.extend(results[extractor])
+        self._convert_unit(message)
+
     def _convert_unit(self, message: Message):
         if self.unit_map:
             for entity in message.entities:
@@ -31,6 +31,10 @@ from fastbot.entity_extractors.constants import (
     DEFAULT_TEMP_UNIT,
     DEFAULT_TZ
 )
+from fastbot.entity_extractors.duckling_extractor import (
+    CLIENT_OPTIONS as DUCKLING_CLIENT_OPTIONS,
+    CACHE_OPTIONS as DUCKLING_CACHE_OPTIONS,
+)
 from fastbot.utils.common import import_from_path
 from typing import Text, List, Dict, Any
 import re
@@ -53,6 +57,14 @@ class ExtractorPipelineBuilder:
         self.duckling_endpoint = kwargs.get('duckling_endpoint', DUCKLING_ENDPOINT)
         self.default_temp_unit = kwargs.get('default_temp_unit', DEFAULT_TEMP_UNIT)
         self.default_timezone = kwargs.get('default_timezone', DEFAULT_TZ)
+        self.combine_regex = kwargs.get('combine_regex', False)
+        # DucklingClient and DucklingCache options, prefixed with `duckling_` in the config
+        # ex: duckling_read_timeout -> read_timeout
+        self.duckling_options = {
+            option: kwargs[f'duckling_{option}']
+            for option in DUCKLING_CLIENT_OPTIONS + list(DUCKLING_CACHE_OPTIONS)
+            if f'duckling_{option}' in kwargs
+        }
 
         self.entity_configs = entity_configs
         self.based_on = based_on
@@ -104,7 +116,7 @@ class ExtractorPipelineBuilder:
             return
         self.entity_cache[config.name] = 1
 
-        self._add_to_cache(Extractor.REGEX, RegexExtractor(config))
+        self._add_to_cache(Extractor.REGEX, RegexExtractor(config, combine_patterns=self.combine_regex))
 
     def _create_custom_entity_extractor(self, config: CustomEntityConfig):
         if self.entity_cache.get(config.name):
@@ -161,7 +173,8 @@ class ExtractorPipelineBuilder:
                     endpoint=self.duckling_endpoint,
                     language=self.language,
                     timezone=self.default_timezone,
-                    default_temp_unit=self.default_temp_unit)
+                    default_temp_unit=self.default_temp_unit,
+                    **self.duckling_options)
 
                 extractors.append(ext)
             elif extractor != Extractor.COMPOSITE:
@@ -171,5 +184,5 @@ class ExtractorPipelineBuilder:
 
         extractors.extend(composite)
 
-        pipeline = ExtractorPipeline(extractors, unit_map=self.unit_cache)
+        pipeline = ExtractorPipeline(extractors, unit_map=self.unit_cache, combine_regex=self.combine_regex)
         return pipeline
@@ -1,13 +1,117 @@
 from .base import Extractor
 from fastbot.models import Message, Entity
 from fastbot.models.entity import RegexEntityConfig
-from typing import Dict, List, Text, Any, Union
+from typing import Dict, List, Text, Any, Union, Tuple, Iterator, Hashable
 import re
 
 
+# Patterns using global inline flags or numbered backreferences
+# can not be merged into an alternation with other patterns
+GLOBAL_FLAGS = re.compile(r'^\(\?[aiLmsux]+\)')
+NUMBERED_BACKREF = re.compile(r'\\[1-9]|\(\?\(\d+\)')
+NAMED_GROUP = re.compile(r'\(\?P<(\w+)>')
+NAMED_BACKREF = re.compile(r'\(\?P=(\w+)\)')
+
+
+def match_value(match_text: Text, groupdict: Dict[Text, Any]):
+    """
+    Value of a regex entity: the matched text, or the named groups
+    + the matched text if the pattern has named groups
+    """
+    if groupdict:
+        value = {k: v for k, v in groupdict.items()}
+        value['text'] = match_text
+        return value
+    return match_text
+
+
+class RegexPatternSet:
+    """
+    Merge a list of patterns into a single alternation of named groups,
+    so the text is scanned once for all patterns.
+
+    Named groups of each pattern are renamed to be unique in the alternation,
+    the value of each match keep the original group names.
+    Patterns that cannot be merged (global inline flags, numbered backreferences)
+    are compiled and scanned separately.
+
+    The results are the same as running each pattern separately (in the order of the patterns).
+    The alternation only returns non-overlapping matches, so a pattern that can match
+    from inside the match of another pattern is scanned again separately.
+    """
+
+    def __init__(self, patterns: List[Tuple[Hashable, Text]]):
+        self.keys = [key for key, _ in patterns]
+        self.compiled = [re.compile(pattern) for _, pattern in patterns]
+        self._groups = {}
+        self._separate = []
+
+        alternatives = []
+        for i, (_, pattern) in enumerate(patterns):
+            if GLOBAL_FLAGS.match(pattern) or NUMBERED_BACKREF.search(pattern):
+                self._separate.append(i)
+                continue
+
+            prefix = f'_p{i}_'
+            pattern = NAMED_GROUP.sub(lambda m: f'(?P<{prefix}{m.group(1)}>', pattern)
+            pattern = NAMED_BACKREF.sub(lambda m: f'(?P={prefix}{m.group(1)})', pattern)
+            group = f'_p{i}'
+            alternatives.append(f'(?P<{group}>{pattern})')
+            self._groups[group] = (i, [(prefix+name, name) for name in self.compiled[i].groupindex])
+
+        self.combined = re.compile('|'.join(alternatives)) if alternatives else None
+        self._merged = [i for i in range(len(patterns)) if i not in self._separate]
+
+    def _scan_combined(self, text: Text) -> Tuple[Dict[int, List[Tuple[int, int, Any]]], set]:
+        """
+        Scan the text with the alternation.
+        Return the matches of each pattern and the patterns to scan again separately:
+        the patterns with an empty match or with a match starting inside the match of another pattern
+        """
+        matches = {i: [] for i in self._merged}
+        rescan = set()
+        # Start of the next match of each pattern from the last checked position
+        next_start = {}
+
+        for m in self.combined.finditer(text):
+            # The outer group of the pattern is always the last closed group
+            i, names = self._groups[m.lastgroup]
+            groupdict = {name: m.group(full_name) for full_name, name in names}
+            matches[i].append((m.start(), m.end(), match_value(m.group(), groupdict)))
+
+            start, end = m.start(), m.end()
+            if start == end:
+                rescan.add(i)
+                end = start+1
+            for j in self._merged:
+                if j == i or j in rescan:
+                    continue
+                if next_start.get(j, -1) < start:
+                    found = self.compiled[j].search(text, start)
+                    next_start[j] = found.start() if found else len(text)+1
+                if next_start[j] < end:
+                    rescan.add(j)
+        return matches, rescan
+
+    def _scan(self, i: int, text: Text) -> List[Tuple[int, int, Any]]:
+        return [(m.start(), m.end(), match_value(m.group(), m.groupdict())) for m in self.compiled[i].finditer(text)]
+
+    def finditer(self, text: Text) -> Iterator[Tuple[Hashable, int, int, Any]]:
+        """
+        Yield (key, start, end, value) for each match, pattern by pattern
+        """
+        matches, rescan = self._scan_combined(text) if self.combined else ({}, set())
+        for i, key in enumerate(self.keys):
+            for start, end, value in (matches[i] if i in matches and i not in rescan else self._scan(i, text)):
+                yield key, start, end, value
+
+
 class RegexExtractor(Extractor):
     """
     Extract entities from messages using a regular expression
+
+    Patterns are compiled once. With `combine_patterns=True` all the patterns
+    are merged into one RegexPatternSet and the text is scanned once.
     """
     name = 'RegexExtractor'
 
@@ -19,6 +123,16 @@ class RegexExtractor(Extractor):
 
         self.entity_name = entity_config.name
         self.entity_patterns = entity_config.patterns
+        self.compiled_patterns = [re.compile(pattern) for pattern in self.entity_patterns]
+        self.combine_patterns = kwargs.get('combine_patterns', False)
+        self._pattern_set = None
+
+    @property
+    def pattern_set(self) -> RegexPatternSet:
+        # Built on first use, not needed when the ExtractorPipeline combines the patterns
+        if self._pattern_set is None:
+            self._pattern_set = RegexPatternSet([(self.entity_name, pattern) for pattern in self.entity_patterns])
+        return self._pattern_set
 
     def convert_to_entity(self, value: Any, start: int, end: int):
         return Entity(self.entity_name, start, end, value, self.name)
@@ -26,15 +140,16 @@ class RegexExtractor(Extractor):
     def process(self, message: Message):
         text = message.text
 
+        if self.combine_patterns:
+            return [self.convert_to_entity(value, start_index, end_index)
+                    for _, start_index, end_index, value in self.pattern_set.finditer(text)]
+
         entities = []
-        for pattern in self.entity_patterns:
-            for m in re.finditer(pattern, text):
+        for pattern in self.compiled_patterns:
+            for m in pattern.finditer(text):
                 start_index = m.start(0)
                 end_index = m.end(0)
-                value = m.group()
-                if m.groupdict():
-                    value = {k: v for k, v in m.groupdict().items()}
-                    value['text'] = m.group()
+                value = match_value(m.group(), m.groupdict())
                 entities.append(self.convert_to_entity(
                     value,
                     start_index,
@@ -1,4 +1,4 @@
-from .cache import NluCache
+from .cache import NluCache, TokenFeatures
 from .entity import Entity
 from .input import InputConfig
 from .message import Message
@@ -1,12 +1,182 @@
+from typing import Text, List, Dict, Any, Optional, Tuple
+import threading
+import numpy as np
+
+
+class Vocabulary:
+    """
+    Intern strings (pos, tag, dep values) as integer ids, shared by the whole process.
+    Only closed sets of values (the labels of the models) are interned so the vocabulary stays small,
+    open ones (ex: lemmas) would grow it with every new word. Id 0 is the empty string.
+    """
+
+    def __init__(self):
+        self.strings = []
+        self._ids = {}
+        self._lock = threading.Lock()
+        self.id('')
+
+    def id(self, string: Text) -> int:
+        idx = self._ids.get(string)
+        if idx is None:
+            with self._lock:
+                idx = self._ids.get(string)
+                if idx is None:
+                    idx = len(self.strings)
+                    self.strings.append(string)
+                    self._ids[string] = idx
+        return idx
+
+    def ids(self, strings: List[Text]) -> List[int]:
+        ids = self._ids
+        return [ids[string] if string in ids else self.id(string) for string in strings]
+
+    def lookup(self, ids: np.ndarray) -> List[Text]:
+        strings = self.strings
+        return [strings[idx] for idx in ids.tolist()]
+
+
+vocabulary = Vocabulary()
+
+# Values of the token flags (istitle, isupper, like_num, like_email, like_url) of each bit mask
+FLAG_VALUES = [tuple(bool(mask >> bit & 1) for bit in range(5)) for mask in range(32)]
+
+
+class TokenFeatures:
+    """
+    Columnar store of the token features of a sentence: each column has one value per token.
+        - words, lower, lemma: text of the tokens
+        - pos, tag, dep: ids in `vocabulary`
+        - flags: bit masks of FLAGS
+        - start, end: character offsets
+        - ner: training label of each token (samples only)
+
+    Parameters:
+        categories: (3, n_tokens) array of the pos, tag and dep ids, 0 for the features not computed
+        flags: (n_tokens,) array of the flags' bit masks
+        offsets: (2, n_tokens) array of the start and end offsets
+        lemma: lemma of each token, None if not computed
+    """
+    FLAGS = ['istitle', 'isupper', 'like_num', 'like_email', 'like_url']
+    CATEGORIES = ['pos', 'tag', 'dep', 'lemma']
+    INTERNED = ['pos', 'tag', 'dep']
+
+    __slots__ = ['words', 'lower', 'pos', 'tag', 'dep', 'lemma', 'flags', 'start', 'end', 'ner']
+
+    def __init__(self,
+                 words: List[Text],
+                 categories: np.ndarray,
+                 flags: np.ndarray,
+                 offsets: np.ndarray,
+                 lemma: Optional[List[Text]] = None,
+                 ner: Optional[List[Text]] = None):
+        self.words = words
+        self.lower = [word.lower() for word in words]
+        self.pos, self.tag, self.dep = categories
+        self.lemma = lemma if lemma is not None else ['']*len(words)
+        self.flags = flags
+        self.start, self.end = offsets
+        self.ner = ner
+
+    def __len__(self):
+        return len(self.words)
+
+    def strings(self, column: Text) -> List[Text]:
+        if column in self.INTERNED:
+            return vocabulary.lookup(getattr(self, column))
+        return getattr(self, column)
+
+    def flag_values(self) -> List[Tuple[bool, ...]]:
+        """
+        Values of the FLAGS of each token
+        """
+        return [FLAG_VALUES[mask] for mask in self.flags.tolist()]
+
+    def to_pos_tag(self) -> List[Dict[Text, Any]]:
+        """
+        The features as one dictionary per token (format of `NluCache.pos_tag`)
+        """
+        istitle, isupper, like_num, like_email, like_url = zip(*self.flag_values()) if len(self) else [[]]*5
+        columns = {
+            'word': self.words,
+            'pos': self.strings('pos'),
+            'tag': self.strings('tag'),
+            'dep': self.strings('dep'),
+            'like_num': like_num,
+            'like_email': like_email,
+            'like_url': like_url,
+            'lemma': self.lemma,
+            'start': self.start.tolist(),
+            'end': self.end.tolist(),
+            'ner': self.ner or [None]*len(self),
+        }
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+    @classmethod
+    def from_pos_tag(cls, pos_tag: List[Dict[Text, Any]]):
+        words = [token['word'] for token in pos_tag]
+        categories = [vocabulary.ids([token[column] for token in pos_tag]) for column in cls.INTERNED]
+        flags = [
+            word.istitle() | word.isupper() << 1 | token['like_num'] << 2 | token['like_email'] << 3 | token['like_url'] << 4
+            for word, token in zip(words, pos_tag)]
+        offsets = [[token['start'] for token in pos_tag], [token['end'] for token in pos_tag]]
+        ner = [token['ner'] for token in pos_tag]
+        return cls(
+            words,
+            np.array(categories, dtype=np.int32).reshape(3, len(words)),
+            np.array(flags, dtype=np.uint8),
+            np.array(offsets, dtype=np.int32).reshape(2, len(words)),
+            lemma=[token['lemma'] for token in pos_tag],
+            ner=ner if any(label is not None for label in ner) else None)
+
+    def __getstate__(self):
+        # Vocabulary ids are only valid in this process
+        state = {name: getattr(self, name) for name in self.__slots__}
+        for column in self.INTERNED:
+            state[column] = self.strings(column)
+        return state
+
+    def __setstate__(self, state: Dict[Text, Any]):
+        for name, value in state.items():
+            if name in self.INTERNED:
+                value = np.array(vocabulary.ids(value), dtype=np.int32)
+            setattr(self, name, value)
+
+
 class NluCache:
     def __init__(self, text, **kwargs):
         self.processed_text = text
         self.tokens = []
-        self.pos_tag = []
+        self._pos_tag = []
+        self._token_features = None
         self.classifiers_output = {}
         self.dense_embedding_vector = None
         self.sparse_embedding_vector = None
 
+    @property
+    def token_features(self) -> Optional[TokenFeatures]:
+        # Built from `pos_tag` if only the dictionaries were set
+        if self._token_features is None and self._pos_tag:
+            self._token_features = TokenFeatures.from_pos_tag(self._pos_tag)
+        return self._token_features
+
+    @token_features.setter
+    def token_features(self, token_features: Optional[TokenFeatures]):
+        self._token_features = token_features
+        self._pos_tag = []
+
+    @property
+    def pos_tag(self) -> List[Dict[Text, Any]]:
+        # Built from the token features on demand
+        if not self._pos_tag and self._token_features is not None:
+            self._pos_tag = self._token_features.to_pos_tag()
+        return self._pos_tag
+
+    @pos_tag.setter
+    def pos_tag(self, pos_tag: List[Dict[Text, Any]]):
+        self._pos_tag = pos_tag
+        self._token_features = None
+
     def to_json(self):
         return {
             "processed_text": self.processed_text,
@@ -67,13 +67,15 @@ class ListEntityConfig:
                  case_sensitive: bool = True,
                  fuzzy_match: bool = False,
                  fuzzy_match_threshold: float = 70.0,
-                 fuzzy_match_min_search_length: int = 5):
+                 fuzzy_match_min_search_length: int = 5,
+                 fuzzy_match_max_candidates: int = 10):
         self.name = name
         self.values = values
         self.case_sensitive = case_sensitive
         self.fuzzy_match = fuzzy_match
         self.fuzzy_match_threshold = fuzzy_match_threshold
         self.fuzzy_match_min_search_length = fuzzy_match_min_search_length
+        self.fuzzy_match_max_candidates = fuzzy_match_max_candidates
 
 
 class RegexEntityConfig:
@@ -1,9 +1,15 @@
 from fastbot.nlu.component import BaseComponent
 from fastbot.nlu.constants import NLU_CONFIDENT_THRESHOLD, NLU_AMBIGUITY_THRESHOLD
 from fastbot.models import NluData, Message
+from typing import List
+import numpy as np
 
 
 class Classifier(BaseComponent):
+    # Whether the classifier can be trained in another process (see EnsembleClassifier's `train_workers`),
+    # the classifier and the training data are pickled to the worker process and the trained classifier is pickled back
+    parallel_train = True
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.confident_threshold = kwargs.get('confident_threshold', NLU_CONFIDENT_THRESHOLD)
@@ -17,3 +23,22 @@ class Classifier(BaseComponent):
 
     def predict(self):
         raise NotImplementedError('Subclass must implement this')
+
+    def predict_batch(self, messages: List[Message]):
+        """
+        Return the intents ranking of each message. By default call `predict`
+        on each message, override this method for batch inference.
+        """
+        return [self.predict(message) for message in messages]
+
+    def predict_probs(self, messages: List[Message]) -> np.ndarray:
+        """
+        Return the score of each intent (in the order of `self.intents`) for each message,
+        with shape (n_messages, n_intents). Scores a message has no prediction for are NaN.
+        By default built from `predict_batch`, override this method to skip building the rankings.
+        """
+        probs = np.full((len(messages), len(self.intents)), np.nan)
+        for i, ranking in enumerate(self.predict_batch(messages)):
+            for intent in ranking:
+                probs[i, self.intent2idx[intent['name']]] = intent['score']
+        return probs
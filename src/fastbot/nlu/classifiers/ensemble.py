@@ -2,11 +2,33 @@ from . import Classifier
 import numpy as np
 from fastbot.schema.nlu_data import NluData
 from fastbot.models.message import Message
-from typing import Text, List, Dict, Any
+from typing import Text, List, Dict, Any, Optional
 from sklearn.metrics import accuracy_score, f1_score
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from time import time
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+def _train_classifier(classifier: Classifier, data: NluData) -> Classifier:
+    # Run in a worker process, return the trained classifier
+    classifier.train(data)
+    return classifier
 
 
 class EnsembleClassifier(Classifier):
+    """
+    Combine the intents rankings of several classifiers.
+
+    Sub-classifiers can run in parallel:
+        - train_workers: number of processes to train the classifiers with `parallel_train`, 1 to train sequentially
+        - predict_workers: number of threads to run the classifiers' inference, 1 to run sequentially.
+            Sklearn and tflite models release the GIL in native code.
+        - predict_timeout: seconds to wait for each classifier's inference (a number or one per classifier),
+            a classifier timing out is left out of the ensemble's result. Only used with predict_workers > 1
+    """
     name = 'EnsembleClassifier'
 
     def __init__(self, classifiers: List[Classifier], strategy: Text = 'max', classifier_weights: List[float] = None, **kwargs):
@@ -23,13 +45,70 @@ class EnsembleClassifier(Classifier):
         self.classifiers = classifiers
         self.strategy = strategy
         self.weights = classifier_weights
+        # Number of intents in the rankings, None for all
+        self.ranking_size = kwargs.get('ranking_size')
+        assert self.ranking_size is None or self.ranking_size >= 2, "ranking_size must be at least 2 (ambiguity check)"
+        self._columns = None
+        self.train_workers = kwargs.get('train_workers', 1)
+        self.predict_workers = kwargs.get('predict_workers', 1)
+        self.predict_timeout = kwargs.get('predict_timeout')
+        if isinstance(self.predict_timeout, list):
+            assert len(self.predict_timeout) == len(classifiers), "Mismatch size between `classifiers` and `predict_timeout`"
+        self._executor = None
 
     def train(self, data: NluData):
         self._create_label_mapping(data)
-        for c in self.classifiers:
-            print(f'Start training {c.name}')
-            c.train(data)
-            print(f'Done training {c.name}')
+        parallel = []
+        if self.train_workers > 1 and len(self.classifiers) > 1:
+            parallel = [i for i, c in enumerate(self.classifiers) if c.parallel_train]
+
+        pool = ProcessPoolExecutor(min(self.train_workers, len(parallel))) if parallel else None
+        try:
+            futures = {}
+            for i in parallel:
+                print(f'Start training {self.classifiers[i].name} (worker process)')
+                futures[i] = pool.submit(_train_classifier, self.classifiers[i], data)
+
+            # The others are trained in this process while the workers are running
+            for i, c in enumerate(self.classifiers):
+                if i not in futures:
+                    print(f'Start training {c.name}')
+                    c.train(data)
+                    print(f'Done training {c.name}')
+
+            for i, future in futures.items():
+                self.classifiers[i] = future.result()
+                print(f'Done training {self.classifiers[i].name}')
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self._align()
+
+    def _run_classifiers(self, function, timeout: bool = False) -> List[Any]:
+        """
+        Call `function(classifier)` for each classifier, in parallel if predict_workers > 1.
+        With `timeout`, the result of a classifier not done after its predict_timeout is None
+        """
+        if self.predict_workers <= 1 or len(self.classifiers) < 2:
+            return [function(c) for c in self.classifiers]
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(min(self.predict_workers, len(self.classifiers)), thread_name_prefix='fastbot-ensemble')
+        start = time()
+        futures = [self._executor.submit(function, c) for c in self.classifiers]
+
+        results = []
+        for i, future in enumerate(futures):
+            limit = self.predict_timeout[i] if isinstance(self.predict_timeout, list) else self.predict_timeout
+            if not timeout or limit is None:
+                results.append(future.result())
+                continue
+            try:
+                results.append(future.result(max(0, start+limit-time())))
+            except FutureTimeoutError:
+                log.warning(f'{self.classifiers[i].name} did not answer in {limit}s, left out of {self.name}')
+                results.append(None)
+        return results
 
     def evaluate(self, test_data: NluData):
         y_true, y_pred = self.predict_test_data(test_data)
@@ -59,90 +138,138 @@ class EnsembleClassifier(Classifier):
 
         return results
 
+    def _align(self):
+        """
+        Map the intents of each classifier to the ensemble's intents, so classifiers' outputs
+        can be stacked into a (n_classifiers, n_samples, n_intents) tensor
+        """
+        if not getattr(self, 'intents', None):
+            intents = []
+            for c in self.classifiers:
+                intents.extend(intent for intent in c.intents if intent not in intents)
+            self.intents = intents
+            self.intent2idx = {intent: idx for idx, intent in enumerate(self.intents)}
+            self.idx2intent = {idx: intent for intent, idx in self.intent2idx.items()}
+            self.number_of_intent = len(self.intents)
+        self._columns = [np.asarray([self.intent2idx[intent] for intent in c.intents], dtype=int) for c in self.classifiers]
+
+    def _stack(self, outputs: List[np.ndarray]) -> np.ndarray:
+        """
+        Stack the scores of each classifier (n_samples, classifier's n_intents) in the ensemble's intents order.
+        Intents a classifier does not predict are NaN.
+        """
+        if self._columns is None:
+            self._align()
+        n_samples = outputs[0].shape[0] if outputs else 0
+        probs = np.full((len(self.classifiers), n_samples, len(self.intents)), np.nan)
+        for i, (columns, output) in enumerate(zip(self._columns, outputs)):
+            probs[i][:, columns] = output
+        return probs
+
+    def _combine(self, probs: np.ndarray):
+        """
+        Combine the stacked scores of the classifiers for each sample and intent:
+            - average: weighted average, a missing score counts as 0
+            - max: highest score, also return the index of the classifier giving it
+
+        Return (scores, classifier_indices, has_prediction)
+        """
+        missing = np.isnan(probs)
+        has_prediction = ~missing.all(axis=(0, 2))
+        if self.strategy == 'average':
+            scores = np.tensordot(np.asarray(self.weights), np.where(missing, 0, probs), axes=1)
+            scores[missing.all(axis=0)] = np.nan
+            return scores, None, has_prediction
+
+        probs = np.where(missing, -np.inf, probs)
+        best = np.argmax(probs, axis=0)
+        scores = np.take_along_axis(probs, best[np.newaxis], axis=0)[0]
+        scores[np.isinf(scores)] = np.nan
+        return scores, best, has_prediction
+
     def predict_test_data(self, test_data: NluData):
-        classifiers_outputs = {}
-        for c in self.classifiers:
-            y_true, y_pred = c.predict_test_data(test_data)
-            classifiers_outputs[c.name] = y_pred
-
-        y_pred = []
-        for i in range(len(test_data.all_samples)):
-            if self.strategy == 'average':
-                avg_pred = np.zeros((len(test_data.intent_names)))
-                for j, pred in enumerate(classifiers_outputs.values()):
-                    avg_pred += pred[i] * self.weights[j]
-                y_pred.append(avg_pred)
-
-            elif self.strategy == 'max':
-                max_confidence = 0
-                max_pred = np.zeros((len(test_data.intent_names)))
-                for pred in classifiers_outputs.values():
-                    if np.max(pred[i]) > max_confidence:
-                        max_confidence = np.max(pred[i])
-                        max_pred = pred[i]
-                y_pred.append(max_pred)
-
-        y_pred = np.asarray(y_pred)
-        return y_true, y_pred
+        outputs = self._run_classifiers(lambda c: c.predict_test_data(test_data))
+        outputs = [y_pred for _, y_pred in outputs]
+        probs = np.nan_to_num(self._stack(outputs))
+        # Classifiers' labels are indices of their own intents, the ensemble's are indices of self.intents
+        y_true = np.asarray([self.intent2idx[intent] for intent in test_data.all_intents], dtype=int)
 
-    def _process_classifers_output(self, classifiers_output: Dict[Text, Any]):
-        intents = {}
         if self.strategy == 'average':
-            # Scaled classifiers' results base on classifiers' weights
-            for i, intents_ranking in enumerate(classifiers_output.values()):
-                for intent in intents_ranking:
-                    if (not intents.get(intent['name'])):
-                        intents[intent['name']] = intent['score'] * self.weights[i]
-                    else:
-                        intents[intent['name']] += intent['score'] * self.weights[i]
-
-        elif self.strategy == 'max':
-            for i, (classifier, intents_ranking) in enumerate(classifiers_output.items()):
-                for intent in intents_ranking:
-                    if (not intents.get(intent['name'])):
-                        intents[intent['name']] = {
-                            'score': intent['score'],
-                            'classifier': classifier
-                        }
-                    else:
-                        if (intent['score'] > intents[intent['name']]['score']):
-                            intents[intent['name']] = {
-                                'score': intent['score'],
-                                'classifier': classifier
-                            }
+            y_pred = np.tensordot(np.asarray(self.weights), probs, axes=1)
+        else:
+            # Prediction of the most confident classifier of each sample
+            best = np.argmax(probs.max(axis=2), axis=0)
+            y_pred = probs[best, np.arange(probs.shape[1])]
+        return y_true, y_pred
 
-        return intents
+    def _rankings(self, scores: np.ndarray, classifiers: Optional[np.ndarray] = None, has_prediction: Optional[np.ndarray] = None):
+        """
+        Build the rankings of the top `ranking_size` intents from a (n_samples, n_intents) scores array.
+        Intents without score are left out.
+        """
+        k = self.ranking_size or scores.shape[1]
+        order = np.argsort(-np.nan_to_num(scores, nan=-np.inf), axis=1, kind='stable')[:, :k]
+        top_scores = np.take_along_axis(scores, order, axis=1).tolist()
+        top_intents = np.asarray(self.intents, dtype=object)[order].tolist()
+        if classifiers is not None:
+            names = np.asarray([c.name for c in self.classifiers], dtype=object)
+            top_classifiers = names[np.take_along_axis(classifiers, order, axis=1)].tolist()
+
+        rankings = []
+        for i in range(len(order)):
+            ranking = []
+            if has_prediction is None or has_prediction[i]:
+                for j, (intent, score) in enumerate(zip(top_intents[i], top_scores[i])):
+                    if score != score:  # NaN, no more scores
+                        break
+                    if classifiers is None:
+                        ranking.append({'name': intent, 'score': score})
+                    else:
+                        ranking.append({'name': intent, 'score': score, 'classifier': top_classifiers[i][j]})
+            rankings.append(ranking)
+        return rankings
 
     def predict(self, message: Message):
-        classifiers_output = {}
-        for c in self.classifiers:
-            c_ranking = c.predict(message)
-            message.nlu_cache.classifiers_output[c.name] = c_ranking
-            classifiers_output[c.name] = c_ranking
+        return self.predict_batch([message])[0]
 
-        intents = self._process_classifers_output(classifiers_output)
+    def predict_batch(self, messages: List[Message]):
+        outputs = self._run_classifiers(lambda c: c.predict_probs(messages), timeout=True)
+        outputs = [
+            output if output is not None else np.full((len(messages), len(c.intents)), np.nan)
+            for c, output in zip(self.classifiers, outputs)]
+        probs = self._stack(outputs)
 
-        ranking = []
-        if self.strategy == 'average':
-            for intent, score in intents.items():
-                ranking.append({'name': intent, 'score': score})
-        elif self.strategy == 'max':
-            for intent, detail in intents.items():
-                ranking.append({'name': intent, 'score': detail['score'], 'classifier': detail['classifier']})
+        # Classifiers' own rankings
+        for i, c in enumerate(self.classifiers):
+            rankings = self._rankings(probs[i], has_prediction=~np.isnan(probs[i]).all(axis=1))
+            for message, ranking in zip(messages, rankings):
+                message.nlu_cache.classifiers_output[c.name] = ranking
 
-        ranking.sort(key=lambda i: i['score'], reverse=True)
+        scores, best, has_prediction = self._combine(probs)
+        return self._rankings(scores, best, has_prediction)
 
-        return ranking
+    def _update_message(self, message: Message, ranking: List[Dict[Text, Any]]):
+        message.intents_ranking = ranking
+
+        # No intent if no classifier answered (ex: all timed out),
+        # no ambiguity check if only one intent has a score
+        if not ranking:
+            return
+        top_score = ranking[0]['score']
+        if top_score <= self.confident_threshold:
+            return
+        if len(ranking) > 1 and top_score - ranking[1]['score'] <= self.ambiguity_threshold:
+            return
+        message.intent = ranking[0]['name']
 
     def process(self, message: Message):
         ranking = self.predict(message)
+        self._update_message(message, ranking)
 
-        message.intents_ranking = ranking
-
-        # Check intent threshold
-        if (message.intents_ranking[0]['score'] > self.confident_threshold and
-                message.intents_ranking[0]['score'] - message.intents_ranking[1]['score'] > self.ambiguity_threshold):
-            message.intent = message.intents_ranking[0]['name']
+    def process_batch(self, messages: List[Message]):
+        rankings = self.predict_batch(messages)
+        for message, ranking in zip(messages, rankings):
+            self._update_message(message, ranking)
 
     def get_metadata(self):
         metadata = {
@@ -150,6 +277,9 @@ class EnsembleClassifier(Classifier):
             'type': self.component_type,
             'strategy': self.strategy,
             'classifier_weights': self.weights,
+            'ranking_size': self.ranking_size,
+            'predict_workers': self.predict_workers,
+            'predict_timeout': self.predict_timeout,
             'classifiers': [c.get_metadata() for c in self.classifiers],
             'confident_threshold': self.confident_threshold,
             'ambiguity_threshold': self.ambiguity_threshold,
@@ -173,7 +303,10 @@ class EnsembleClassifier(Classifier):
             classifier = load_component(classifier_type, path, classifier_metadata)
             classifiers.append(classifier)
 
-        ensemble_classifier = cls(classifiers, strategy, classifier_weights, name=metadata['name'])
+        ensemble_classifier = cls(classifiers, strategy, classifier_weights, name=metadata['name'],
+                                  ranking_size=metadata.get('ranking_size'),
+                                  predict_workers=metadata.get('predict_workers', 1),
+                                  predict_timeout=metadata.get('predict_timeout'))
         ensemble_classifier.confident_threshold = metadata['confident_threshold']
         ensemble_classifier.ambiguity_threshold = metadata['ambiguity_threshold']
         return ensemble_classifier
@@ -2,6 +2,7 @@ from . import Classifier
 from fastbot.schema.nlu_data import NluData
 from fastbot.models.message import Message
 from typing import Text, List, Dict, Any, Union
+from fastbot.utils.tflite import TFLiteSessionPool, TFLITE_POOL_SIZE
 from sklearn.metrics import accuracy_score, f1_score
 import numpy as np
 
@@ -11,6 +12,8 @@ INFERENCING = 'inferencing'
 
 class KerasClassifier(Classifier):
     name = 'KerasClassifier'
+    # A keras model under training can not be pickled
+    parallel_train = False
 
     def __init__(self, max_sequence_len: int = 30, batch_size: int = 64, epochs: int = 150, **kwargs):
         super().__init__(**kwargs)
@@ -138,14 +141,22 @@ class KerasClassifier(Classifier):
         return results
 
     def tflite_predict(self, inp: np.ndarray):
-        inp = np.float32(inp)
-        input_detail = self.model.get_input_details()[0]
-        output_detail = self.model.get_output_details()[0]
-        self.model.allocate_tensors()
-        self.model.set_tensor(input_detail['index'], inp)
-        self.model.invoke()
-        output = self.model.get_tensor(output_detail['index'])
-        return output
+        return self.model.predict(inp)
+
+    def _ranking(self, probs: np.ndarray):
+        ranking = []
+        for i, prob in enumerate(probs):
+            ranking.append({'name': self.idx2intent[i], 'score': prob})
+        ranking.sort(key=lambda i: i['score'], reverse=True)
+        return ranking
+
+    def _predict_probs(self, vecs: np.ndarray):
+        if self._model_mode == TRAINING:
+            return self.model.predict(vecs)  # pylint: disable=no-member
+        elif self._model_mode == INFERENCING:
+            return self.tflite_predict(vecs)
+        else:
+            raise Exception(f'model_mode must be `training` or `inferencing`')
 
     def predict(self, message: Message):
         if not message.text:
@@ -155,23 +166,22 @@ class KerasClassifier(Classifier):
         vec = self._padding(vec)
         vec = np.expand_dims(vec, axis=0)
 
-        if self._model_mode == TRAINING:
-            probs = self.model.predict(vec)[0]  # pylint: disable=no-member
-        elif self._model_mode == INFERENCING:
-            probs = self.tflite_predict(vec)[0]
-        else:
-            raise Exception(f'model_mode must be `training` or `inferencing`')
+        probs = self._predict_probs(vec)[0]
+        return self._ranking(probs)
 
-        ranking = []
-        for i, prob in enumerate(probs):
-            ranking.append({'name': self.idx2intent[i], 'score': prob})
-        ranking.sort(key=lambda i: i['score'], reverse=True)
+    def predict_probs(self, messages: List[Message]) -> np.ndarray:
+        # Messages without text have no prediction
+        probs = np.full((len(messages), len(self.intents)), np.nan)
+        indices = [i for i, message in enumerate(messages) if message.text]
+        if indices:
+            vecs = np.asarray([self._padding(messages[i].nlu_cache.dense_embedding_vector) for i in indices])
+            probs[indices] = self._predict_probs(vecs)
+        return probs
 
-        return ranking
-
-    def process(self, message: Message):
-        ranking = self.predict(message)
+    def predict_batch(self, messages: List[Message]):
+        return [self._ranking(probs) if not np.isnan(probs).all() else [] for probs in self.predict_probs(messages)]
 
+    def _update_message(self, message: Message, ranking: List[Dict[Text, Any]]):
         if ranking:
             message.nlu_cache.classifiers_output[self.name] = ranking
             message.intents_ranking = ranking
@@ -181,6 +191,15 @@ class KerasClassifier(Classifier):
                     message.intents_ranking[0]['score'] - message.intents_ranking[1]['score'] > self.ambiguity_threshold):
                 message.intent = message.intents_ranking[0]['name']
 
+    def process(self, message: Message):
+        ranking = self.predict(message)
+        self._update_message(message, ranking)
+
+    def process_batch(self, messages: List[Message]):
+        rankings = self.predict_batch(messages)
+        for message, ranking in zip(messages, rankings):
+            self._update_message(message, ranking)
+
     def get_metadata(self):
         metadata = {
             'name': self.name,
@@ -211,17 +230,10 @@ class KerasClassifier(Classifier):
 
     @classmethod
     def load(cls, path: Text, metadata: Dict[Text, Any], **kwargs):
-        try:
-            import tflite_runtime.interpreter as tflite
-        except:
-            raise ModuleNotFoundError("""
-            tflite_runtime module is soft-required for load keras model for inference. Please install it seperately.
-            Visit `https://www.tensorflow.org/lite/guide/python` for guide on how to install appropriate
-                tflite_runtime package for your OS and python's version. 
-                    """)
+        pool_size = kwargs.get('tflite_pool_size', TFLITE_POOL_SIZE)
 
         classifier = cls()
-        classifier.model = tflite.Interpreter(f'{path}/{metadata["name"]}.tflite')
+        classifier.model = TFLiteSessionPool(f'{path}/{metadata["name"]}.tflite', pool_size)
         classifier._update_properties(metadata)
         return classifier
 
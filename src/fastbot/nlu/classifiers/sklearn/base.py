@@ -2,7 +2,8 @@ from .. import Classifier
 from fastbot.schema.nlu_data import NluData
 from fastbot.models.message import Message
 from sklearn.metrics import accuracy_score, f1_score
-from typing import Text, List, Dict, Any
+from typing import Text, List, Dict, Any, Union
+from scipy import sparse
 import numpy as np
 import pickle
 
@@ -10,10 +11,15 @@ import pickle
 class SklearnClassifier(Classifier):
     name = 'SklearnClassifier'
 
+    # Whether the estimator accepts scipy sparse matrix as input.
+    # Set to False for estimators that only work with dense arrays
+    accept_sparse = True
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.reduce_method = kwargs.get('reduce_method', 'mean')
         assert self.reduce_method in ['mean', 'sum'], "reduce method can only be `mean` or `sum`"
+        self.accept_sparse = kwargs.get('accept_sparse', self.accept_sparse)
         self.model = None
 
     def _reduce(self, words_embedding: np.ndarray):
@@ -34,21 +40,41 @@ class SklearnClassifier(Classifier):
             return words_embedding.sum(axis=0)
 
     def _concat_dense_sparse(self, dense_vector: np.ndarray, sparse_vector: any):
+        """
+        Concatenate the sentence embedding (dense) and the sparse features of a sample
+        into a single row. The row is kept sparse as long as it contains sparse features.
+        """
         if sparse_vector is not None and dense_vector is not None:
-            return np.concatenate((self._reduce(dense_vector), sparse_vector.toarray()[0]), axis=0)
+            dense_row = sparse.csr_matrix(self._reduce(dense_vector).reshape((1, -1)))
+            return sparse.hstack((dense_row, sparse_vector), format='csr')
         elif sparse_vector is not None:
-            return sparse_vector.toarray()[0]
+            return sparse.csr_matrix(sparse_vector)
         elif dense_vector is not None:
             return self._reduce(dense_vector)
 
+    def _stack(self, rows: List[Union[np.ndarray, sparse.spmatrix]]):
+        """
+        Stack rows into a feature matrix. Use a CSR matrix when rows are sparse,
+        only densify if the estimator does not accept sparse input.
+        """
+        if not any(sparse.issparse(row) for row in rows):
+            return np.asarray(rows)
+
+        X = sparse.vstack([
+            row if sparse.issparse(row) else sparse.csr_matrix(row.reshape((1, -1)))
+            for row in rows], format='csr')
+        if not self.accept_sparse:
+            return X.toarray()
+        return X
+
     def _prepared_data(self, data: NluData, create_label_mapping: bool = False):
         if create_label_mapping:
             self._create_label_mapping(data)
 
-        X = [self._concat_dense_sparse(
+        X = self._stack([self._concat_dense_sparse(
             sample.nlu_cache.dense_embedding_vector,
             sample.nlu_cache.sparse_embedding_vector)
-            for sample in data.all_samples]
+            for sample in data.all_samples])
         y = [self.intent2idx[intent] for intent in data.all_intents]
         return X, y
 
@@ -89,20 +115,30 @@ class SklearnClassifier(Classifier):
         }
         return results
 
-    def predict(self, message: Message):
-        embed = self._concat_dense_sparse(message.nlu_cache.dense_embedding_vector, message.nlu_cache.sparse_embedding_vector)
-        probs = self.model.predict_proba([embed])[0]
-
+    def _ranking(self, probs: np.ndarray):
         ranking = []
         for i, prob in enumerate(probs):
             ranking.append({'name': self.idx2intent[i], 'score': prob})
         ranking.sort(key=lambda i: i['score'], reverse=True)
-
         return ranking
 
-    def process(self, message: Message):
-        ranking = self.predict(message)
+    def predict(self, message: Message):
+        embed = self._concat_dense_sparse(message.nlu_cache.dense_embedding_vector, message.nlu_cache.sparse_embedding_vector)
+        probs = self.model.predict_proba(self._stack([embed]))[0]
+        return self._ranking(probs)
+
+    def predict_probs(self, messages: List[Message]) -> np.ndarray:
+        X = self._stack([self._concat_dense_sparse(
+            message.nlu_cache.dense_embedding_vector,
+            message.nlu_cache.sparse_embedding_vector)
+            for message in messages])
+        return self.model.predict_proba(X)
 
+    def predict_batch(self, messages: List[Message]):
+        y_pred = self.predict_probs(messages)
+        return [self._ranking(probs) for probs in y_pred]
+
+    def _update_message(self, message: Message, ranking: List[Dict[Text, Any]]):
         message.nlu_cache.classifiers_output[self.name] = ranking
         message.intents_ranking = ranking
 
@@ -111,6 +147,15 @@ class SklearnClassifier(Classifier):
                 message.intents_ranking[0]['score'] - message.intents_ranking[1]['score'] > self.ambiguity_threshold):
             message.intent = message.intents_ranking[0]['name']
 
+    def process(self, message: Message):
+        ranking = self.predict(message)
+        self._update_message(message, ranking)
+
+    def process_batch(self, messages: List[Message]):
+        rankings = self.predict_batch(messages)
+        for message, ranking in zip(messages, rankings):
+            self._update_message(message, ranking)
+
     def get_metadata(self):
         metadata = {
             'name': self.name,
@@ -119,6 +164,7 @@ class SklearnClassifier(Classifier):
             'confident_threshold': self.confident_threshold,
             'ambiguity_threshold': self.ambiguity_threshold,
             'reduce_method': self.reduce_method,
+            'accept_sparse': self.accept_sparse,
         }
         return metadata
 
@@ -139,6 +185,7 @@ class SklearnClassifier(Classifier):
         self.intents = metadata['intents']
         self.number_of_intent = len(self.intents)
         self.reduce_method = metadata['reduce_method']
+        self.accept_sparse = metadata.get('accept_sparse', self.accept_sparse)
         self.confident_threshold = metadata['confident_threshold']
         self.ambiguity_threshold = metadata['ambiguity_threshold']
         self.intent2idx = {intent: idx for idx, intent in enumerate(self.intents)}
@@ -1,4 +1,4 @@
-from typing import Text, Dict, Any
+from typing import Text, List, Dict, Any
 from fastbot.schema.nlu_data import NluData
 from fastbot.models.message import Message
 import pickle
@@ -9,16 +9,36 @@ class BaseComponent:
 
     requires = []
 
+    # Token features read from `nlu_cache.pos_tag` (ex: 'pos', 'dep', 'lemma'),
+    # so SpacyPipeline only runs the spacy pipes needed to compute them
+    pos_tag_features = []
+
     def __init__(self, **kwargs):
         self.name = kwargs.get('name', self.name)
         self.config = kwargs
 
+    def add_dependent(self, component: 'BaseComponent'):
+        """
+        Called by the Interpreter when `component` is added after this component in the pipeline
+        """
+        pass
+
     def train(self, data: NluData):
         raise NotImplementedError('Subclass must implement this')
 
     def process(self, message: Message):
         raise NotImplementedError('Subclass must implement this')
 
+    def process_batch(self, messages: List[Message]):
+        """
+        Process a batch of messages at once. By default call `process`
+        on each message. Override this method for components that can
+        vectorize the work over the whole batch (ex: one `transform` or
+        one `predict` call for every message)
+        """
+        for message in messages:
+            self.process(message)
+
     def evaluate(self, test_data: NluData):
         """
         Evaluate test data. For components that have internal states change
@@ -4,6 +4,7 @@ from fastbot.models.cache import NluCache
 from .component import BaseComponent
 from .classifiers import Classifier
 from .registry import load_component
+from fastbot.utils.aio import run_in_thread
 from typing import List, Text, Union, Dict, Any
 import os
 import shutil
@@ -28,6 +29,8 @@ class Interpreter:
 
     def add_component(self, component: BaseComponent) -> None:
         if self.verify_requirement(component):
+            for previous in self.pipeline:
+                previous.add_dependent(component)
             self.pipeline.append(component)
             self.pipeline_names.append(component.component_type)
 
@@ -76,6 +79,38 @@ class Interpreter:
                 component.process(message)
         return message
 
+    async def aprocess(self, message: Union[Message, str]) -> Message:
+        """
+        Run `process` in the event loop's default executor, so the event loop
+        can serve other conversations during the inference
+        """
+        return await run_in_thread(self.process, message)
+
+    def process_batch(self, messages: List[Union[Message, str]]) -> List[Message]:
+        """
+        Same as `process` but push the whole list of messages through each
+        component at once, so components can vectorize their work.
+        Messages are returned in the same order as the input.
+        """
+        messages = [Message(message) if isinstance(message, str) else message for message in messages]
+
+        pending = []
+        for message in messages:
+            # Same as `process`, skip messages with a pre-populated intent
+            # or an overridden intent
+            if message.intent:
+                continue
+            if self.override_intent and self._override_intent(message):
+                continue
+            if message.nlu_cache.classifiers_output:
+                message.nlu_cache.classifiers_output = {}
+            pending.append(message)
+
+        if pending:
+            for component in self.pipeline:
+                component.process_batch(pending)
+        return messages
+
     def __iter__(self):
         for component in self.pipeline_names:
             yield component
@@ -1,12 +1,173 @@
 from . import NamedEntities
 from fastbot.schema.nlu_data import NluData
 from fastbot.models import Message, Entity
+from fastbot.models.cache import TokenFeatures
 from typing import Dict, Text, Any, List, Optional, Tuple
+from collections import OrderedDict
+from sklearn.metrics import accuracy_score, f1_score
 import sklearn_crfsuite
+import threading
 import pickle
+import os
+
+
+# Number of sentences' features kept by CrfExtractor's feature cache, 0 to disable
+CRF_FEATURE_CACHE_SIZE = int(os.getenv('CRF_FEATURE_CACHE_SIZE', 0))
+
+# Features of a token, in TokenFeatures (column, index of the flag or None)
+WORD_FEATURES = {
+    'word.lower': ('lower', None),
+    'word.istitle': ('flags', 0),
+    'word.isupper': ('flags', 1),
+    'pos': ('pos', None),
+    'tag': ('tag', None),
+    'dep': ('dep', None),
+    'lemma': ('lemma', None),
+    'like_num': ('flags', 2),
+    'like_email': ('flags', 3),
+    'like_url': ('flags', 4),
+}
+DEFAULT_WORD_FEATURES = ['word.lower', 'word.istitle', 'word.isupper', 'pos', 'tag', 'dep', 'like_num', 'like_email', 'like_url']
+
+
+class FeatureTemplate:
+    """
+    Features of each token of a sentence: `word_features` of the token and of its `window` neighbors
+    on each side (prefixed by their relative position, ex: `-1:pos`, `+2:word.lower`),
+    `BOS`/`EOS` at the beginning/end of the sentence and the intent.
+
+    The feature names are compiled once per sentence length, the features of a token
+    are built by zipping them with the token's values followed by its neighbors' values.
+    """
+
+    def __init__(self, word_features: List[Text] = DEFAULT_WORD_FEATURES, window: int = 1):
+        for name in word_features:
+            assert name in WORD_FEATURES, f'Unknown CRF feature `{name}`, available features are {list(WORD_FEATURES)}'
+        self.word_features = list(word_features)
+        self.window = window
+        # The columns of TokenFeatures to read and where to find each feature's value in them
+        self._columns = []
+        self._getters = []
+        for name in self.word_features:
+            column, flag = WORD_FEATURES[name]
+            if column not in self._columns:
+                self._columns.append(column)
+            self._getters.append((self._columns.index(column), flag))
+        self._keys = {}
+
+    def _token_keys(self, before: int, after: int, intent: bool) -> Tuple[Text, ...]:
+        """
+        Feature names of a token with `before` and `after` neighbors
+        """
+        keys = ['bias', *self.word_features]
+        keys.extend(f'-{i}:{name}' for i in range(1, before+1) for name in self.word_features)
+        if before == 0:
+            keys.append('BOS')
+        keys.extend(f'+{i}:{name}' for i in range(1, after+1) for name in self.word_features)
+        if after == 0:
+            keys.append('EOS')
+        if intent:
+            keys.append('intent')
+        return tuple(keys)
+
+    def keys(self, length: int, intent: bool) -> List[Tuple[Text, ...]]:
+        """
+        Feature names of each token of a sentence of `length` tokens
+        """
+        keys = self._keys.get((length, intent))
+        if keys is None:
+            window = self.window
+            keys = [self._token_keys(min(i, window), min(length-1-i, window), intent) for i in range(length)]
+            self._keys[(length, intent)] = keys
+        return keys
+
+    def _values(self, sent: TokenFeatures) -> List[Tuple[Any, ...]]:
+        """
+        Values of `word_features` of each token
+        """
+        columns = []
+        for column in self._columns:
+            if column == 'lower':
+                columns.append(sent.lower)
+            elif column == 'flags':
+                columns.append(list(zip(*sent.flag_values())))
+            else:
+                columns.append(sent.strings(column))
+        return list(zip(*[columns[i] if flag is None else columns[i][flag] for i, flag in self._getters]))
+
+    def features(self, sent: Optional[TokenFeatures], intent: Optional[Text] = None) -> List[Dict[Text, Any]]:
+        if sent is None or not len(sent):
+            return []
+        values = self._values(sent)
+        n = len(values)
+        # Values of the neighbors before/after each token, nearest first
+        before = [()] + values[:-1]
+        after = values[1:] + [()]
+        for k in range(2, self.window+1):
+            before = [left + values[i-k] if i >= k else left for i, left in enumerate(before)]
+            after = [right + values[i+k] if i+k < n else right for i, right in enumerate(after)]
+
+        suffix = (intent,) if intent else ()
+        return [
+            dict(zip(keys, (1.0,) + value + (left or (True,)) + (right or (True,)) + suffix))
+            for keys, value, left, right in zip(self.keys(n, bool(intent)), values, before, after)]
+
+
+class FeatureCache:
+    """
+    Bounded LRU cache of the features of sentences keyed by (processed text, intent),
+    so training several times on the same data or evaluating it does not rebuild the features.
+    The features depend on the SpacyPipeline before the CrfExtractor, `clear()` the cache if it changes.
+    """
+
+    def __init__(self, max_size: int = CRF_FEATURE_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[Text, Optional[Text]]) -> Optional[List[Dict[Text, Any]]]:
+        with self._lock:
+            features = self._entries.get(key)
+            if features is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return features
+
+    def set(self, key: Tuple[Text, Optional[Text]], features: List[Dict[Text, Any]]):
+        with self._lock:
+            self._entries[key] = features
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[Text, Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
 
 
 class CrfExtractor(NamedEntities):
+    """
+    Named entities extraction with a CRF on the token features of SpacyPipeline.
+
+    Parameters:
+        config: sklearn_crfsuite.CRF arguments
+        word_features: features of each token and its neighbors (see WORD_FEATURES)
+        window: number of neighbors on each side of a token
+        feature_cache_size: number of sentences' features to cache (see FeatureCache), 0 to disable
+    """
     name = 'CrfExtractor'
 
     default = {
@@ -18,28 +179,60 @@ class CrfExtractor(NamedEntities):
     }
 
     requires = ['SpacyPipeline']
+    pos_tag_features = ['pos', 'tag', 'dep']
 
     def __init__(self, config: Dict[Text, Any] = {}, confidence_threshold: int = 0.7, **kwargs):
         super().__init__(**kwargs)
         args = {**self.default, **config}
         self.model = kwargs.get("model", sklearn_crfsuite.CRF(**args))
         self.confidence_threshold = confidence_threshold
+        self.template = FeatureTemplate(kwargs.get('word_features', DEFAULT_WORD_FEATURES), kwargs.get('window', 1))
+        # Token features SpacyPipeline has to compute for this template
+        self.pos_tag_features = [name for name in self.template.word_features if name in TokenFeatures.CATEGORIES]
+        self.feature_cache_size = kwargs.get('feature_cache_size', CRF_FEATURE_CACHE_SIZE)
+        self.feature_cache = FeatureCache(self.feature_cache_size) if self.feature_cache_size > 0 else None
+
+    def _features(self, message: Message, intent: Optional[Text] = None) -> List[Dict[Text, Any]]:
+        if self.feature_cache is None:
+            return self.template.features(message.nlu_cache.token_features, intent)
+        key = (message.nlu_cache.processed_text, intent)
+        features = self.feature_cache.get(key)
+        if features is None:
+            features = self.template.features(message.nlu_cache.token_features, intent)
+            self.feature_cache.set(key, features)
+        return features
 
     def train(self, data: NluData):
-        sents = [sample.nlu_cache.pos_tag for sample in data.all_samples]
-        X = [self._sent2features(s, intent) for s, intent in zip(sents, data.all_intents)]
-        y = [self._sent2labels(s) for s in sents]
+        samples = data.all_samples
+        X = [self._features(sample, intent) for sample, intent in zip(samples, data.all_intents)]
+        y = [self._sent2labels(sample.nlu_cache.token_features) for sample in samples]
         self.model.fit(X, y)
 
     def evaluate(self, test_data: NluData):
-        pass
+        samples = test_data.all_samples
+        X = [self._features(sample, intent) for sample, intent in zip(samples, test_data.all_intents)]
+        y_true = [label for sample in samples for label in self._sent2labels(sample.nlu_cache.token_features)]
+        y_pred = [label for labels in self.model.predict(X) for label in labels]
+        return {
+            'scores': {
+                'acc': accuracy_score(y_true, y_pred),
+                'f1': f1_score(y_true, y_pred, average='weighted')
+            }
+        }
 
     def process(self, message: Message):
-        feature = self._sent2features(message.nlu_cache.pos_tag, message.intent)
+        feature = self._features(message, message.intent)
         pred = self.model.predict_marginals_single(feature)
         pred_score = [max(w.items(), key=lambda x:x[1]) for w in pred]
         message.entities.extend(self.convert_to_entity(pred_score, message))
 
+    def process_batch(self, messages: List[Message]):
+        features = [self._features(message, message.intent) for message in messages]
+        preds = self.model.predict_marginals(features)
+        for message, pred in zip(messages, preds):
+            pred_score = [max(w.items(), key=lambda x:x[1]) for w in pred]
+            message.entities.extend(self.convert_to_entity(pred_score, message))
+
     def convert_to_entity(self, result: List[Tuple[Text, float]], message: Message):
 
         entities = []
@@ -58,24 +251,28 @@ class CrfExtractor(NamedEntities):
                 confidence=entity['confidence']
             ))
 
-        for i, (feature, (result, score)) in enumerate(zip(message.nlu_cache.pos_tag, result), 1):
-            if result.startswith('B'):
+        token_features = message.nlu_cache.token_features
+        if token_features is None:
+            return entities
+        offsets = zip(token_features.start.tolist(), token_features.end.tolist())
+        for i, ((start, end), (label, score)) in enumerate(zip(offsets, result), 1):
+            if label.startswith('B'):
                 if entity_name != 'None':
                     _add_entity()
-                entity_name = '-'.join(result.split('-')[1:])
+                entity_name = '-'.join(label.split('-')[1:])
                 entity = {
                     'entity': entity_name,
-                    'start': feature['start'],
-                    'end': feature['end'],
+                    'start': start,
+                    'end': end,
                     'extractor': 'CrfExtractor',
                     'confidence': score}
-            elif result.startswith('O'):
+            elif label.startswith('O'):
                 if entity_name != 'None':
                     _add_entity()
                 entity_name = 'None'
                 entity = {}
-            elif result.startswith('I'):
-                entity['end'] = feature['end']
+            elif label.startswith('I'):
+                entity['end'] = end
 
             if i == len(result):
                 if entity_name != 'None':
@@ -84,66 +281,17 @@ class CrfExtractor(NamedEntities):
         entities = [e for e in entities if e.confidence > self.confidence_threshold]
         return entities
 
-    def _word2features(self, sent: List[Dict[Text, Text]], i: int, intent: Optional[Text] = None):
-        word = sent[i]['word']
-        features = {
-            'bias': 1.0,
-            'word.lower': word.lower(),
-            'word.istitle': word.istitle(),
-            'word.isupper': word.isupper(),
-            'pos': sent[i]['pos'],
-            'tag': sent[i]['tag'],
-            'dep': sent[i]['dep'],
-            'like_num': sent[i]['like_num'],
-            'like_email': sent[i]['like_email'],
-            'like_url': sent[i]['like_url'],
-        }
-        if i > 0:
-            word_b = sent[i-1]['word']
-            features.update({
-                '-1:word.lower': word_b.lower(),
-                '-1:word.istitle': word_b.istitle(),
-                '-1:word.isupper': word_b.isupper(),
-                '-1:pos': sent[i-1]['pos'],
-                '-1:tag': sent[i-1]['tag'],
-                '-1:dep': sent[i-1]['dep'],
-                '-1:like_num': sent[i-1]['like_num'],
-                '-1:like_email': sent[i-1]['like_email'],
-                '-1:like_url': sent[i-1]['like_url'],
-            })
-        else:
-            features['BOS'] = True
-
-        if i < len(sent)-1:
-            word_a = sent[i+1]['word']
-            features.update({
-                '+1:word.lower': word_a.lower(),
-                '+1:word.istitle': word_a.istitle(),
-                '+1:word.isupper': word_a.isupper(),
-                '+1:pos': sent[i+1]['pos'],
-                '+1:tag': sent[i+1]['tag'],
-                '+1:dep': sent[i+1]['dep'],
-                '+1:like_num': sent[i+1]['like_num'],
-                '+1:like_email': sent[i+1]['like_email'],
-                '+1:like_url': sent[i+1]['like_url'],
-            })
-        else:
-            features['EOS'] = True
-        if intent:
-            features['intent'] = intent
-        return features
-
-    def _sent2features(self, sent: List[Dict], intent: Optional[Text] = None):
-        return [self._word2features(sent, i, intent) for i in range(len(sent))]
-
-    def _sent2labels(self, sent: List[Dict]):
-        return [sent['ner'] for sent in sent]
+    def _sent2labels(self, sent: TokenFeatures):
+        return sent.ner or [None]*len(sent)
 
     def get_metadata(self):
         return {
             'name': self.name,
             'type': self.component_type,
             'confidence_threshold': self.confidence_threshold,
+            'word_features': self.template.word_features,
+            'window': self.template.window,
+            'feature_cache_size': self.feature_cache_size,
         }
 
     def save(self, path: Text):
@@ -154,4 +302,7 @@ class CrfExtractor(NamedEntities):
     def load(cls, path: Text, metadata: Dict[Text, Any], **kwargs):
         with open(f'{path}/{metadata["name"]}.pkl', 'rb') as fp:
             model = pickle.load(fp)
-        return cls(confidence_threshold=metadata["confidence_threshold"], model=model)
+        return cls(confidence_threshold=metadata["confidence_threshold"], model=model,
+                   word_features=metadata.get('word_features', DEFAULT_WORD_FEATURES),
+                   window=metadata.get('window', 1),
+                   feature_cache_size=metadata.get('feature_cache_size', CRF_FEATURE_CACHE_SIZE))
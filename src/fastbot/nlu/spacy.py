@@ -1,15 +1,87 @@
 from .component import BaseComponent
 from fastbot.models.nlu_data import NluData, Sample, TRAIN_DATA
 from fastbot.models.message import Message, Entity
-from typing import Text, List, Dict, Any, Optional, Union
+from fastbot.models.cache import TokenFeatures, vocabulary
+from typing import Text, List, Dict, Any, Optional, Union, Tuple, Callable
 import spacy
+from spacy.attrs import POS, TAG, DEP, LEMMA, IS_TITLE, IS_UPPER, LIKE_NUM, LIKE_EMAIL, LIKE_URL, IDX, LENGTH
 import numpy as np
+import threading
+import weakref
 import logging
 import random
+import os
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+SPACY_BATCH_SIZE = int(os.getenv('SPACY_BATCH_SIZE', 256))
+SPACY_N_PROCESS = int(os.getenv('SPACY_N_PROCESS', 1))
+
+# Spacy pipes needed to compute each feature. Only these (well-known) pipes are ever excluded,
+# others pipes of the model are always loaded
+EMBEDDING_PIPES = ['tok2vec', 'transformer']
+FEATURE_PIPES = {
+    'pos': EMBEDDING_PIPES + ['tagger', 'morphologizer', 'attribute_ruler'],
+    'tag': EMBEDDING_PIPES + ['tagger', 'morphologizer', 'attribute_ruler'],
+    'dep': EMBEDDING_PIPES + ['parser'],
+    'lemma': EMBEDDING_PIPES + ['tagger', 'morphologizer', 'attribute_ruler', 'lemmatizer', 'trainable_lemmatizer'],
+    'entities': EMBEDDING_PIPES + ['ner', 'entity_ruler', 'span_ruler'],
+    # token.vector fallback to the tok2vec output for models without static vectors
+    'vector': EMBEDDING_PIPES,
+}
+KNOWN_PIPES = set(pipe for pipes in FEATURE_PIPES.values() for pipe in pipes) | {'senter'}
+POS_TAG_FEATURES = ['pos', 'tag', 'dep', 'lemma']
+
+# Token attributes stored in TokenFeatures: categories, flags (in TokenFeatures.FLAGS order) and offsets
+TOKEN_ATTRS = [POS, TAG, DEP, LEMMA, IS_TITLE, IS_UPPER, LIKE_NUM, LIKE_EMAIL, LIKE_URL, IDX, LENGTH]
+FLAG_BITS = np.array([1 << bit for bit in range(5)], dtype=np.uint64)
+# Spacy string hashes of the pos, tag and dep labels to `vocabulary` ids, hashes do not depend on the model.
+# Bounded by the labels of the models, lemmas are not interned
+_hash_ids: Dict[int, int] = {}
+
+
+def _intern(hashes: List[int], strings: spacy.strings.StringStore) -> List[int]:
+    for key in set(hashes).difference(_hash_ids):
+        _hash_ids[key] = vocabulary.id(strings[key])
+    return [_hash_ids[key] for key in hashes]
+
+
+class SpacyModelRegistry:
+    """
+    Spacy models shared by every SpacyPipeline of the process (ex: several Interpreters),
+    keyed by (language model, excluded pipes). A model is loaded by the first `acquire`
+    and dropped when the last user `release` it.
+    """
+
+    def __init__(self):
+        self._models: Dict[Tuple, List] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: Tuple, loader: Callable[[], spacy.language.Language]) -> spacy.language.Language:
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is None:
+                entry = [loader(), 0]
+                self._models[key] = entry
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, key: Tuple):
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._models[key]
+
+    def stats(self):
+        with self._lock:
+            return {' '.join([key[0], *key[1]]): count for key, (_, count) in self._models.items()}
+
+
+model_registry = SpacyModelRegistry()
+
 
 class SpacyPipeline(BaseComponent):
     """
@@ -20,7 +92,17 @@ class SpacyPipeline(BaseComponent):
         - Pos Tagging
         - Dependency Parsing
 
-    Enable 
+    Only the spacy pipes needed by the enabled tasks are loaded. With pos tagging, the token features
+    to compute are `token_features` or the `pos_tag_features` of the components after this one
+    in the Interpreter (ex: CrfExtractor needs 'pos', 'tag', 'dep'), or all of 'pos', 'tag', 'dep', 'lemma'
+    if none of them declares its features.
+    The model is loaded on first use, from the process-wide `model_registry`: pipelines using the same
+    language model and pipes share the same spacy Language object.
+
+    `n_process` > 1 (or -1 for one per CPU) runs `nlp.pipe` in worker processes, only for inputs of more
+    than one batch (training, large batches). The model is pickled to the workers: its custom components
+    must be importable by them, and with the `spawn` start method (macOS, Windows) the program's entry point
+    must be guarded by `if __name__ == '__main__':`.
     """
 
     name = 'SpacyPipeline'
@@ -45,7 +127,15 @@ class SpacyPipeline(BaseComponent):
         self.pos_tagging = pos_tagging
         self.auto_download = auto_download
         self.entity_dimensions = kwargs.get("entity_dimensions", [])
-        self.model = self.load_model()
+        # nlp.pipe settings for training and batch inference
+        self.batch_size = kwargs.get("batch_size", SPACY_BATCH_SIZE)
+        self.n_process = kwargs.get("n_process", SPACY_N_PROCESS)
+        assert self.n_process == -1 or self.n_process >= 1, "n_process must be -1 (one per CPU) or at least 1"
+        self.token_features = kwargs.get("token_features")
+        self._dependent_features = set()
+        self._model = None
+        self._model_key = None
+        self._release = None
         if self.all_tasks:
             self.named_entities = True
             self.vectorization = True
@@ -54,9 +144,59 @@ class SpacyPipeline(BaseComponent):
         elif self.pos_tagging:
             self.tokenization = True
 
+    @property
+    def model(self):
+        if self._model is None:
+            key = (self.language_model, tuple(self.excluded_pipes()))
+            self._model = model_registry.acquire(key, self.load_model)
+            self._model_key = key
+            # Release the model when the pipeline is garbage collected
+            self._release = weakref.finalize(self, model_registry.release, key)
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self.release_model()
+        self._model = model
+
+    def release_model(self):
+        """
+        Give the shared model back to the registry, it is loaded again on next use
+        """
+        if self._release is not None:
+            self._release()
+            self._release = None
+        self._model = None
+        self._model_key = None
+
+    def add_dependent(self, component: BaseComponent):
+        if not component.pos_tag_features:
+            return
+        self.tokenization = True
+        self.pos_tagging = True
+        self._dependent_features.update(component.pos_tag_features)
+        # Reload if the model is already loaded without the pipes needed by the component
+        if self._model_key is not None and self._model_key[1] != tuple(self.excluded_pipes()):
+            self.release_model()
+
+    def needed_features(self) -> List[Text]:
+        features = []
+        if self.pos_tagging:
+            features.extend(self.token_features or sorted(self._dependent_features) or POS_TAG_FEATURES)
+        if self.named_entities:
+            features.append('entities')
+        if self.vectorization:
+            features.append('vector')
+        return features
+
+    def excluded_pipes(self) -> List[Text]:
+        needed = set(pipe for feature in self.needed_features() for pipe in FEATURE_PIPES[feature])
+        return sorted(KNOWN_PIPES - needed)
+
     def load_model(self):
+        exclude = self.excluded_pipes()
         try:
-            return spacy.load(self.language_model)
+            return spacy.load(self.language_model, exclude=exclude)
         except Exception as e:
             log.warning(f'{self.language_model} does not exist!')
             if self.auto_download:
@@ -64,19 +204,22 @@ class SpacyPipeline(BaseComponent):
                 import subprocess
                 download = subprocess.Popen(['python', '-m', 'spacy', 'download', self.language_model])
                 download.wait()
-                return spacy.load(self.language_model)
+                return spacy.load(self.language_model, exclude=exclude)
             else:
                 raise e
 
-    def _tokenize(self, doc: spacy.tokens.Doc, message: Union[Message, Sample]):
+    def _extract_features(self, doc: spacy.tokens.Doc, message: Union[Message, Sample]):
+        """
+        Tokenization, vectorization and pos tagging from the tokens of the doc, then the named entities
+        """
+        words = [token.text for token in doc] if self.tokenization or self.pos_tagging else None
         if self.tokenization:
-            message.nlu_cache.tokens = [token.text for token in doc]
-
-    def _vectorize(self, doc: spacy.tokens.Doc, message: Union[Message, Sample]):
+            message.nlu_cache.tokens = words
         if self.vectorization:
             message.nlu_cache.dense_embedding_vector = np.array([token.vector for token in doc])
+        if self.pos_tagging:
+            message.nlu_cache.token_features = self._token_features(doc, words, message)
 
-    def _extract_entities(self, doc: spacy.tokens.Doc, message: Union[Message, Sample]):
         if self.named_entities:
             for ent in doc.ents:
                 if ent.label_ in self.entity_dimensions or not self.entity_dimensions:
@@ -87,29 +230,32 @@ class SpacyPipeline(BaseComponent):
                         ent.text,
                         self.component_type))
 
-    def _pos_tagging(self, doc: spacy.tokens.Doc, message: Union[Message, Sample]):
-        if self.pos_tagging:
-            pos_tag = []
+    def _token_features(self, doc: spacy.tokens.Doc, words: List[Text], message: Union[Message, Sample]) -> TokenFeatures:
+        """
+        Read the token attributes of the doc as columns (one array per attribute).
+        Only the categories in `needed_features` are read, the others are left empty
+        """
+        features = self.needed_features()
+        values = doc.to_array(TOKEN_ATTRS)
+        categories = np.zeros((3, len(words)), dtype=np.int32)
+        for i, column in enumerate(TokenFeatures.INTERNED):
+            if column in features:
+                categories[i] = _intern(values[:, i].tolist(), doc.vocab.strings)
+        lemma = None
+        if 'lemma' in features:
+            strings = doc.vocab.strings
+            lemma = [strings[key] for key in values[:, 3].tolist()]
+        flags = (values[:, 4:9] @ FLAG_BITS).astype(np.uint8)
+        offsets = np.array([values[:, 9], values[:, 9]+values[:, 10]], dtype=np.int32).reshape(2, len(words))
+
+        ner = None
+        if isinstance(message, Sample):
+            ner = []
             entity = 'None'
-            for token in doc:
-                features = {
-                    'word': token.text,
-                    'pos': token.pos_,
-                    'tag': token.tag_,
-                    'dep': token.dep_,
-                    'like_num': token.like_num,
-                    'like_email': token.like_email,
-                    'like_url': token.like_url,
-                    'lemma': token.lemma_,
-                    'start': token.idx,
-                    'end': token.idx+len(token),
-                    'ner': None
-                }
-                if (isinstance(message, Sample)):
-                    ner, entity = self._parse_custom_ner(message, token.text, entity)
-                    features['ner'] = ner
-                pos_tag.append(features)
-            message.nlu_cache.pos_tag = pos_tag
+            for text in words:
+                label, entity = self._parse_custom_ner(message, text, entity)
+                ner.append(label)
+        return TokenFeatures(words, categories, flags, offsets, lemma=lemma, ner=ner)
 
     def _parse_custom_ner(self,
                           message: Sample,
@@ -126,20 +272,26 @@ class SpacyPipeline(BaseComponent):
                     return f'B-{e.entity}', e.entity
         return 'O', 'None'
 
+    def _pipe(self, messages: List[Union[Message, Sample]]):
+        """
+        Run the messages through `nlp.pipe` by batches of `batch_size`, with `n_process` processes
+        if there is more than one batch (starting the workers costs more than a single batch)
+        """
+        texts = (message.nlu_cache.processed_text for message in messages)
+        n_process = self.n_process if len(messages) > self.batch_size else 1
+        docs = self.model.pipe(texts, batch_size=self.batch_size, n_process=n_process)
+        for doc, message in zip(docs, messages):
+            self._extract_features(doc, message)
+
     def train(self, data: NluData):
-        for sample in data.all_samples:
-            doc = self.model(sample.nlu_cache.processed_text)
-            self._tokenize(doc, sample)
-            self._vectorize(doc, sample)
-            self._extract_entities(doc, sample)
-            self._pos_tagging(doc, sample)
+        self._pipe(data.all_samples)
 
     def process(self, message: Message):
         doc = self.model(message.nlu_cache.processed_text)
-        self._tokenize(doc, message)
-        self._vectorize(doc, message)
-        self._extract_entities(doc, message)
-        self._pos_tagging(doc, message)
+        self._extract_features(doc, message)
+
+    def process_batch(self, messages: List[Message]):
+        self._pipe(messages)
 
     def get_metadata(self):
         return {
@@ -153,6 +305,9 @@ class SpacyPipeline(BaseComponent):
             "pos_tagging": self.pos_tagging,
             "auto_download": self.auto_download,
             "entity_dimensions": self.entity_dimensions,
+            "batch_size": self.batch_size,
+            "n_process": self.n_process,
+            "token_features": self.token_features,
         }
 
     def save(self, path: Text):
@@ -56,10 +56,14 @@ class ExternalVectorizer(Vectorizer):
                 sample.nlu_cache.dense_embedding_vector = result
 
     def process(self, message: Message):
+        self.process_batch([message])
+
+    def process_batch(self, messages: List[Message]):
         request_data = [{
             'raw_text': message.text,
             'processed_text': message.nlu_cache.processed_text,
             'tokens': message.nlu_cache.tokens
-        }]
+        } for message in messages]
         results = self._vectorized(request_data)
-        message.nlu_cache.dense_embedding_vector = results[0]
+        for message, result in zip(messages, results):
+            message.nlu_cache.dense_embedding_vector = result
@@ -29,25 +29,22 @@ class TfidfVectorizer(Vectorizer):
                 sample.nlu_cache.sparse_embedding_vector = embed
 
     def evaluate(self, test_data: NluData):
-        for sample in test_data.all_samples:
-            embed = self.model.transform([sample.nlu_cache.processed_text])[0]
-            if sample.nlu_cache.sparse_embedding_vector != None:
-                sample.nlu_cache.sparse_embedding_vector = hstack((
-                    sample.nlu_cache.sparse_embedding_vector,
+        self.process_batch(test_data.all_samples)
+
+    def process(self, message: Message):
+        self.process_batch([message])
+
+    def process_batch(self, messages: List[Message]):
+        texts = [message.nlu_cache.processed_text for message in messages]
+        embeds = self.model.transform(texts)
+        for message, embed in zip(messages, embeds):
+            if message.nlu_cache.sparse_embedding_vector != None:
+                message.nlu_cache.sparse_embedding_vector = hstack((
+                    message.nlu_cache.sparse_embedding_vector,
                     embed
                 ))
             else:
-                sample.nlu_cache.sparse_embedding_vector = embed
-
-    def process(self, message: Message):
-        embed = self.model.transform([message.nlu_cache.processed_text])[0]
-        if message.nlu_cache.sparse_embedding_vector != None:
-            message.nlu_cache.sparse_embedding_vector = hstack((
-                message.nlu_cache.sparse_embedding_vector,
-                embed
-            ))
-        else:
-            message.nlu_cache.sparse_embedding_vector = embed
+                message.nlu_cache.sparse_embedding_vector = embed
 
     def save(self, path: Text):
         with open(f'{path}/{self.name}.pkl', 'wb') as fp:
@@ -37,6 +37,7 @@ class ListEntityConfigSchema(BaseSchema):
     fuzzy_match = fields.Bool(default=False)
     fuzzy_match_threshold = fields.Float(default=75.0)
     fuzzy_match_min_search_length = fields.Integer(default=5)
+    fuzzy_match_max_candidates = fields.Integer(default=10)
 
 
 class RegexEntityConfigSchema(BaseSchema):
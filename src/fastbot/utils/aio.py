@@ -0,0 +1,40 @@
+from typing import Any, Callable
+import functools
+import asyncio
+import inspect
+
+
+async def run_in_thread(func: Callable, *args, **kwargs) -> Any:
+    """
+    Run a blocking function in the event loop's default executor
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+async def maybe_await(value: Any) -> Any:
+    """
+    Await the value if it is awaitable (ex: result of a hook defined as a coroutine)
+    """
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+def run_sync(value: Any) -> Any:
+    """
+    Resolve the value of a hook defined as a coroutine from synchronous code.
+    """
+    if not inspect.isawaitable(value):
+        return value
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_await(value))
+    if inspect.iscoroutine(value):
+        value.close()
+    raise RuntimeError('Cannot run a coroutine hook with the synchronous API inside a running event loop, use the async API instead (ex: Agent.aprocess)')
+
+
+async def _await(value: Any) -> Any:
+    return await value
@@ -0,0 +1,78 @@
+from typing import Text, Optional
+from queue import LifoQueue
+import numpy as np
+import os
+
+
+TFLITE_POOL_SIZE = int(os.getenv('TFLITE_POOL_SIZE', 1))
+
+
+def import_tflite():
+    try:
+        import tflite_runtime.interpreter as tflite
+    except:
+        raise ModuleNotFoundError("""
+            tflite_runtime module is soft-required for load keras model for inference. Please install it seperately.
+            Visit `https://www.tensorflow.org/lite/guide/python` for guide on how to install appropriate
+                tflite_runtime package for your OS and python's version.
+                    """)
+    return tflite
+
+
+class TFLiteSession:
+    """
+    A prepared tflite interpreter. Tensors are allocated once when the session is
+    created and the input/output tensor indices are cached. The input tensor is only
+    resized (and re-allocated) when the batch size changes.
+
+    A session is NOT thread-safe, use TFLiteSessionPool to share a model between threads.
+    """
+
+    def __init__(self, model_path: Text, num_threads: Optional[int] = None):
+        tflite = import_tflite()
+        self.interpreter = tflite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+
+        input_detail = self.interpreter.get_input_details()[0]
+        output_detail = self.interpreter.get_output_details()[0]
+        self.input_index = input_detail['index']
+        self.input_shape = list(input_detail['shape'])
+        self.input_dtype = input_detail['dtype']
+        self.output_index = output_detail['index']
+
+    def _resize(self, batch_size: int):
+        self.input_shape[0] = batch_size
+        self.interpreter.resize_tensor_input(self.input_index, self.input_shape)
+        self.interpreter.allocate_tensors()
+
+    def predict(self, inp: np.ndarray) -> np.ndarray:
+        inp = np.asarray(inp, dtype=self.input_dtype)
+        if inp.shape[0] != self.input_shape[0]:
+            self._resize(inp.shape[0])
+        self.interpreter.set_tensor(self.input_index, inp)
+        self.interpreter.invoke()
+        # get_tensor return a copy, safe to use after the session is released
+        return self.interpreter.get_tensor(self.output_index)
+
+
+class TFLiteSessionPool:
+    """
+    Thread-safe pool of TFLiteSession of the same model.
+    Each call borrows a session for the duration of the inference, so up to `pool_size`
+    threads can run inference in parallel without contention.
+    """
+
+    def __init__(self, model_path: Text, pool_size: int = TFLITE_POOL_SIZE, num_threads: Optional[int] = None):
+        assert pool_size >= 1, 'pool_size must be equal or greater than 1'
+        self.model_path = model_path
+        self.pool_size = pool_size
+        self._sessions = LifoQueue(maxsize=pool_size)
+        for _ in range(pool_size):
+            self._sessions.put(TFLiteSession(model_path, num_threads))
+
+    def predict(self, inp: np.ndarray) -> np.ndarray:
+        session = self._sessions.get()
+        try:
+            return session.predict(inp)
+        finally:
+            self._sessions.put(session)
@@ -0,0 +1,144 @@
+from fastbot.dialog.agent import Agent
+from fastbot.dialog.controller import DialogController
+from fastbot.dialog.context.memory import MemoryContextManager
+from fastbot.dialog.nodes.base import BaseNode
+from fastbot.dialog.nodes.status import NodeStatus, NodeResult
+from fastbot.models import Message, Response
+from fastbot.utils.aio import run_sync
+import asyncio
+import pytest
+
+
+class HooksNode(BaseNode):
+    """
+    Node with on_enter/on_exit results, hooks are coroutines with `coroutines=True`
+    """
+
+    def __init__(self, name, coroutines=False, **kwargs):
+        super().__init__(name, **kwargs)
+        self.coroutines = coroutines
+        self.messages = 0
+
+    def _result(self, value):
+        if not self.coroutines:
+            return value
+
+        async def _hook():
+            await asyncio.sleep(0)
+            return value
+        return _hook()
+
+    def on_enter(self, context):
+        return self._result(NodeResult(NodeStatus.WAITING) if self.messages == 0 and context.get_data(self.name).get('ask') else None)
+
+    def on_message(self, context):
+        self.messages += 1
+        context.add_response(Response(f'{self.name} {self.messages}'))
+        return self._result(NodeResult(NodeStatus.DONE))
+
+    def on_exit(self, context):
+        return self._result(NodeResult(NodeStatus.DONE))
+
+
+def new_context():
+    context = MemoryContextManager()
+    context.create_turn_context(Message('hello'))
+    return context
+
+
+def history(context):
+    return [step.hash for step in context.get_history()]
+
+
+@pytest.mark.parametrize('coroutines', [False, True])
+def test_run_and_arun_record_the_same_steps(coroutines):
+    sync_context = new_context()
+    HooksNode('node', coroutines=coroutines).run(sync_context)
+    async_context = new_context()
+    asyncio.run(HooksNode('node', coroutines=coroutines).arun(async_context))
+    # on_exit result is recorded as an intent step, same as before the async hooks
+    assert history(sync_context) == history(async_context) == ['intent__node']
+
+
+def test_on_enter_and_on_message_steps():
+    context = new_context()
+    context.set_data('node', {'ask': True})
+    node = HooksNode('node', coroutines=True)
+    assert asyncio.run(node.arun(context)).status == NodeStatus.WAITING
+    assert history(context) == ['intent__node']
+
+    class MessageOnly(HooksNode):
+        def on_exit(self, context):
+            return None
+    MessageOnly('other').run(context)
+    assert history(context) == ['intent__node', 'action__other']
+
+
+def test_coroutine_hook_in_running_loop():
+    async def _hook():
+        return 1
+
+    async def _main():
+        with pytest.raises(RuntimeError):
+            run_sync(_hook())
+    asyncio.run(_main())
+    assert run_sync(_hook()) == 1
+    assert run_sync(2) == 2
+
+
+def make_controller(node):
+    controller = DialogController(MemoryContextManager())
+    controller.add_node(node)
+    controller.add_intent_trigger('greet', node)
+    return controller
+
+
+def greet(text='hello'):
+    message = Message(text)
+    message.intent = 'greet'
+    return message
+
+
+def test_ahandle_message():
+    controller = make_controller(HooksNode('node', coroutines=True))
+    turn = asyncio.run(controller.ahandle_message(greet(), user_id='user'))
+    assert [response.content for response in turn.responses] == ['node 1']
+    context = controller.get_user_context('user', None)
+    assert history(context) == ['intent__greet', 'intent__node']
+
+
+def test_ahandle_message_serializes_a_conversation():
+    active = []
+    overlaps = []
+
+    class SlowNode(HooksNode):
+        async def aon_message(self, context):
+            active.append(context._id)
+            overlaps.append(len(active))
+            await asyncio.sleep(0.01)
+            active.remove(context._id)
+            return self.on_message(context)
+
+    controller = make_controller(SlowNode('node'))
+
+    async def _main():
+        return await asyncio.gather(*[
+            controller.ahandle_message(greet(), user_id='user' if i < 3 else 'other')
+            for i in range(5)])
+    turns = asyncio.run(_main())
+    assert all(turn.responses for turn in turns)
+    # Messages of the other conversation run concurrently, not the ones of the same conversation
+    assert max(overlaps) == 2
+
+
+def test_agent_aprocess():
+    class Interpreter:
+        async def aprocess(self, message):
+            message.intent = 'greet'
+
+    agent = Agent.__new__(Agent)
+    agent.interpreter = Interpreter()
+    agent.controller = make_controller(HooksNode('node', coroutines=True))
+    turn = asyncio.run(agent.aprocess('hello', user_id='user'))
+    assert turn.message.intent == 'greet'
+    assert [response.content for response in turn.responses] == ['node 1']
@@ -0,0 +1,92 @@
+from fastbot.dialog.context.cache import ContextCache, CONTEXT_CACHE_SIZE
+from fastbot.dialog.context.memory import MemoryContextManager
+from fastbot.dialog.context.sqlite import SqliteContextManager
+from fastbot.dialog.controller import DialogController
+from fastbot.models import Step
+import pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('fastbot.dialog.context.cache.time.monotonic', clock)
+    return clock
+
+
+def test_lru_eviction():
+    cache = ContextCache(max_size=2)
+    cache['a'] = 'context a'
+    cache['b'] = 'context b'
+    assert cache.get('a') == 'context a'
+    cache['c'] = 'context c'
+    # b is the least recently used
+    assert list(cache) == ['a', 'c']
+    assert cache.get('b') is None
+    assert cache.stats()['evictions'] == 1
+    assert len(cache) == 2
+
+
+def test_idle_expiry(clock):
+    cache = ContextCache(max_size=None, idle_timeout=10)
+    cache['a'] = 'context a'
+    clock.now = 5
+    cache['b'] = 'context b'
+    clock.now = 12
+    assert cache.get('a') is None
+    assert cache.get('b') == 'context b'
+    clock.now = 30
+    assert cache.get('b') is None
+    assert cache.stats()['expirations'] == 2
+    assert len(cache) == 0
+
+
+def test_spill_and_rehydrate():
+    manager = MemoryContextManager()
+    spilled = {}
+
+    def spill(_id, context):
+        spilled[_id] = context.to_dict()
+
+    def rehydrate(_id):
+        if _id not in spilled:
+            return None
+        context = manager.init('user', _id)
+        context.restore(spilled.pop(_id))
+        return context
+
+    cache = ContextCache(max_size=1, spill=spill, rehydrate=rehydrate)
+    context = manager.init('user', 'a')
+    context.set_callstack('node')
+    context.set_data('node', {'slot': 1})
+    context.set_history(Step(intent='greet'))
+    cache['a'] = context
+    cache['b'] = manager.init('user', 'b')
+    assert list(spilled) == ['a']
+
+    context = cache['a']
+    assert context.callstack == ['node']
+    assert context.get_data('node') == {'slot': 1}
+    assert [step.hash for step in context.get_history()] == ['intent__greet']
+    # b is spilled in turn
+    assert list(spilled) == ['b']
+    assert cache.stats()['spills'] == 2
+    assert cache.stats()['rehydrations'] == 1
+    with pytest.raises(KeyError):
+        cache['c']
+
+
+def test_memory_contexts_are_not_evicted_by_default(tmp_path):
+    assert DialogController(MemoryContextManager()).context_managers.max_size is None
+    assert DialogController(MemoryContextManager(), context_cache_size=10).context_managers.max_size == 10
+    controller = DialogController(MemoryContextManager(), context_spill=lambda _id, context: None)
+    assert controller.context_managers.max_size == CONTEXT_CACHE_SIZE
+    controller = DialogController(SqliteContextManager(str(tmp_path/'contexts.db')))
+    assert controller.context_managers.max_size == CONTEXT_CACHE_SIZE
@@ -0,0 +1,46 @@
+from fastbot.dialog.context import history
+from fastbot.dialog.context.history import encode_history, decode_history
+from fastbot.dialog.context.memory import MemoryContextManager
+from fastbot.models import Step
+
+
+def steps(n):
+    return [Step(intent='greet', text=f'hello {i}') if i % 2 == 0 else Step(action=f'action_{i % 10}') for i in range(n)]
+
+
+def test_history_is_unbounded_by_default():
+    context = MemoryContextManager(user_id='user')
+    for step in steps(500):
+        context.set_history(step)
+    assert len(context.get_history()) == 500
+
+    context.restore(context.to_dict())
+    assert len(context.get_history()) == 500
+
+
+def test_history_size():
+    dropped = []
+    context = MemoryContextManager(user_id='user', history_size=3, history_sink=lambda ctx, steps: dropped.extend(steps))
+    for step in steps(5):
+        context.set_history(step)
+    assert [step.hash for step in context.get_history()] == ['intent__greet', 'action__action_3', 'intent__greet']
+    assert [step.hash for step in dropped] == ['intent__greet', 'action__action_1']
+
+    # The size is kept by the contexts created from the manager
+    assert context.init('other').history_size == 3
+
+
+def test_encode_decode_history():
+    original = steps(20) + [Step(action='action__with__separator')]
+    decoded = decode_history(encode_history(original))
+    assert [(s.intent, s.action, s.data) for s in decoded] == [(s.intent, s.action, s.data) for s in original]
+    # Output of Step.to_dict is also accepted
+    assert decode_history([{'intent': 'greet', 'text': 'hi'}])[0].data == {'text': 'hi'}
+
+
+def test_decoded_states_are_bounded(monkeypatch):
+    monkeypatch.setattr(history, '_states', {})
+    monkeypatch.setattr(history, 'CONTEXT_STATES_SIZE', 5)
+    decoded = decode_history([f'intent__intent_{i}' for i in range(20)])
+    assert [step.intent for step in decoded] == [f'intent_{i}' for i in range(20)]
+    assert len(history._states) == 5
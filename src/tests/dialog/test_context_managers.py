@@ -0,0 +1,114 @@
+"""
+load/save/lock contract shared by the persistent context managers
+"""
+from fastbot.dialog.context.mongo import MongoContextManager
+from fastbot.dialog.context.redis import RedisContextManager
+from fastbot.dialog.context.sqlite import SqliteContextManager
+from fastbot.models import Step
+import threading
+import asyncio
+import pytest
+
+
+@pytest.fixture(params=['mongo', 'redis', 'sqlite'])
+def manager(request, tmp_path):
+    if request.param == 'mongo':
+        mongomock = pytest.importorskip('mongomock')
+        db = mongomock.MongoClient().get_database('fastbot_test')
+        return MongoContextManager(
+            contexts_col=db.get_collection('contexts'),
+            users_col=db.get_collection('users'),
+            lock_change_stream=False)
+    if request.param == 'redis':
+        fakeredis = pytest.importorskip('fakeredis')
+        return RedisContextManager(client=fakeredis.FakeRedis(), prefix='test:')
+    return SqliteContextManager(str(tmp_path/'contexts.db'))
+
+
+def turn(context, message_id, node, value):
+    context.load(message_id)
+    context.set_data(node, value)
+    context.set_history(Step(intent='greet', text=message_id))
+    context.user_data['last'] = message_id
+    context.save(message_id)
+
+
+def test_load_and_save(manager):
+    turn(manager.init('user', 'conversation'), 'm1', 'node_a', {'a': 1})
+    turn(manager.init('user', 'conversation'), 'm2', 'node_b', {'b': 2})
+
+    context = manager.init('user', 'conversation')
+    context.load('m3')
+    assert context.get_data('node_a') == {'a': 1}
+    assert context.get_data('node_b') == {'b': 2}
+    assert [step.data['text'] for step in context.get_history()] == ['m1', 'm2']
+    assert context.user_data == {'last': 'm2'}
+    context.save('m3')
+
+    # User data is shared by the conversations of a user, not the context
+    other = manager.init('user', 'other conversation')
+    other.load('m4')
+    assert other.user_data == {'last': 'm2'}
+    assert other.get_data('node_a') == {}
+    other.save('m4')
+
+
+def test_update_user_data(manager):
+    manager.update_user_data('user', {'name': 'Alex', 'tags': ['a']})
+    context = manager.init('user', 'conversation')
+    context.load('m1')
+    assert context.user_data == {'name': 'Alex', 'tags': ['a']}
+    context.save('m1')
+
+
+def test_lock_waits_for_save(manager):
+    first = manager.init('user', 'conversation')
+    first.load('m1')
+
+    loaded = threading.Event()
+    second = manager.init('user', 'conversation')
+    thread = threading.Thread(target=lambda: (second.load('m2'), loaded.set()))
+    thread.start()
+    assert not loaded.wait(0.2)
+
+    first.set_data('node', {'from': 'm1'})
+    first.save('m1')
+    assert loaded.wait(5)
+    thread.join()
+    assert second.get_data('node') == {'from': 'm1'}
+    second.save('m2')
+
+
+def test_expired_lock(manager):
+    first = manager.init('user', 'conversation')
+    first.timeout_after = 0.05
+    first.load('m1')
+    # m2 takes the lock once it expires
+    second = manager.init('user', 'conversation')
+    second.load('m2')
+    second.set_data('node', {'from': 'm2'})
+    second.save('m2')
+
+    # m1 lost its lock to m2, its changes are dropped
+    first.set_data('node', {'from': 'm1'})
+    first.save('m1')
+    context = manager.init('user', 'conversation')
+    context.load('m3')
+    assert context.get_data('node') == {'from': 'm2'}
+    context.save('m3')
+
+
+def test_async_load_and_save(manager):
+    async def _turn(message_id):
+        context = manager.init('user', 'conversation')
+        await context.aload(message_id)
+        context.set_history(Step(intent='greet', text=message_id))
+        await context.asave(message_id)
+
+    async def _turns():
+        await asyncio.gather(*[_turn(f'm{i}') for i in range(5)])
+    asyncio.run(_turns())
+
+    context = manager.init('user', 'conversation')
+    context.load('last')
+    assert sorted(step.data['text'] for step in context.get_history()) == [f'm{i}' for i in range(5)]
@@ -0,0 +1,103 @@
+from fastbot.dialog.context.lock import LockNotifier, backoff
+from fastbot.dialog.context.mongo import MongoContextManager
+import threading
+import asyncio
+import time
+import pytest
+
+
+def test_backoff():
+    for attempt in range(10):
+        delay = min(0.5, 0.02 * 2 ** attempt)
+        assert delay / 2 <= backoff(attempt, 0.02, 0.5) <= delay
+
+
+def test_release_in_the_same_process_wakes_the_waiter():
+    notifier = LockNotifier()
+    waiter = notifier.register('context')
+    woken = []
+    thread = threading.Thread(target=lambda: woken.append(waiter.wait(10)))
+    start = time.monotonic()
+    thread.start()
+    notifier.notify('context')
+    thread.join(5)
+    assert woken == [True]
+    assert time.monotonic() - start < 5
+    notifier.unregister('context', waiter)
+    assert notifier._waiters == {}
+
+
+def test_release_before_the_wait_is_not_missed():
+    notifier = LockNotifier()
+    # Registered before the lock attempt, the release happens before the wait
+    waiter = notifier.register('context')
+    notifier.notify('context')
+    assert waiter.wait(0)
+
+    other = notifier.register('other')
+    notifier.notify('context')
+    assert not other.wait(0)
+
+
+def test_async_release_before_the_wait_is_not_missed():
+    notifier = LockNotifier()
+
+    async def _wait():
+        waiter = notifier.register('context', asyncio.get_running_loop())
+        # Released from another thread
+        thread = threading.Thread(target=notifier.notify, args=('context',))
+        thread.start()
+        thread.join()
+        await asyncio.sleep(0)
+        return await waiter.await_(0.01)
+    assert asyncio.run(_wait())
+
+
+class NoChangeStreamCollection:
+    """
+    Collection of a standalone server, change streams are not supported
+    """
+
+    def __init__(self):
+        self.watched = threading.Event()
+
+    def watch(self, pipeline):
+        self.watched.set()
+        raise RuntimeError('The $changeStream stage is only supported on replica sets')
+
+
+def test_fallback_to_polling_without_change_stream():
+    col = NoChangeStreamCollection()
+    notifier = LockNotifier(col)
+    assert notifier.change_stream
+    waiter = notifier.register('context')
+    assert col.watched.wait(5)
+    notifier._watcher.join(5)
+    assert not notifier.change_stream
+    # No notification, the wait returns after the backoff and the caller retries
+    assert not waiter.wait(0.01)
+
+
+def test_lock_released_by_another_process_is_polled():
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient().get_database('fastbot_test')
+
+    def make_manager():
+        # Each manager has its own notifier, as in two processes without change stream
+        return MongoContextManager(
+            contexts_col=db.get_collection('contexts'),
+            users_col=db.get_collection('users'),
+            lock_change_stream=False)
+    first = make_manager().init('user', 'conversation')
+    first.load('m1')
+
+    loaded = threading.Event()
+    second = make_manager().init('user', 'conversation')
+    thread = threading.Thread(target=lambda: (second.load('m2'), loaded.set()))
+    thread.start()
+    assert not loaded.wait(0.1)
+    first.set_data('node', {'from': 'm1'})
+    first.save('m1')
+    assert loaded.wait(5)
+    thread.join()
+    assert second.get_data('node') == {'from': 'm1'}
@@ -0,0 +1,179 @@
+from fastbot.dialog.context.mongo import MongoContextManager
+from fastbot.models import Step
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+
+class CountingCollection:
+    """
+    Count the commands sent to a collection
+    """
+
+    def __init__(self, collection, counter):
+        self._collection = collection
+        self._counter = counter
+
+    def __bool__(self):
+        return True
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in ['find_one', 'find_one_and_update', 'insert_one', 'update_one', 'bulk_write']:
+            return attr
+
+        def _command(*args, **kwargs):
+            self._counter.append(name)
+            return attr(*args, **kwargs)
+        return _command
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().get_database('fastbot_test')
+
+
+def make_manager(db, **kwargs):
+    return MongoContextManager(
+        contexts_col=db.get_collection('contexts'),
+        users_col=db.get_collection('users'),
+        lock_change_stream=False,
+        **kwargs)
+
+
+def turn(context, message_id, node, value):
+    context.load(message_id)
+    context.set_data(node, value)
+    context.set_history(Step(intent='greet', text=message_id))
+    context.user_data['last'] = message_id
+    context.save(message_id)
+
+
+def test_only_changes_are_written(db):
+    manager = make_manager(db, history_size=2)
+    turn(manager.init('user', 'conversation'), 'm1', 'node_a', {'a': 1})
+    context = manager.init('user', 'conversation')
+    context.load('m2')
+    context.set_data('node_b', {'b': 2})
+    context.reset_node('node_a')
+    context.set_history(Step(action='action_x'))
+    context.set_history(Step(intent='bye'))
+    update = context._context_update()
+    assert set(update['$set']) == {'lockTimeout', 'lockOwner', 'data.timestamp', 'data.node_data.node_b'}
+    assert update['$unset'] == {'data.node_data.node_a': ''}
+    assert update['$push']['data.history']['$slice'] == -2
+    context.save('m2')
+
+    document = db.get_collection('contexts').find_one({'_id': context._id})
+    assert document['data']['node_data'] == {'node_b': {'b': 2}}
+    assert document['data']['history'] == ['action__action_x', 'intent__bye']
+    assert document['lockOwner'] is None
+
+
+def loaded_context(db, **kwargs):
+    """
+    Context of a conversation saved with some node data, loaded for a new message
+    """
+    manager = make_manager(db, **kwargs)
+    context = manager.init('user', 'conversation')
+    context.load('m1')
+    context.set_data('node_a', {'a': 1})
+    context.set_status('node_a', 'done')
+    context.set_data('node_b', 'b')
+    context.save('m1')
+    context.load('m2')
+    return context
+
+
+def state_update(update):
+    # Without the lock fields
+    return {op: {key: val for key, val in fields.items() if not key.startswith('lock')} for op, fields in update.items()}
+
+
+def test_update_of_set_values(db):
+    context = loaded_context(db)
+    context.set_data('node_c', [1])
+    # Mutable values can be modified in place, reading them marks them as changed
+    context.get_data('node_a')['a'] = 2
+    # Scalars can not
+    context.get_data('node_b')
+    assert state_update(context._context_update()) == {'$set': {
+        'data.timestamp': context.timestamp,
+        'data.node_data.node_c': [1],
+        'data.node_data.node_a': {'a': 2},
+    }}
+
+
+def test_update_of_removed_values(db):
+    context = loaded_context(db)
+    context.reset_node('node_a')
+    assert state_update(context._context_update()) == {
+        '$set': {'data.timestamp': context.timestamp},
+        '$unset': {'data.node_data.node_a': '', 'data.node_status.node_a': ''},
+    }
+    context.save('m2')
+    document = db.get_collection('contexts').find_one({'_id': context._id})
+    assert document['data']['node_data'] == {'node_b': 'b'}
+    assert document['data']['node_status'] == {}
+
+
+def test_update_after_restart(db):
+    context = loaded_context(db, history_size=5)
+    context.set_history(Step(intent='greet'))
+    context.restart()
+    context.set_callstack('node_c')
+    context.set_data('node_c', {'c': 1})
+    context.set_history(Step(intent='bye'))
+    assert state_update(context._context_update()) == {'$set': {
+        'data.timestamp': context.timestamp,
+        'data.callstack': ['node_c'],
+        'data.history': ['intent__bye'],
+        'data.node_params': {},
+        'data.node_results': {},
+        'data.node_status': {},
+        'data.node_data': {'node_c': {'c': 1}},
+    }}
+
+
+def test_update_of_undottable_keys(db):
+    context = loaded_context(db)
+    context.set_data('node.with.dots', 1)
+    context.set_data('$node', 2)
+    context.reset_node('node_b')
+    context.set_history(Step(intent='greet'))
+    # node_data is rewritten entirely, the other fields are updated by key
+    assert state_update(context._context_update()) == {
+        '$set': {
+            'data.timestamp': context.timestamp,
+            'data.node_data': {'node_a': {'a': 1}, 'node.with.dots': 1, '$node': 2},
+        },
+        '$push': {'data.history': {'$each': ['intent__greet']}},
+    }
+
+
+def test_commands_per_turn(db):
+    commands = []
+    manager = MongoContextManager(
+        contexts_col=CountingCollection(db.get_collection('contexts'), commands),
+        users_col=CountingCollection(db.get_collection('users'), commands),
+        lock_change_stream=False)
+    context = manager.init('user', 'conversation')
+    assert commands == []
+    context.load('m1')
+    assert sorted(commands) == ['find_one', 'find_one_and_update']
+    commands.clear()
+    context.user_data['key'] = 'value'
+    context.save('m1')
+    assert commands == ['update_one', 'update_one']
+
+
+def test_timestamp_is_restored(db):
+    manager = make_manager(db)
+    context = manager.init('user', 'conversation')
+    context.load('m1')
+    context.timestamp = 1000.0
+    context.save('m1')
+
+    context = manager.init('user', 'conversation')
+    context.load('m2')
+    assert context.timestamp == 1000.0
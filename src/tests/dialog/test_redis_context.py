@@ -0,0 +1,50 @@
+from fastbot.dialog.context.redis import RedisContextManager
+from fastbot.models import Step
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture
+def manager():
+    return RedisContextManager(client=fakeredis.FakeRedis(), prefix='test:')
+
+
+def turn(context, message_id, node, value):
+    context.load(message_id)
+    context.set_data(node, value)
+    context.set_history(Step(intent='greet', text=message_id))
+    context.user_data['last'] = message_id
+    context.save(message_id)
+
+
+def test_save_releases_the_lock(manager):
+    context = manager.init('user', 'conversation')
+    context.load('m1')
+    assert manager.client.exists(context.lock_key)
+    context.save('m1')
+    assert not manager.client.exists(context.lock_key)
+
+
+def test_session_timeout_is_the_context_ttl(manager):
+    manager.session_timeout = 1
+    context = manager.init('user', 'conversation')
+    turn(context, 'm1', 'node', {})
+    assert 3500*1000 < manager.client.pttl(context.context_key) <= 3600*1000
+
+
+def test_lock_and_reads_are_one_transaction(manager, monkeypatch):
+    turn(manager.init('user', 'conversation'), 'm1', 'node', {'a': 1})
+    pipelines = []
+    pipeline_class = type(manager.client.pipeline())
+    execute = pipeline_class.execute
+
+    def _execute(pipe, *args, **kwargs):
+        pipelines.append((pipe.transaction, [command[0][0] for command in pipe.command_stack]))
+        return execute(pipe, *args, **kwargs)
+    monkeypatch.setattr(pipeline_class, 'execute', _execute)
+
+    context = manager.init('user', 'conversation')
+    context.load('m2')
+    assert pipelines == [(True, ['SET', 'GET', 'HGETALL'])]
+    assert context.get_data('node') == {'a': 1}
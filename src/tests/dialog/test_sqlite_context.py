@@ -0,0 +1,74 @@
+from fastbot.dialog.context.sqlite import SqliteContextManager
+from fastbot.models import Step
+import threading
+import pytest
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return SqliteContextManager(str(tmp_path/'contexts.db'))
+
+
+def test_contexts_are_persisted(manager, tmp_path):
+    context = manager.init('user', 'conversation')
+    context.load('m1')
+    context.set_data('node', {'a': 1})
+    context.save('m1')
+
+    # Another process opening the same file
+    reopened = SqliteContextManager(str(tmp_path/'contexts.db'))
+    context = reopened.init('user', 'conversation')
+    context.load('m2')
+    assert context.get_data('node') == {'a': 1}
+
+
+def test_concurrent_saves_are_batched(manager):
+    contexts = [manager.init('user', f'conversation {i}') for i in range(20)]
+    for i, context in enumerate(contexts):
+        context.load(f'm{i}')
+        context.set_history(Step(intent='greet'))
+        context.user_data[f'key {i}'] = i
+
+    commits = manager.store.commits
+    start = threading.Barrier(len(contexts))
+
+    def _save(i, context):
+        start.wait()
+        context.save(f'm{i}')
+    threads = [threading.Thread(target=_save, args=(i, context)) for i, context in enumerate(contexts)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert manager.store.commits - commits < len(contexts)
+    for i in range(len(contexts)):
+        context = manager.init('user', f'conversation {i}')
+        context.load('check')
+        assert len(context.get_history()) == 1
+    assert context.user_data == {f'key {i}': i for i in range(len(contexts))}
+
+
+def test_failed_write_does_not_fail_the_batch(manager):
+    errors = []
+    start = threading.Barrier(10)
+
+    def _write(i):
+        start.wait()
+        statements = [('INSERT INTO users (id, key, value) VALUES (?, ?, ?)', [('user', f'key {i}', str(i))])]
+        if i == 0:
+            statements.append(('INSERT INTO missing_table VALUES (?)', [(1,)]))
+        try:
+            manager.store.write(statements)
+        except Exception as e:
+            errors.append((i, e))
+    threads = [threading.Thread(target=_write, args=(i,)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [i for i, _ in errors] == [0]
+    context = manager.init('user', 'conversation')
+    context.load('m1')
+    assert sorted(context.user_data) == [f'key {i}' for i in range(1, 10)]
@@ -0,0 +1,154 @@
+from fastbot.dialog.context.write_behind import WriteBehindQueue, _queues
+from fastbot.dialog.context.mongo import MongoContextManager
+import threading
+import pytest
+
+
+class Writer:
+    """
+    Record the written entries, fail the next `failures` writes
+    """
+
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+        self.written = threading.Event()
+
+    def __call__(self, entries):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('unavailable')
+        self.batches.append(entries)
+        self.written.set()
+
+
+@pytest.fixture
+def writer():
+    return Writer()
+
+
+def test_saves_are_coalesced(writer):
+    queue = WriteBehindQueue(writer, interval=60)
+    queue.put('a', 'context a', 'm1')
+    queue.put('b', 'context b', 'm1')
+    queue.put('a', 'context a', 'm2')
+    queue.flush()
+    assert writer.batches == [[('context a', 'm2'), ('context b', 'm1')]]
+    queue.flush()
+    assert len(writer.batches) == 1
+    queue.close()
+
+
+def test_flush_size_wakes_the_writer(writer):
+    queue = WriteBehindQueue(writer, interval=60, max_size=2)
+    queue.put('a', 'context a', 'm1')
+    assert not writer.written.wait(0.1)
+    queue.put('b', 'context b', 'm1')
+    assert writer.written.wait(5)
+    assert writer.batches == [[('context a', 'm1'), ('context b', 'm1')]]
+    queue.close()
+
+
+def test_take_pending_entry(writer):
+    queue = WriteBehindQueue(writer, interval=60)
+    queue.put('a', 'context a', 'm1')
+    assert queue.take('a') == ('context a', 'm1')
+    assert queue.take('a') is None
+    queue.flush()
+    assert writer.batches == []
+    queue.close()
+
+
+def test_take_waits_for_the_write():
+    started, release = threading.Event(), threading.Event()
+
+    def writer(entries):
+        started.set()
+        release.wait()
+    queue = WriteBehindQueue(writer, interval=60)
+    queue.put('a', 'context a', 'm1')
+    flush = threading.Thread(target=queue.flush)
+    flush.start()
+    assert started.wait(5)
+
+    taken = []
+    take = threading.Thread(target=lambda: taken.append(queue.take('a')))
+    take.start()
+    take.join(0.1)
+    assert take.is_alive()
+    release.set()
+    take.join(5)
+    flush.join(5)
+    assert taken == [None]
+    queue.close()
+
+
+def test_failed_writes_are_retried_then_dropped():
+    writer = Writer(failures=10)
+    queue = WriteBehindQueue(writer, interval=60, max_retries=2)
+    queue.put('a', 'context a', 'm1')
+    queue.flush()
+    queue.flush()
+    assert queue.stats()['pending'] == 1
+    queue.flush()
+    assert queue.stats() == {'pending': 0, 'writes': 0, 'coalesced': 0, 'dropped': 1}
+
+    writer.failures = 1
+    queue.put('a', 'context a', 'm2')
+    queue.flush()
+    queue.flush()
+    assert writer.batches == [[('context a', 'm2')]]
+    queue.close()
+
+
+def test_close_flushes_and_unregisters(writer):
+    queue = WriteBehindQueue(writer, interval=60)
+    assert queue in _queues
+    queue.put('a', 'context a', 'm1')
+    queue.close()
+    assert writer.batches == [[('context a', 'm1')]]
+    assert queue not in _queues
+    with pytest.raises(AssertionError):
+        queue.put('a', 'context a', 'm2')
+
+
+def test_load_while_pending():
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient().get_database('fastbot_test')
+    written = []
+
+    def writer(entries):
+        # Same writes as MongoContextManager._bulk_save, one update at a time
+        for context, lock_owner in entries:
+            context.contexts_col.update_one({'_id': context._id, 'lockOwner': lock_owner}, context._context_update())
+            context.clear_changes()
+            written.append(lock_owner)
+    queue = WriteBehindQueue(writer, interval=60)
+    manager = MongoContextManager(
+        contexts_col=db.get_collection('contexts'),
+        users_col=db.get_collection('users'),
+        lock_change_stream=False,
+        write_behind=True,
+        write_queue=queue)
+
+    context = manager.init('user', 'conversation')
+    context.load('m1')
+    context.set_data('node', {'a': 1})
+    context.save('m1')
+    assert queue.stats()['pending'] == 1
+
+    # The same instance continues from its pending save, nothing is written
+    context.load('m2')
+    assert context.get_data('node') == {'a': 1}
+    assert queue.stats()['pending'] == 0
+    assert context.lock_owner == 'm1'
+    context.set_data('node', {'a': 2})
+    context.save('m2')
+
+    # Another instance writes the pending save first
+    other = manager.init('user', 'conversation')
+    other.load('m3')
+    assert written == ['m1']
+    assert other.get_data('node') == {'a': 2}
+    assert queue.stats()['pending'] == 0
+    queue.close()
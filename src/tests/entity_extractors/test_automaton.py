@@ -0,0 +1,91 @@
+from fastbot.entity_extractors.automaton import AhoCorasick, is_word_boundary
+from fastbot.entity_extractors.list_extractor import ListExtractor
+from fastbot.models import Message
+from fastbot.models.entity import ListEntityConfig, ListEntityItem
+import random
+import regex
+import pytest
+
+
+def old_exact_search(items, text, case_sensitive=False):
+    """
+    ListExtractor.process before the automaton (without fuzzy matching): `\\bterm\\b` regex of every term
+    of every item, longest term first. Terms are deduplicated in order to make the order deterministic
+    """
+    entities = []
+    for item in items:
+        search_terms = [item.name] + item.synonyms
+        if not case_sensitive:
+            search_terms = list(dict.fromkeys(term.lower() for term in search_terms))
+            text = text.lower()
+        search_terms.sort(key=len, reverse=True)
+        overlaps = []
+        for term in search_terms:
+            for match in regex.finditer(fr'\b{term}\b', text):
+                start, end = match.start(), match.end()
+                if not any(start <= prev_end and prev_start <= end for prev_start, prev_end in overlaps):
+                    entities.append((item.code or item.name, match.group(), start, end))
+                    overlaps.append((start, end))
+    return entities
+
+
+def exact_search(items, text, case_sensitive=False):
+    extractor = ListExtractor(ListEntityConfig('product', items, case_sensitive=case_sensitive, fuzzy_match=False))
+    return [(e.value, e.text, e.start, e.end) for e in extractor.process(Message(text))]
+
+
+@pytest.mark.parametrize('text, expected', [
+    # Word boundaries
+    ('cats and dogs', []),
+    ('a cat.', [('cat', 'cat', 2, 5)]),
+    ('ice_cream', []),
+    ('café cat', [('cat', 'cat', 5, 8)]),
+    # Non-overlapping occurrences of a term
+    ('aa aa aa', [('aa', 'aa', 0, 2), ('aa', 'aa', 3, 5), ('aa', 'aa', 6, 8)]),
+    # Longest term first, the shorter terms inside it are dropped
+    ('fly to new york city', [('NYC', 'new york city', 7, 20)]),
+    ('new york and york', [('NYC', 'new york', 0, 8), ('NYC', 'york', 13, 17)]),
+])
+def test_exact_search(text, expected):
+    items = [
+        ListEntityItem('cat'),
+        ListEntityItem('aa'),
+        ListEntityItem('new york', code='NYC', synonyms=['york', 'new york city']),
+    ]
+    assert exact_search(items, text) == expected
+    assert old_exact_search(items, text) == expected
+
+
+def test_find_all_occurrences():
+    rng = random.Random(3)
+    for _ in range(200):
+        keywords = [''.join(rng.choice('ab') for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 6))]
+        text = ''.join(rng.choice('ab ') for _ in range(rng.randint(0, 20)))
+        found = AhoCorasick(keywords).find_all(text)
+        for index, keyword in enumerate(keywords):
+            expected = [(i, i+len(keyword)) for i in range(len(text)) if text.startswith(keyword, i)]
+            assert found.get(index, []) == expected
+
+
+def test_word_boundary_same_as_regex():
+    rng = random.Random(5)
+    alphabet = ['a', 'Z', '1', '_', ' ', '.', '-', 'é', 'é', 'ก', 'ิ', '中']
+    boundary = regex.compile(r'\b')
+    for _ in range(300):
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 10)))
+        for index in range(len(text)+1):
+            assert is_word_boundary(text, index) == (boundary.match(text, index) is not None), (text, index)
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_same_result_as_regex_search(seed):
+    rng = random.Random(seed)
+    words = ['new', 'york', 'city', 'ny', 'bang', 'bangkok', 'kok', 'a', 'b1', 'x_y', 'Été']
+    items = []
+    for i in range(rng.randint(1, 5)):
+        terms = [' '.join(rng.sample(words, rng.randint(1, 2))) for _ in range(rng.randint(1, 3))]
+        items.append(ListEntityItem(terms[0], code=rng.choice([None, f'code{i}']), synonyms=terms[1:]))
+    separators = [' ', ' ', ', ', '-', '']
+    text = ''.join(rng.choice(words) + rng.choice(separators) for _ in range(rng.randint(1, 10)))
+    case_sensitive = rng.random() < 0.3
+    assert exact_search(items, text, case_sensitive) == old_exact_search(items, text, case_sensitive)
@@ -0,0 +1,103 @@
+from fastbot.entity_extractors.composite_extractor import CompositeEntitiesExtractor, SearchLimitExceeded, chain_bounds
+from fastbot.models import Entity, Message
+from fastbot.models.entity import CompositeEntityConfig
+import random
+import pytest
+
+
+def make_extractor(patterns):
+    return CompositeEntitiesExtractor(CompositeEntityConfig('composite', patterns))
+
+
+def as_tuples(entities):
+    # The permutation search returns a composite once per permutation containing it
+    return sorted(set((e.entity, e.start, e.end, str(e.value)) for e in entities))
+
+
+def test_car_composite():
+    extractor = make_extractor(['@number @color @car_make', '@color @car_make'])
+    text = 'I want 2 red toyota and a blue honda'
+    entities = [
+        Entity('number', 7, 8, 2, 'test'),
+        Entity('color', 9, 12, 'red', 'test'),
+        Entity('car_make', 13, 19, 'toyota', 'test'),
+        Entity('color', 26, 30, 'blue', 'test'),
+        Entity('car_make', 31, 36, 'honda', 'test'),
+    ]
+    message = Message(text)
+    message.entities = entities
+    assert as_tuples(extractor.process(message)) == [
+        ('composite', 7, 19, str({'number': 2, 'color': 'red', 'car_make': 'toyota'})),
+        ('composite', 26, 36, str({'color': 'blue', 'car_make': 'honda'})),
+    ]
+
+
+def random_entities(rng, n_words, n_entities, types):
+    """
+    Entities over words of 3 letters separated by a space, an entity can span several words
+    and overlap other entities
+    """
+    entities = []
+    for _ in range(n_entities):
+        start = rng.randrange(n_words)
+        end = min(n_words, start+rng.choice([1, 1, 1, 2]))
+        entities.append(Entity(rng.choice(types), start*4, end*4-1, f'{start}-{end}', 'test'))
+    return entities
+
+
+@pytest.mark.parametrize('seed', range(500))
+def test_same_result_as_permutations(seed):
+    rng = random.Random(seed)
+    types = ['a', 'b', 'c']
+    patterns = ['@a @b @c', '@a @b', '@b @c', '@c and @a', '@b']
+    extractor = make_extractor(rng.sample(patterns, rng.randint(1, 3)))
+    n_words = rng.randint(3, 8)
+    text = ' '.join(rng.choice(['abc', 'and', 'xyz']) for _ in range(n_words))
+    entities = random_entities(rng, n_words, rng.randint(1, 10), types)
+
+    assert extractor.is_simple
+    expected = extractor._find_composite_entities_by_permutations(text, entities)
+    assert as_tuples(extractor._find_composite_entities(text, entities)) == as_tuples(expected)
+
+
+def test_avoidance_search_is_bounded():
+    # Every blocker can be left out by 2 excluders, which are not compatible with each other:
+    # without memoization the search would try every combination of excluders
+    n = 18
+    blockers = [{i} for i in range(n)]
+    overlaps = [set() for _ in range(3*n)]
+    for i in range(n):
+        for excluder in (n+2*i, n+2*i+1):
+            overlaps[i].add(excluder)
+            overlaps[excluder].add(i)
+    # The last blocker can not be avoided
+    overlaps[n-1] = set()
+    chain = {3*n-1}
+    assert not CompositeEntitiesExtractor._can_avoid(blockers, chain, overlaps)
+    with pytest.raises(SearchLimitExceeded):
+        CompositeEntitiesExtractor._can_avoid(blockers, chain, overlaps, max_states=10)
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_search_limit_falls_back_to_permutations(seed):
+    rng = random.Random(seed)
+    extractor = CompositeEntitiesExtractor(
+        CompositeEntityConfig('composite', ['@a @b @c', '@a @b', '@b @c']), max_search_states=0)
+    n_words = rng.randint(3, 8)
+    message = Message(' '.join(rng.choice(['abc', 'and', 'xyz']) for _ in range(n_words)))
+    message.entities = random_entities(rng, n_words, rng.randint(1, 10), ['a', 'b', 'c'])
+    expected = extractor._find_composite_entities_by_permutations(message.text, message.entities)
+    assert as_tuples(extractor.process(message)) == as_tuples(expected)
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_chain_bounds(seed):
+    rng = random.Random(seed)
+    n_words = rng.randint(1, 8)
+    text = ' '.join('abc' for _ in range(n_words))
+    entities = sorted(random_entities(rng, n_words, rng.randint(1, 10), ['a']), key=lambda e: e.start)
+    for entity, (prefix_start, next_bound, suffix_end) in zip(entities, chain_bounds(text, entities)):
+        assert next_bound == min((e.end for e in entities if e.start > entity.end), default=len(text))
+        assert suffix_end == max((e.start for e in entities if entity.end < e.start <= next_bound), default=len(text))
+        previous_bound = max((e.start for e in entities if e.end < entity.start), default=0)
+        assert prefix_start == min((e.end for e in entities if previous_bound <= e.end < entity.start), default=0)
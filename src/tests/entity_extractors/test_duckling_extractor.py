@@ -0,0 +1,183 @@
+from fastbot.entity_extractors.duckling_extractor import DucklingExtractor
+from fastbot.entity_extractors.duckling_client import DucklingClient, CircuitBreaker
+from fastbot.entity_extractors.duckling_cache import DucklingCache, get_cache
+from fastbot.models import Message
+import asyncio
+import pytest
+
+
+NUMBER_MATCH = {'dim': 'number', 'start': 0, 'end': 1, 'body': '3', 'value': {'type': 'value', 'value': 3}}
+
+
+class FakeClient:
+    """
+    Return `results` in turn, None is a failed request
+    """
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+        self.payloads = []
+
+    def parse(self, payload):
+        self.calls += 1
+        self.payloads.append(payload)
+        return self.results.pop(0)
+
+    async def aparse(self, payload):
+        return self.parse(payload)
+
+
+def make_extractor(client, cache=None):
+    return DucklingExtractor(['number'], client=client, cache=cache or DucklingCache(max_size=10))
+
+
+def test_empty_result_is_cached():
+    client = FakeClient([])
+    extractor = make_extractor(client)
+    assert extractor.process(Message('hello')) == []
+    assert extractor.process(Message('hello')) == []
+    assert client.calls == 1
+    assert extractor.cache.stats()['hits'] == 1
+
+
+def test_failed_request_is_not_cached():
+    client = FakeClient(None, [NUMBER_MATCH])
+    extractor = make_extractor(client)
+    assert extractor.process(Message('3')) == []
+    entities = extractor.process(Message('3'))
+    assert [(e.entity, e.value) for e in entities] == [('number', 3)]
+    assert client.calls == 2
+
+
+def test_async_failed_request_is_not_cached():
+    client = FakeClient(None, [], [])
+    extractor = make_extractor(client)
+    assert asyncio.run(extractor.aprocess(Message('hello'))) == []
+    assert asyncio.run(extractor.aprocess(Message('hello'))) == []
+    assert asyncio.run(extractor.aprocess(Message('hello'))) == []
+    assert client.calls == 2
+
+
+def test_cached_result_is_shifted_to_the_text():
+    client = FakeClient([NUMBER_MATCH])
+    extractor = make_extractor(client)
+    extractor.process(Message('3'))
+    entities = extractor.process(Message('  3 '))
+    assert [(e.start, e.end) for e in entities] == [(2, 3)]
+    assert client.calls == 1
+
+
+def test_text_is_sent_as_is():
+    match = {'dim': 'distance', 'start': 0, 'end': 4, 'body': '3 KM', 'value': {'type': 'value', 'value': 3, 'unit': 'kilometre'}}
+    client = FakeClient([match])
+    extractor = DucklingExtractor(['length'], client=client, cache=DucklingCache(max_size=10))
+    entities = extractor.process(Message(' 3 KM'))
+    assert 'text=3%20KM&' in client.payloads[0]
+    assert [(e.start, e.end, e.value) for e in entities] == [(1, 5, 3)]
+
+    # Same normalized text, the match is taken from the cache and mapped to this text
+    matches = extractor._parse('3 km ', extractor.default_timezone)
+    assert [(m['start'], m['end'], m['body']) for m in matches] == [(0, 4, '3 km')]
+    assert client.calls == 1
+
+
+def test_cache_is_shared_by_options():
+    endpoint = 'http://duckling.test'
+    assert get_cache(endpoint) is get_cache(endpoint)
+    assert get_cache(endpoint, max_size=10) is get_cache(endpoint, max_size=10)
+    assert get_cache(endpoint, max_size=10) is not get_cache(endpoint, max_size=20)
+    assert get_cache(endpoint, max_size=10, ttl=5).ttl == 5
+    assert get_cache(endpoint, max_size=0) is None
+
+
+def test_without_cache():
+    client = FakeClient(None, [])
+    extractor = DucklingExtractor(['number'], client=client, cache=False)
+    assert extractor.process(Message('hello')) == []
+    assert extractor.process(Message('hello')) == []
+    assert client.calls == 2
+
+
+@pytest.mark.parametrize('error', [ConnectionError('refused'), ValueError('invalid json')])
+def test_client_failure_returns_none(error):
+    client = DucklingClient('http://localhost:8000', circuit_failures=1, circuit_reset_timeout=60)
+
+    def post(*args, **kwargs):
+        raise error
+    client.session.post = post
+    assert client.parse('text=hello') is None
+    # Open circuit
+    assert client.parse('text=hello') is None
+    assert asyncio.run(client.aparse('text=hello')) is None
+
+
+def test_client_empty_parse_returns_empty_list():
+    client = DucklingClient('http://localhost:8000')
+
+    class Response:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return []
+    client.session.post = lambda *args, **kwargs: Response()
+    assert client.parse('text=hello') == []
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('fastbot.entity_extractors.duckling_client.time.monotonic', clock)
+    return clock
+
+
+def test_circuit_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert not breaker.is_open
+    breaker.record_failure()
+    assert breaker.is_open
+    assert breaker.is_rejecting()
+    clock.now = 9
+    assert not breaker.allow()
+
+
+def test_half_open_circuit_lets_one_request_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock.now = 10
+    assert not breaker.is_rejecting()
+    assert breaker.allow()
+    # The others wait for the result of the half-open request
+    assert not breaker.allow()
+    assert breaker.is_rejecting()
+
+    # Failure re-opens the circuit for reset_timeout
+    breaker.record_failure()
+    clock.now = 19
+    assert not breaker.allow()
+    clock.now = 20
+    assert breaker.allow()
+    # Success closes it
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.allow() and breaker.allow()
+
+
+def test_only_connection_errors_and_unavailable_responses_are_retried():
+    client = DucklingClient('http://localhost:8000', max_retries=2)
+    retries = client.session.get_adapter('http://localhost:8000').max_retries
+    assert (retries.connect, retries.read, retries.status) == (2, 0, 2)
+    assert retries.is_retry('POST', 503)
+    assert not retries.is_retry('POST', 500)
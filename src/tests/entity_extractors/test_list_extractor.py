@@ -0,0 +1,95 @@
+from fastbot.entity_extractors.list_extractor import ListExtractor, WORD_PATTERN
+from fastbot.models import Message
+from fastbot.models.entity import ListEntityConfig, ListEntityItem
+from rapidfuzz import fuzz
+import random
+import pytest
+
+
+CATALOG = [
+    ListEntityItem('iphone 13 pro', synonyms=['iphone13 pro']),
+    ListEntityItem('samsung galaxy', synonyms=['galaxy s21']),
+    ListEntityItem('chocolate', code='CHOC', synonyms=['choco']),
+    ListEntityItem('strawberry'),
+    ListEntityItem('new york', synonyms=['nyc']),
+    ListEntityItem('bangkok'),
+]
+
+
+def make_extractor(items=CATALOG, **kwargs):
+    config = dict(case_sensitive=False, fuzzy_match=True, fuzzy_match_threshold=80)
+    config.update(kwargs)
+    return ListExtractor(ListEntityConfig('product', items, **config))
+
+
+def extract(extractor, text):
+    return [(e.value, e.text, round(e.confidence, 1)) for e in extractor.process(Message(text))]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('I want an iphon 13 pro please', [('iphone 13 pro', 'iphon 13 pro', 96.0)]),
+    ('samsung galaxi s21 for me', [('samsung galaxy', 'samsung galaxi', 92.9)]),
+    ('chocolat and strawbery', [('CHOC', 'chocolat', 94.1), ('strawberry', 'strawbery', 94.7)]),
+    ('fly to new yrok from Bangkok', [('new york', 'new yrok', 87.5), ('bangkok', 'bangkok', 100.0)]),
+    # The window doesn't take the surrounding words
+    ('a strawberry milkshake', [('strawberry', 'strawberry', 100.0)]),
+    # Part of a term is not a match
+    ('samsung', []),
+    ('i live in new jersey', []),
+    # Short terms are matched exactly
+    ('fly to nyc', [('new york', 'nyc', 100.0)]),
+    ('fly to nyx', []),
+    ('nothing here', []),
+])
+def test_fuzzy_match_catalog(text, expected):
+    assert extract(make_extractor(), text) == expected
+
+
+def test_fuzzy_match_threshold():
+    assert extract(make_extractor(fuzzy_match_threshold=95), 'samsung galaxi') == []
+    assert extract(make_extractor(fuzzy_match_threshold=90), 'samsung galaxi') == [('samsung galaxy', 'samsung galaxi', 92.9)]
+
+
+def test_exact_match():
+    extractor = make_extractor(fuzzy_match=False)
+    assert extract(extractor, 'new york and nyc, not newyork') == [('new york', 'new york', 1.0), ('new york', 'nyc', 1.0)]
+
+
+def brute_force_search(extractor, text):
+    """
+    Score every fuzzy term against every window, without the n-gram shortlist
+    """
+    text = text.lower()
+    words = [(m.start(), m.end()) for m in WORD_PATTERN.finditer(text)]
+    matches = set()
+    for j, term_idx in enumerate(extractor._fuzzy_terms):
+        term = extractor._terms[term_idx]
+        n_words = extractor._fuzzy_terms_words[j]
+        for size in (n_words-1, n_words, n_words+1):
+            for i in range(len(words)-size+1) if size > 0 else []:
+                start, end = words[i][0], words[i+size-1][1]
+                confidence = fuzz.ratio(text[start:end], term, score_cutoff=extractor.fuzzy_match_threshold)
+                if confidence:
+                    matches.add((term_idx, start, end, confidence))
+    return matches
+
+
+def test_shortlist_finds_the_brute_force_matches():
+    rng = random.Random(7)
+    alphabet = 'abcdefgh'
+    words = [''.join(rng.choice(alphabet) for _ in range(rng.randint(3, 8))) for _ in range(60)]
+    items = [ListEntityItem(' '.join(rng.sample(words, rng.randint(1, 3)))) for _ in range(40)]
+    # Enough candidates to keep every term sharing an n-gram with the window
+    extractor = make_extractor(items, fuzzy_match_max_candidates=len(items), fuzzy_match_min_search_length=1)
+
+    def typo(word):
+        i = rng.randrange(len(word))
+        return word[:i] + rng.choice(alphabet) + word[i+1:]
+
+    for _ in range(100):
+        text = ' '.join(typo(w) if rng.random() < 0.3 else w for w in rng.sample(words, 6))
+        found = set(
+            (term_idx, start, end, confidence)
+            for term_idx, term_matches in extractor._fuzzy_search(text).items()
+            for start, end, confidence in term_matches)
+        assert found == brute_force_search(extractor, text)
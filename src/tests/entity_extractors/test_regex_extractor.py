@@ -0,0 +1,59 @@
+from fastbot.entity_extractors.pipeline import ExtractorPipeline
+from fastbot.entity_extractors.regex_extractor import RegexExtractor, RegexPatternSet
+from fastbot.models import Message
+from fastbot.models.entity import RegexEntityConfig
+import random
+import re
+
+
+def entities(extracted):
+    return [(e.entity, e.start, e.end, e.value) for e in extracted]
+
+
+def separate_scan(patterns, text):
+    return [(key, m.start(), m.end(), m.group()) for key, pattern in patterns for m in re.finditer(pattern, text)]
+
+
+def test_overlapping_patterns_of_different_extractors():
+    extractors = lambda: [
+        RegexExtractor(RegexEntityConfig('phone', [r'\d{3}-\d{4}'])),
+        RegexExtractor(RegexEntityConfig('number', [r'\d+'])),
+        RegexExtractor(RegexEntityConfig('code', [r'(?P<prefix>[A-Z]+)-(?P<number>\d+)'])),
+    ]
+    text = 'call 555-1234 or ABC-42'
+
+    message = Message(text)
+    ExtractorPipeline(extractors()).process(message)
+    expected = entities(message.entities)
+
+    message = Message(text)
+    ExtractorPipeline(extractors(), combine_regex=True).process(message)
+    assert entities(message.entities) == expected
+    assert ('number', 5, 8, '555') in expected
+    assert ('code', 17, 23, {'prefix': 'ABC', 'number': '42', 'text': 'ABC-42'}) in expected
+
+
+def test_combine_patterns_of_one_extractor():
+    config = RegexEntityConfig('date', [r'\d{4}-\d{2}-\d{2}', r'\d{2}-\d{2}', r'(?i)today'])
+    text = 'from 2021-05-06 to 07-08 or Today'
+    separate = RegexExtractor(config).process(Message(text))
+    combined = RegexExtractor(config, combine_patterns=True).process(Message(text))
+    assert entities(combined) == entities(separate)
+    assert ("date", 7, 12, "21-05") in entities(combined)
+
+
+def test_random_patterns_same_as_separate_scans():
+    rng = random.Random(0)
+    atoms = ['a', 'b', 'ab', 'a+', 'b*', '[ab]', 'ba?', r'\d', r'\d+', 'x', '(?:ab)+', 'a|b']
+    for _ in range(300):
+        patterns = [(f'p{i}', ''.join(rng.choice(atoms) for _ in range(rng.randint(1, 3)))) for i in range(rng.randint(1, 5))]
+        text = ''.join(rng.choice('ab1x ') for _ in range(rng.randint(0, 30)))
+        assert list(RegexPatternSet(patterns).finditer(text)) == separate_scan(patterns, text), (patterns, text)
+
+
+def test_pattern_set_not_built_when_pipeline_combines():
+    extractor = RegexExtractor(RegexEntityConfig('number', [r'\d+']), combine_patterns=True)
+    message = Message('1 2')
+    ExtractorPipeline([extractor], combine_regex=True).process(message)
+    assert entities(message.entities) == [('number', 0, 1, '1'), ('number', 2, 3, '2')]
+    assert extractor._pattern_set is None
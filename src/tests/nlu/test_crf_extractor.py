@@ -0,0 +1,139 @@
+from fastbot.nlu.ner.crf import CrfExtractor, FeatureTemplate, FeatureCache
+from fastbot.models.cache import TokenFeatures
+from fastbot.models import Message, NluData, Sample
+import random
+import pytest
+
+
+def old_word2features(sent, i, intent=None):
+    """
+    CrfExtractor._word2features before the feature templates, on the pos_tag dicts of a sentence
+    """
+    word = sent[i]['word']
+    features = {
+        'bias': 1.0,
+        'word.lower': word.lower(),
+        'word.istitle': word.istitle(),
+        'word.isupper': word.isupper(),
+        'pos': sent[i]['pos'],
+        'tag': sent[i]['tag'],
+        'dep': sent[i]['dep'],
+        'like_num': sent[i]['like_num'],
+        'like_email': sent[i]['like_email'],
+        'like_url': sent[i]['like_url'],
+    }
+    for position, j, edge in (('-1', i-1, 'BOS'), ('+1', i+1, 'EOS')):
+        if 0 <= j < len(sent):
+            features.update({
+                f'{position}:word.lower': sent[j]['word'].lower(),
+                f'{position}:word.istitle': sent[j]['word'].istitle(),
+                f'{position}:word.isupper': sent[j]['word'].isupper(),
+                f'{position}:pos': sent[j]['pos'],
+                f'{position}:tag': sent[j]['tag'],
+                f'{position}:dep': sent[j]['dep'],
+                f'{position}:like_num': sent[j]['like_num'],
+                f'{position}:like_email': sent[j]['like_email'],
+                f'{position}:like_url': sent[j]['like_url'],
+            })
+        else:
+            features[edge] = True
+    if intent:
+        features['intent'] = intent
+    return features
+
+
+def random_sentence(rng, length):
+    words = ['Send', 'BOX', 'to', 'bob', '42', 'a@b.co', 'http://x.io', 'Bangkok']
+    sent = []
+    start = 0
+    for _ in range(length):
+        word = rng.choice(words)
+        sent.append({
+            'word': word,
+            'pos': rng.choice(['NOUN', 'VERB', 'NUM']),
+            'tag': rng.choice(['NN', 'VB', 'CD']),
+            'dep': rng.choice(['ROOT', 'dobj', 'nummod']),
+            'lemma': word.lower(),
+            'like_num': word.isdigit(),
+            'like_email': '@' in word,
+            'like_url': word.startswith('http'),
+            'start': start,
+            'end': start+len(word),
+            'ner': rng.choice(['O', 'B-city', 'I-city']),
+        })
+        start += len(word)+1
+    return sent
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_template_same_as_old_word2features(seed):
+    rng = random.Random(seed)
+    sent = random_sentence(rng, rng.randint(1, 6))
+    intent = rng.choice([None, 'greet'])
+    features = FeatureTemplate().features(TokenFeatures.from_pos_tag(sent), intent)
+    assert features == [old_word2features(sent, i, intent) for i in range(len(sent))]
+
+
+def test_feature_cache_lru():
+    cache = FeatureCache(max_size=2)
+    assert cache.get(('a', None)) is None
+    cache.set(('a', None), [{'bias': 1.0}])
+    cache.set(('b', 'greet'), [])
+    assert cache.get(('a', None)) == [{'bias': 1.0}]
+    cache.set(('c', None), [])
+    # b is the least recently used
+    assert cache.get(('b', 'greet')) is None
+    assert cache.get(('c', None)) == []
+    assert cache.stats() == {'size': 2, 'hits': 2, 'misses': 2, 'hit_rate': 0.5}
+
+
+def city_sample(text, city):
+    """
+    Sample `<text> <city>` with the city labelled
+    """
+    words = text.split() + [city]
+    sent = []
+    start = 0
+    for i, word in enumerate(words):
+        sent.append({
+            'word': word, 'pos': 'PROPN' if word == city else 'VERB', 'tag': 'NNP' if word == city else 'VB',
+            'dep': 'pobj' if word == city else 'ROOT', 'lemma': word.lower(),
+            'like_num': False, 'like_email': False, 'like_url': False,
+            'start': start, 'end': start+len(word), 'ner': 'B-city' if word == city else 'O'})
+        start += len(word)+1
+    sample = Sample(' '.join(words))
+    sample.nlu_cache.token_features = TokenFeatures.from_pos_tag(sent)
+    return sample
+
+
+def city_data():
+    return NluData({'travel': [
+        city_sample(text, city)
+        for text in ['fly to', 'go to', 'travel to']
+        for city in ['Bangkok', 'Paris', 'Tokyo']]})
+
+
+def test_train_evaluate_and_process():
+    crf = CrfExtractor(feature_cache_size=100)
+    data = city_data()
+    crf.train(data)
+    assert crf.feature_cache.stats()['misses'] == 9
+    assert crf.evaluate(data)['scores'] == {'acc': 1.0, 'f1': 1.0}
+    assert crf.feature_cache.stats()['hits'] == 9
+
+    messages = []
+    for text in ['fly to Paris', 'go to Tokyo']:
+        message = Message(text)
+        message.intent = 'travel'
+        message.nlu_cache.token_features = city_sample(*text.rsplit(' ', 1)).nlu_cache.token_features
+        messages.append(message)
+    crf.process_batch(messages)
+    assert [[(e.entity, e.value) for e in message.entities] for message in messages] == [[('city', 'Paris')], [('city', 'Tokyo')]]
+
+    # Same entities one message at a time
+    message = Message('fly to Paris')
+    message.intent = 'travel'
+    message.nlu_cache.token_features = messages[0].nlu_cache.token_features
+    crf.process(message)
+    assert [(e.entity, e.value, e.confidence) for e in message.entities] == [
+        (e.entity, e.value, e.confidence) for e in messages[0].entities]
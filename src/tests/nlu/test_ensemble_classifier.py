@@ -0,0 +1,202 @@
+from fastbot.nlu.classifiers import Classifier
+from fastbot.nlu.classifiers.ensemble import EnsembleClassifier
+from fastbot.models import Message, NluData, Sample
+from typing import List
+import numpy as np
+import random
+import pytest
+import time
+import os
+
+
+class FakeClassifier(Classifier):
+    """
+    Always predict `scores` (one per intent), after `delay` seconds
+    """
+
+    def __init__(self, intents: List[str], scores: List[float], delay: float = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.intents = intents
+        self.intent2idx = {intent: idx for idx, intent in enumerate(intents)}
+        self.scores = scores
+        self.delay = delay
+
+    def predict_probs(self, messages: List[Message]) -> np.ndarray:
+        time.sleep(self.delay)
+        return np.tile(np.asarray(self.scores, dtype=float), (len(messages), 1))
+
+    def predict_test_data(self, test_data: NluData):
+        # Labels are indices of the classifier's own intents (0 for an unknown intent),
+        # the prediction is one-hot of the true intent
+        known = np.asarray([intent in self.intent2idx for intent in test_data.all_intents])
+        y_true = np.asarray([self.intent2idx.get(intent, 0) for intent in test_data.all_intents])
+        return y_true, np.eye(len(self.intents))[y_true] * known[:, np.newaxis]
+
+
+def make_ensemble(classifiers, **kwargs):
+    ensemble = EnsembleClassifier(classifiers, 'max', confident_threshold=0.5, ambiguity_threshold=0.1, **kwargs)
+    ensemble._align()
+    return ensemble
+
+
+def test_all_classifiers_timeout():
+    ensemble = make_ensemble([
+        FakeClassifier(['a', 'b'], [0.9, 0.1], delay=0.5, name='slow1'),
+        FakeClassifier(['a', 'b'], [0.8, 0.2], delay=0.5, name='slow2'),
+    ], predict_workers=2, predict_timeout=0.05)
+
+    message = Message('hello')
+    ensemble.process(message)
+    assert message.intents_ranking == []
+    assert message.intent is None
+
+
+def test_timeout_classifier_left_out():
+    ensemble = make_ensemble([
+        FakeClassifier(['a', 'b'], [0.9, 0.1], name='fast'),
+        FakeClassifier(['a', 'b'], [0.1, 0.95], delay=0.5, name='slow'),
+    ], predict_workers=2, predict_timeout=0.05)
+
+    messages = [Message('hello'), Message('world')]
+    ensemble.process_batch(messages)
+    for message in messages:
+        assert message.intent == 'a'
+        assert [intent['classifier'] for intent in message.intents_ranking] == ['fast', 'fast']
+        assert message.nlu_cache.classifiers_output['slow'] == []
+
+
+def test_single_intent_ranking():
+    ensemble = make_ensemble([FakeClassifier(['a'], [0.9], name='only')])
+    message = Message('hello')
+    ensemble.process(message)
+    assert len(message.intents_ranking) == 1
+    assert message.intent == 'a'
+
+    ensemble = make_ensemble([FakeClassifier(['a'], [0.3], name='only')])
+    message = Message('hello')
+    ensemble.process(message)
+    assert message.intent is None
+
+
+def test_max_and_average_strategies():
+    classifiers = [FakeClassifier(['a', 'b'], [0.6, 0.4], name='x'), FakeClassifier(['b', 'c'], [0.9, 0.1], name='y')]
+    ensemble = make_ensemble(classifiers)
+    ranking = ensemble.predict(Message('hello'))
+    assert [(intent['name'], intent['classifier']) for intent in ranking] == [('b', 'y'), ('a', 'x'), ('c', 'y')]
+
+    ensemble = EnsembleClassifier(classifiers, 'average', [0.5, 0.5])
+    ensemble._align()
+    ranking = ensemble.predict(Message('hello'))
+    assert [intent['name'] for intent in ranking] == ['b', 'a', 'c']
+    assert np.isclose(ranking[0]['score'], 0.65)
+
+
+class CountingClassifier(FakeClassifier):
+    """
+    Learn the frequency of each intent in the training data
+    """
+
+    def __init__(self, parallel_train: bool = True, **kwargs):
+        super().__init__([], [], **kwargs)
+        self.parallel_train = parallel_train
+
+    def train(self, data):
+        self._create_label_mapping(data)
+        self.scores = [len(data.intents[intent])/len(data.all_samples) for intent in self.intents]
+        self.trained_in = os.getpid()
+
+
+def test_parallel_train():
+    data = NluData({'a': [Sample('x'), Sample('y'), Sample('z')], 'b': [Sample('w')]})
+    classifiers = [CountingClassifier(name='p1'), CountingClassifier(name='p2'), CountingClassifier(False, name='local')]
+    ensemble = EnsembleClassifier(classifiers, 'max', train_workers=2)
+    ensemble.train(data)
+
+    assert [c.name for c in ensemble.classifiers] == ['p1', 'p2', 'local']
+    for c in ensemble.classifiers:
+        assert c.intents == ['a', 'b']
+        assert c.scores == [0.75, 0.25]
+    assert ensemble.classifiers[0].trained_in != os.getpid()
+    assert ensemble.classifiers[2].trained_in == os.getpid()
+    assert ensemble.predict(Message('hello'))[0]['name'] == 'a'
+
+
+def test_evaluate_maps_labels_to_the_ensemble_intents():
+    data = NluData({'a': [Sample('x')], 'b': [Sample('y'), Sample('z')], 'c': [Sample('w')]})
+    # The last classifier has its intents in another order and does not know `c`
+    ensemble = make_ensemble([
+        FakeClassifier(['a', 'b', 'c'], [], name='x'),
+        FakeClassifier(['b', 'a'], [], name='y'),
+    ])
+    y_true, y_pred = ensemble.predict_test_data(data)
+    assert y_true.tolist() == [0, 1, 1, 2]
+    results = ensemble.evaluate(data)
+    assert results['scores']['acc'] == 1.0
+    assert results['results']['y_true'] == ['a', 'b', 'b', 'c']
+    assert results['misses'] == []
+
+
+class EmptyClassifier(FakeClassifier):
+    """
+    Never has a prediction, as a classifier timing out
+    """
+
+    def predict_probs(self, messages: List[Message]) -> np.ndarray:
+        return np.full((len(messages), len(self.intents)), np.nan)
+
+
+def reference_ranking(ensemble, classifiers_output):
+    """
+    Combination of the classifiers' rankings intent by intent, as before the rankings were stacked
+    """
+    intents = {}
+    for i, (name, ranking) in enumerate(classifiers_output.items()):
+        for intent in ranking:
+            if ensemble.strategy == 'average':
+                intents[intent['name']] = intents.get(intent['name'], 0) + intent['score'] * ensemble.weights[i]
+            elif intent['name'] not in intents or intent['score'] > intents[intent['name']]['score']:
+                intents[intent['name']] = {'score': intent['score'], 'classifier': name}
+    if ensemble.strategy == 'average':
+        ranking = [{'name': intent, 'score': score} for intent, score in intents.items()]
+    else:
+        ranking = [{'name': intent, **detail} for intent, detail in intents.items()]
+    ranking.sort(key=lambda intent: intent['score'], reverse=True)
+    return ranking[:ensemble.ranking_size]
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_same_rankings_as_per_intent_combination(seed):
+    rng = random.Random(seed)
+    all_intents = list('abcdef')
+    classifiers = []
+    for i in range(rng.randint(1, 4)):
+        # Classifiers have their own subset of the intents, in their own order
+        intents = rng.sample(all_intents, rng.randint(1, len(all_intents)))
+        scores = [rng.random() for _ in intents]
+        classifier_class = EmptyClassifier if rng.random() < 0.2 else FakeClassifier
+        classifiers.append(classifier_class(intents, scores, name=f'c{i}'))
+    strategy = rng.choice(['max', 'average'])
+    weights = None
+    if strategy == 'average':
+        weights = [1/len(classifiers)]*len(classifiers)
+    ensemble = EnsembleClassifier(classifiers, strategy, weights, ranking_size=rng.choice([None, 2, 3]))
+    ensemble._align()
+
+    message = Message('hello')
+    ranking = ensemble.predict(message)
+
+    classifiers_output = {}
+    for c in classifiers:
+        own = []
+        if not isinstance(c, EmptyClassifier):
+            own = sorted(({'name': intent, 'score': score} for intent, score in zip(c.intents, c.scores)),
+                         key=lambda intent: intent['score'], reverse=True)[:ensemble.ranking_size]
+        assert message.nlu_cache.classifiers_output[c.name] == own
+        # The combination uses all the scores of the classifiers
+        classifiers_output[c.name] = [{'name': intent, 'score': score} for intent, score in zip(c.intents, c.scores)] if own else []
+
+    expected = reference_ranking(ensemble, classifiers_output)
+    assert [intent['name'] for intent in ranking] == [intent['name'] for intent in expected]
+    assert np.allclose([intent['score'] for intent in ranking], [intent['score'] for intent in expected])
+    if strategy == 'max':
+        assert [intent['classifier'] for intent in ranking] == [intent['classifier'] for intent in expected]
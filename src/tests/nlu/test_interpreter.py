@@ -0,0 +1,50 @@
+from fastbot.nlu.interpreter import Interpreter
+from fastbot.nlu.preprocessors.casing import CasingProcessor
+from fastbot.nlu.tokenizers.word_tokenizer import WordTokenizer
+from fastbot.nlu.vectorizers.tfidf import TfidfVectorizer
+from fastbot.nlu.vectorizers.count import CountVectorizer
+from fastbot.nlu.classifiers.sklearn.kneighbors import KnnClassifier
+from fastbot.models import Message, NluData, Sample
+import numpy as np
+
+
+def make_interpreter(**kwargs):
+    interpreter = Interpreter([
+        CasingProcessor(),
+        WordTokenizer(),
+        TfidfVectorizer(),
+        CountVectorizer(),
+        KnnClassifier(config={'n_neighbors': 3}, confident_threshold=0.4, ambiguity_threshold=0.1),
+    ], **kwargs)
+    interpreter.train(NluData({
+        'greet': [Sample('hello'), Sample('hi there'), Sample('good morning')],
+        'buy': [Sample('I want to buy apples'), Sample('buy two boxes'), Sample('order some milk')],
+        'bye': [Sample('bye bye'), Sample('see you later'), Sample('good night')],
+    }))
+    return interpreter
+
+
+def make_messages():
+    texts = ['Hello there', 'buy milk please', 'see you', 'nothing known', '<bye> override', 'button']
+    messages = [Message(text) for text in texts]
+    # Pre-populated intent (ex: UI button), skipped by the interpreter
+    messages[-1].intent = 'buy'
+    return messages
+
+
+def test_process_batch_same_as_process():
+    interpreter = make_interpreter(override_intent=True)
+    batch = interpreter.process_batch(make_messages())
+    single = [interpreter.process(message) for message in make_messages()]
+
+    assert [m.intent for m in batch] == [m.intent for m in single]
+    assert batch[-1].intent == 'buy' and batch[-1].intents_ranking == []
+    assert batch[-2].intent == 'bye'
+    for b, s in zip(batch, single):
+        assert b.nlu_cache.tokens == s.nlu_cache.tokens
+        if s.nlu_cache.sparse_embedding_vector is None:
+            assert b.nlu_cache.sparse_embedding_vector is None
+        else:
+            assert np.allclose(b.nlu_cache.sparse_embedding_vector.toarray(), s.nlu_cache.sparse_embedding_vector.toarray())
+        assert [i['name'] for i in b.intents_ranking] == [i['name'] for i in s.intents_ranking]
+        assert np.allclose([i['score'] for i in b.intents_ranking], [i['score'] for i in s.intents_ranking])
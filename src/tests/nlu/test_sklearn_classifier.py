@@ -0,0 +1,52 @@
+from fastbot.nlu.classifiers.sklearn.kneighbors import KnnClassifier
+from fastbot.models import Message, NluData, Sample
+from scipy import sparse
+import numpy as np
+
+
+def make_data(dense=True, sparse_features=True):
+    data = NluData({'a': [Sample('x'), Sample('y')], 'b': [Sample('z')]})
+    for i, sample in enumerate(data.all_samples):
+        if dense:
+            # 2 words of 3 dims
+            sample.nlu_cache.dense_embedding_vector = np.full((2, 3), float(i))
+        if sparse_features:
+            sample.nlu_cache.sparse_embedding_vector = sparse.csr_matrix(np.eye(4)[i])
+    return data
+
+
+def test_sparse_rows_stay_csr():
+    classifier = KnnClassifier()
+    X, y = classifier._prepared_data(make_data(), True)
+    assert sparse.isspmatrix_csr(X)
+    assert X.shape == (3, 7)
+    # Mean of the words' embedding followed by the sparse features
+    assert X.toarray()[1].tolist() == [1, 1, 1, 0, 1, 0, 0]
+    assert y == [0, 0, 1]
+
+    X, _ = classifier._prepared_data(make_data(dense=False))
+    assert sparse.isspmatrix_csr(X)
+    assert X.shape == (3, 4)
+
+
+def test_dense_rows_stay_dense():
+    X, _ = KnnClassifier()._prepared_data(make_data(sparse_features=False), True)
+    assert isinstance(X, np.ndarray)
+    assert X.shape == (3, 3)
+
+
+def test_densify_without_sparse_support():
+    classifier = KnnClassifier(accept_sparse=False)
+    X, _ = classifier._prepared_data(make_data(), True)
+    assert isinstance(X, np.ndarray)
+    assert X.tolist() == KnnClassifier()._prepared_data(make_data(), True)[0].toarray().tolist()
+
+
+def test_train_and_predict_on_sparse_features():
+    for accept_sparse in [True, False]:
+        classifier = KnnClassifier(config={'n_neighbors': 1}, accept_sparse=accept_sparse)
+        classifier.train(make_data())
+        message = Message('z')
+        message.nlu_cache.dense_embedding_vector = np.full((2, 3), 2.0)
+        message.nlu_cache.sparse_embedding_vector = sparse.csr_matrix(np.eye(4)[2])
+        assert classifier.predict(message)[0]['name'] == 'b'
@@ -0,0 +1,173 @@
+from fastbot.nlu.spacy import SpacyPipeline, SpacyModelRegistry, model_registry
+from fastbot.nlu.interpreter import Interpreter
+from fastbot.nlu.ner.crf import CrfExtractor
+from fastbot.models.cache import TokenFeatures, vocabulary
+from fastbot.models import Message
+from spacy.language import Language
+import pickle
+import gc
+import pytest
+import spacy
+
+
+@Language.component('fake_tagger')
+def fake_tagger(doc):
+    for token in doc:
+        token.pos_ = 'NUM' if token.like_num else 'NOUN'
+        token.tag_ = 'CD' if token.like_num else 'NN'
+        token.dep_ = 'dep'
+        token.lemma_ = token.lower_
+    return doc
+
+
+def make_pipeline(**kwargs):
+    pipeline = SpacyPipeline(language_model='blank', pos_tagging=True, **kwargs)
+    nlp = spacy.blank('en')
+    nlp.add_pipe('fake_tagger')
+    pipeline.model = nlp
+    return pipeline
+
+
+def process(pipeline, text):
+    message = Message(text)
+    pipeline.process(message)
+    return message.nlu_cache.token_features
+
+
+def test_token_features():
+    features = process(make_pipeline(), 'I Want 2 Apples')
+    assert features.words == ['I', 'Want', '2', 'Apples']
+    assert features.strings('pos') == ['NOUN', 'NOUN', 'NUM', 'NOUN']
+    assert features.strings('tag') == ['NN', 'NN', 'CD', 'NN']
+    assert features.strings('dep') == ['dep']*4
+    assert features.strings('lemma') == ['i', 'want', '2', 'apples']
+    assert [(token['word'], token['start'], token['end'], token['like_num']) for token in features.to_pos_tag()] == [
+        ('I', 0, 1, False), ('Want', 2, 6, False), ('2', 7, 8, True), ('Apples', 9, 15, False)]
+
+
+def test_only_needed_features_are_read():
+    features = process(make_pipeline(token_features=['pos']), 'I want apples')
+    assert features.strings('pos') == ['NOUN']*3
+    assert features.strings('tag') == ['']*3
+    assert features.strings('dep') == ['']*3
+    assert features.strings('lemma') == ['']*3
+
+
+def test_lemmas_are_not_interned():
+    pipeline = make_pipeline()
+    process(pipeline, 'warm up')
+    size = len(vocabulary.strings)
+    for i in range(200):
+        features = process(pipeline, f'unseenword{i} another{i}')
+        assert features.strings('lemma') == [f'unseenword{i}', f'another{i}']
+    assert len(vocabulary.strings) == size
+
+
+def test_pickle_token_features():
+    features = process(make_pipeline(), 'I want 2 apples')
+    restored = pickle.loads(pickle.dumps(features))
+    assert restored.to_pos_tag() == features.to_pos_tag()
+    assert TokenFeatures.from_pos_tag(features.to_pos_tag()).to_pos_tag() == features.to_pos_tag()
+
+
+def test_process_batch_same_as_process():
+    pipeline = make_pipeline(named_entities=True, batch_size=2)
+    texts = ['I want 2 apples', 'hello', '', 'Send 3 Boxes to Bob', 'ok then']
+    messages = [Message(text) for text in texts]
+    pipeline.process_batch(messages)
+    for text, message in zip(texts, messages):
+        features = process(pipeline, text)
+        assert message.nlu_cache.tokens == features.words
+        assert message.nlu_cache.token_features.to_pos_tag() == features.to_pos_tag()
+
+
+def test_worker_processes_only_for_several_batches():
+    pipeline = make_pipeline(batch_size=4, n_process=2)
+    calls = []
+    pipe = pipeline.model.pipe
+
+    def _pipe(texts, **kwargs):
+        calls.append(kwargs['n_process'])
+        return pipe(texts, batch_size=kwargs['batch_size'])
+    pipeline.model.pipe = _pipe
+    pipeline.process_batch([Message('hello') for _ in range(4)])
+    pipeline.process_batch([Message('hello') for _ in range(5)])
+    assert calls == [1, 2]
+
+    with pytest.raises(AssertionError):
+        SpacyPipeline(n_process=0)
+
+
+def test_crf_dependent_excludes_unused_pipes():
+    spacy_pipeline = SpacyPipeline(language_model='blank', tokenization=True)
+    Interpreter([spacy_pipeline, CrfExtractor()])
+    assert spacy_pipeline.pos_tagging
+    assert spacy_pipeline.needed_features() == ['dep', 'pos', 'tag']
+    excluded = spacy_pipeline.excluded_pipes()
+    for pipe in ['lemmatizer', 'trainable_lemmatizer', 'ner', 'entity_ruler', 'span_ruler', 'senter']:
+        assert pipe in excluded
+    for pipe in ['tok2vec', 'tagger', 'attribute_ruler', 'parser']:
+        assert pipe not in excluded
+
+    # A template with lemmas keeps the lemmatizer
+    spacy_pipeline = SpacyPipeline(language_model='blank', tokenization=True)
+    Interpreter([spacy_pipeline, CrfExtractor(word_features=['word.lower', 'lemma'])])
+    assert spacy_pipeline.needed_features() == ['lemma']
+    assert 'lemmatizer' not in spacy_pipeline.excluded_pipes()
+    assert 'parser' in spacy_pipeline.excluded_pipes()
+
+
+def test_model_is_reloaded_for_a_new_dependent():
+    spacy_pipeline = SpacyPipeline(language_model='blank-reload', tokenization=True)
+    spacy_pipeline.load_model = lambda: spacy.blank('en')
+    first = spacy_pipeline.model
+    # Tokenization only, every known pipe is excluded
+    assert 'parser' in spacy_pipeline._model_key[1]
+    spacy_pipeline.add_dependent(CrfExtractor())
+    assert spacy_pipeline._model is None
+    assert spacy_pipeline.model is not first
+    assert 'parser' not in spacy_pipeline._model_key[1]
+    spacy_pipeline.release_model()
+
+
+def test_pipelines_with_the_same_key_share_the_model():
+    loads = []
+
+    def make(**kwargs):
+        spacy_pipeline = SpacyPipeline(language_model='blank-shared', **kwargs)
+        spacy_pipeline.load_model = lambda: loads.append(spacy_pipeline) or spacy.blank('en')
+        return spacy_pipeline
+    first, second = make(tokenization=True), make(tokenization=True)
+    assert first.model is second.model
+    assert len(loads) == 1
+    # Other pipes, other model
+    other = make(named_entities=True)
+    assert other.model is not first.model
+    assert len(loads) == 2
+    for spacy_pipeline in [first, second, other]:
+        spacy_pipeline.release_model()
+    assert not any(key.startswith('blank-shared') for key in model_registry.stats())
+
+
+def test_release_drops_the_last_reference():
+    registry = SpacyModelRegistry()
+    key = ('model', ('ner',))
+    model = registry.acquire(key, lambda: spacy.blank('en'))
+    assert registry.acquire(key, lambda: None) is model
+    assert registry.stats() == {'model ner': 2}
+    registry.release(key)
+    assert registry.stats() == {'model ner': 1}
+    registry.release(key)
+    assert registry.stats() == {}
+    # Loaded again by the next acquire
+    assert registry.acquire(key, lambda: spacy.blank('en')) is not model
+
+
+def test_garbage_collected_pipeline_releases_the_model():
+    spacy_pipeline = SpacyPipeline(language_model='blank-gc', tokenization=True)
+    spacy_pipeline.load_model = lambda: spacy.blank('en')
+    spacy_pipeline.model
+    assert any(key.startswith('blank-gc') for key in model_registry.stats())
+    del spacy_pipeline
+    gc.collect()
+    assert not any(key.startswith('blank-gc') for key in model_registry.stats())
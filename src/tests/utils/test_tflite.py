@@ -0,0 +1,106 @@
+from fastbot.utils import tflite
+from fastbot.utils.tflite import TFLiteSession, TFLiteSessionPool
+from types import SimpleNamespace
+import numpy as np
+import threading
+import pytest
+
+
+class StubInterpreter:
+    """
+    tflite Interpreter of a model returning the sum of each input row, records the calls
+    """
+    instances = []
+
+    def __init__(self, model_path, num_threads=None):
+        self.model_path = model_path
+        self.shape = [1, 3]
+        self.allocations = 0
+        self.resizes = []
+        self.input = None
+        self.output = None
+        StubInterpreter.instances.append(self)
+
+    def allocate_tensors(self):
+        self.allocations += 1
+
+    def get_input_details(self):
+        return [{'index': 0, 'shape': np.array(self.shape), 'dtype': np.float32}]
+
+    def get_output_details(self):
+        return [{'index': 1}]
+
+    def resize_tensor_input(self, index, shape):
+        assert index == 0
+        self.resizes.append(list(shape))
+        self.shape = list(shape)
+
+    def set_tensor(self, index, value):
+        assert index == 0
+        assert list(value.shape) == self.shape, 'input does not match the allocated tensor'
+        assert value.dtype == np.float32
+        self.input = value
+
+    def invoke(self):
+        self.output = self.input.sum(axis=1, keepdims=True)
+
+    def get_tensor(self, index):
+        assert index == 1
+        return self.output.copy()
+
+
+@pytest.fixture(autouse=True)
+def stub_tflite(monkeypatch):
+    StubInterpreter.instances = []
+    monkeypatch.setattr(tflite, 'import_tflite', lambda: SimpleNamespace(Interpreter=StubInterpreter))
+
+
+def test_session_is_allocated_once():
+    session = TFLiteSession('model.tflite')
+    interpreter = session.interpreter
+    assert interpreter.allocations == 1
+    for _ in range(3):
+        assert session.predict([[1, 2, 3]]).tolist() == [[6]]
+    assert interpreter.allocations == 1
+    assert interpreter.resizes == []
+
+
+def test_session_is_resized_when_the_batch_size_changes():
+    session = TFLiteSession('model.tflite')
+    interpreter = session.interpreter
+    assert session.predict(np.ones((4, 3))).tolist() == [[3]]*4
+    assert session.predict(np.ones((4, 3))).tolist() == [[3]]*4
+    assert interpreter.resizes == [[4, 3]]
+    assert session.predict([[1, 1, 1]]).tolist() == [[3]]
+    assert interpreter.resizes == [[4, 3], [1, 3]]
+    assert interpreter.allocations == 3
+
+
+def test_pool_sessions_are_returned():
+    pool = TFLiteSessionPool('model.tflite', pool_size=2)
+    assert len(StubInterpreter.instances) == 2
+    for _ in range(5):
+        assert pool.predict([[1, 2, 3]]).tolist() == [[6]]
+    assert pool._sessions.qsize() == 2
+
+    # A failed inference gives its session back
+    with pytest.raises(AssertionError):
+        pool.predict(np.ones((2, 4)))
+    assert pool._sessions.qsize() == 2
+
+
+def test_pool_checkout_is_exclusive():
+    pool = TFLiteSessionPool('model.tflite', pool_size=1)
+    session = pool._sessions.get()
+    results = []
+    thread = threading.Thread(target=lambda: results.append(pool.predict([[1, 1, 1]])))
+    thread.start()
+    thread.join(0.1)
+    # The only session is checked out, the inference waits for it
+    assert thread.is_alive()
+    pool._sessions.put(session)
+    thread.join(5)
+    assert [r.tolist() for r in results] == [[[3]]]
+
+    with pytest.raises(AssertionError):
+        TFLiteSessionPool('model.tflite', pool_size=0)